@@ -1,18 +1,66 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+import json
+import math
+import sys
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, stream_with_context
 from functools import wraps
-from config import get_database_url, get_secret_key, db, init_app_db
+from config import get_auto_migrate, get_database_url, get_preload_model, get_secret_key, get_tile_cache_dir, db, init_app_db
 from models import Field, Crop, CropHistory, User
-from neural_network_recommender import recommender
-from calculator_api import calculate_profit_with_rotation
+from calculator_api import (
+    calculate_profit_with_rotation, calculate_profit_matrix, get_seed_rate,
+    simulate_profit_distribution, DEFAULT_SIMULATION_DRAWS, SIMULATION_PERCENTILES
+)
 from utils import seed_initial_crops
-from price_updater import update_all_crop_prices, get_price_update_status
+from price_updater import get_price_update_status
+from price_scheduler import run_price_update, start_price_scheduler
+from price_providers import get_provider_metrics
+from price_history import get_average_prices, get_price_history, DEFAULT_BUCKET
+from rotation_planner import plan_field_rotation, MAX_PLAN_YEARS
+from farm_planner import plan_farm, DEFAULT_TIME_LIMIT
+from spatial_index import filter_fields_by_bbox, parse_bbox
+from history_import import HISTORY_BATCH_SIZE, HISTORY_FORMATS, import_crop_history, iter_history_records
+from field_io import (
+    CONTENT_TYPE_FORMATS, EXPORT_FORMATS, IMPORT_BATCH_SIZE, IMPORT_FORMATS,
+    export_fields, import_fields, iter_field_features
+)
+from migrations import run_migrations
+from tiles import TileCache, build_fields_tile, encode_tile, is_valid_tile, union_bounds
+from response_cache import response_cache
+from model_retraining import ModelRetrainer
 from datetime import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-import atexit
 
 app = Flask(__name__)
 
+# Максимальный размер страницы истории посевов при keyset-пагинации
+CROP_HISTORY_MAX_PAGE_SIZE = 1000
+
+# Кэш тайлов границ полей на диске
+field_tile_cache = TileCache(get_tile_cache_dir())
+
+
+def get_recommender():
+    """Рекомендательная модель. pandas и scikit-learn импортируются при первом обращении,
+    модель загружается (или обучается) при первом запросе рекомендаций"""
+    from neural_network_recommender import recommender
+    model_retrainer.sync()
+    return recommender
+
+
+def schedule_model_retrain():
+    """Проверка необходимости переобучения после изменения истории (в процессе, где модель уже загружена)"""
+    if 'neural_network_recommender' in sys.modules:
+        model_retrainer.start()
+
+
+def invalidate_field_recommendations(field_id=None):
+    """Сброс кэша рекомендаций поля (None - всех полей); ML-стек для этого не импортируется"""
+    module = sys.modules.get('neural_network_recommender')
+    if module is None:
+        return
+    if field_id is None:
+        module.recommender.recommendation_cache.clear()
+    else:
+        module.recommender.recommendation_cache.invalidate_field(field_id)
+
 
 def login_required(f):
     """Декоратор для проверки авторизации пользователя"""
@@ -40,99 +88,27 @@ app.config['SECRET_KEY'] = get_secret_key()
 # Инициализация базы данных
 init_app_db(app)
 
-# Автоматическое создание таблиц при запуске
-with app.app_context():
-    try:
-        db.create_all()
-        db.create_all(bind_key='users')
-        print("Таблицы базы данных успешно созданы")
-        
-        # Миграция: добавление колонки last_price_update, если её нет
-        try:
-            from sqlalchemy import inspect, text
-            inspector = inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('crops')]
-            
-            if 'last_price_update' not in columns:
-                print("Добавление колонки last_price_update в таблицу crops...")
-                with db.engine.connect() as conn:
-                    conn.execute(text("ALTER TABLE crops ADD COLUMN last_price_update DATETIME"))
-                    conn.commit()
-                print("Колонка last_price_update успешно добавлена")
-                
-                # Устанавливаем старую дату (25 часов назад) для существующих записей
-                # Это позволит системе сразу обновить цены при первом запуске
-                with db.engine.connect() as conn:
-                    # Обновляем все записи, у которых дата NULL или очень свежая (вероятно, из предыдущей миграции)
-                    conn.execute(text("""
-                        UPDATE crops 
-                        SET last_price_update = datetime('now', '-25 hours') 
-                        WHERE last_price_update IS NULL 
-                           OR datetime(last_price_update) > datetime('now', '-1 hour')
-                    """))
-                    conn.commit()
-                print("Установлена дата обновления для существующих записей (25 часов назад для немедленного обновления)")
-        except Exception as migration_error:
-            print(f"Предупреждение при миграции: {migration_error}")
-            
-    except Exception as e:
-        print(f"Предупреждение при создании таблиц: {e}")
+# Без общей базы кэша ответов инвалидация не доходит до других воркеров
+if response_cache.scope_warning():
+    print(f"[КЭШ] {response_cache.scope_warning()}")
 
-# Настройка планировщика для автоматического обновления цен
-scheduler = BackgroundScheduler()
-scheduler.start()
+# Фоновое переобучение рекомендательной модели на истории посевов
+model_retrainer = ModelRetrainer(app)
 
-def scheduled_price_update():
-    """Функция для автоматического обновления цен каждые 24 часа"""
+# Схема базы данных. В режиме быстрого запуска (AUTO_MIGRATE=0) миграции выполняются
+# отдельным шагом перед запуском воркеров: python utils.py migrate
+if get_auto_migrate():
     with app.app_context():
-        try:
-            print("\n[ПЛАНИРОВЩИК] Запуск автоматического обновления цен...")
-            update_all_crop_prices(force=False)
-            print("[ПЛАНИРОВЩИК] Обновление цен завершено\n")
-        except Exception as e:
-            print(f"[ПЛАНИРОВЩИК] Ошибка при обновлении цен: {e}\n")
-
-# Планируем обновление цен каждые 24 часа
-scheduler.add_job(
-    func=scheduled_price_update,
-    trigger=IntervalTrigger(hours=24),
-    id='update_crop_prices',
-    name='Обновление цен на культуры каждые 24 часа',
-    replace_existing=True
-)
+        run_migrations()
 
-# Выполняем первое обновление при запуске
-# Проверяем, нужно ли принудительное обновление (если все даты одинаковые - значит была миграция)
-with app.app_context():
-    try:
-        from models import Crop
-        from datetime import timedelta
-        
-        # Проверяем, есть ли культуры, которые никогда не обновлялись или обновлялись недавно
-        crops = Crop.query.all()
-        need_force_update = False
-        
-        if crops:
-            # Если все культуры имеют одинаковую дату обновления (вероятно, из миграции)
-            # или если прошло менее 24 часов - делаем принудительное обновление
-            first_update = crops[0].last_price_update if crops[0].last_price_update else None
-            if first_update:
-                time_since = datetime.utcnow() - first_update
-                if time_since < timedelta(hours=24):
-                    # Все культуры обновлены недавно - вероятно, это результат миграции
-                    # Делаем принудительное обновление при первом запуске
-                    need_force_update = True
-                    print("\n[ИНИЦИАЛИЗАЦИЯ] Обнаружены недавно обновленные культуры (миграция).")
-                    print("[ИНИЦИАЛИЗАЦИЯ] Выполняется принудительное обновление цен...")
-        
-        print("\n[ИНИЦИАЛИЗАЦИЯ] Первичное обновление цен...")
-        update_all_crop_prices(force=need_force_update)
-        print("[ИНИЦИАЛИЗАЦИЯ] Первичное обновление завершено\n")
-    except Exception as e:
-        print(f"[ИНИЦИАЛИЗАЦИЯ] Ошибка при первичном обновлении цен: {e}\n")
+# Модель рекомендаций до fork воркеров (PRELOAD_MODEL=1 и gunicorn --preload): неизменяемый
+# снимок модели загружается один раз и разделяется воркерами copy-on-write
+if get_preload_model():
+    get_recommender().preload()
 
-# Остановка планировщика при выходе из приложения
-atexit.register(lambda: scheduler.shutdown())
+# Планировщик цен: работает только в одном процессе (лидер по файловой блокировке),
+# первичное обновление выполняется в фоне и не задерживает запуск
+price_scheduler = start_price_scheduler(app)
 
 # Маршруты
 @app.route('/')
@@ -249,9 +225,48 @@ def logout():
 
 @app.route('/api/fields', methods=['GET'])
 @api_login_required
+@response_cache.cached('fields')
 def get_fields():
-    fields = Field.query.all()
-    return jsonify([field.to_dict() for field in fields])
+    # ?bbox=minLon,minLat,maxLon,maxLat - только поля, пересекающие область карты
+    # ?zoom=<z> или ?tolerance=<градусы> - упрощенные геометрии, ?encoding=polyline - компактные
+    bbox = request.args.get('bbox')
+    zoom = request.args.get('zoom', type=float)
+    tolerance = request.args.get('tolerance', type=float)
+    encoding = request.args.get('encoding')
+    include_geometry = request.args.get('include_geometry', '1') not in ('0', 'false')
+    try:
+        bbox = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if encoding not in (None, 'geojson', 'polyline'):
+        return jsonify({'error': 'Неизвестная кодировка геометрии'}), 400
+    if tolerance is not None and tolerance < 0:
+        return jsonify({'error': 'Допуск упрощения не может быть отрицательным'}), 400
+    
+    fields = filter_fields_by_bbox(Field.query, db.engine, bbox).all()
+    return jsonify([
+        field.to_dict(zoom=zoom, tolerance=tolerance, encoding=encoding, include_geometry=include_geometry)
+        for field in fields
+    ])
+
+
+@app.route('/tiles/fields/<int:z>/<int:x>/<int:y>.geojson', methods=['GET'])
+@api_login_required
+def get_fields_tile(z, x, y):
+    # Тайл границ полей: обрезанные и упрощенные полигоны, кэшируются на диске
+    if not is_valid_tile(z, x, y):
+        return jsonify({'error': 'Некорректные координаты тайла'}), 400
+    
+    data = field_tile_cache.get(z, x, y)
+    if data is None:
+        # Поколение кэша - до чтения полей: тайл по данным до изменения поля не сохранится
+        generation = field_tile_cache.generation()
+        data = encode_tile(build_fields_tile(Field.query, db.engine, z, x, y))
+        field_tile_cache.put(z, x, y, data, generation)
+    
+    response = app.response_class(data, mimetype='application/geo+json')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/api/fields', methods=['POST'])
@@ -259,13 +274,13 @@ def get_fields():
 def create_field():
     data = request.json
     try:
-        field = Field(
-            name=data['name'],
-            geometry=data['geometry'],
-            area=data.get('area', 0)
-        )
+        field = Field(name=data['name'])
+        # Площадь, центроид и bbox вычисляются на сервере, площадь от клиента не используется
+        field.set_geometry(data['geometry'])
         db.session.add(field)
         db.session.commit()
+        field_tile_cache.invalidate_bounds(field.bbox)
+        response_cache.invalidate('fields')
         return jsonify(field.to_dict()), 201
     except Exception as e:
         db.session.rollback()
@@ -277,27 +292,91 @@ def create_field():
 def update_field(field_id):
     field = Field.query.get_or_404(field_id)
     data = request.json
+    old_bbox = field.bbox
     try:
         if 'name' in data:
             field.name = data['name']
         if 'geometry' in data:
-            field.geometry = data['geometry']
-        if 'area' in data:
-            field.area = data['area']
+            field.set_geometry(data['geometry'])
         db.session.commit()
+        # Название тоже есть в свойствах тайла, поэтому сбрасываем тайлы и по старому, и по новому bbox
+        field_tile_cache.invalidate_bounds(old_bbox)
+        field_tile_cache.invalidate_bounds(field.bbox)
+        response_cache.invalidate('fields')
+        invalidate_field_recommendations(field_id)
         return jsonify(field.to_dict())
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
 
 
+@app.route('/api/fields/import', methods=['POST'])
+@api_login_required
+def import_fields_stream():
+    # Массовый импорт: тело запроса - GeoJSON FeatureCollection, NDJSON (объект Feature в строке)
+    # или CSV с колонками name и geometry. Формат - ?format= или по Content-Type.
+    # Ответ - NDJSON с отчетом после каждого пакета, последняя строка содержит done: true
+    fmt = request.args.get('format') or CONTENT_TYPE_FORMATS.get(request.mimetype, 'geojson')
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'error': f"Формат импорта: {', '.join(IMPORT_FORMATS)}"}), 400
+    batch_size = request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int)
+    if batch_size < 1:
+        return jsonify({'error': 'Размер пакета должен быть положительным'}), 400
+
+    # Тайлы сбрасываются один раз по общему bbox импортированных полей, а не по каждому полю
+    imported = {'bounds': None}
+
+    def on_commit(rows):
+        for row in rows:
+            imported['bounds'] = union_bounds(
+                imported['bounds'],
+                (row['bbox_min_lon'], row['bbox_min_lat'], row['bbox_max_lon'], row['bbox_max_lat'])
+            )
+        response_cache.invalidate('fields')
+
+    def generate():
+        features = iter_field_features(request.stream, fmt)
+        try:
+            for progress in import_fields(features, batch_size, on_commit):
+                yield json.dumps(progress, ensure_ascii=False) + '\n'
+        finally:
+            if imported['bounds'] is not None:
+                field_tile_cache.invalidate_bounds(imported['bounds'])
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/fields/export', methods=['GET'])
+@api_login_required
+def export_fields_stream():
+    # Потоковая выгрузка полей: ?format=geojson|ndjson, ?bbox=minLon,minLat,maxLon,maxLat
+    fmt = request.args.get('format', 'geojson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"Формат выгрузки: {', '.join(EXPORT_FORMATS)}"}), 400
+    bbox = request.args.get('bbox')
+    try:
+        bbox = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/geo+json'
+    response = app.response_class(stream_with_context(export_fields(fmt, bbox)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=fields.{fmt}'
+    return response
+
+
 @app.route('/api/fields/<int:field_id>', methods=['DELETE'])
 @api_login_required
 def delete_field(field_id):
     field = Field.query.get_or_404(field_id)
+    old_bbox = field.bbox
     try:
         db.session.delete(field)
         db.session.commit()
+        field_tile_cache.invalidate_bounds(old_bbox)
+        # Вместе с полем удаляется его история посевов
+        response_cache.invalidate('fields', 'crop_history')
+        invalidate_field_recommendations(field_id)
         return jsonify({'message': 'Поле удалено'}), 200
     except Exception as e:
         db.session.rollback()
@@ -306,6 +385,7 @@ def delete_field(field_id):
 
 @app.route('/api/crops', methods=['GET'])
 @api_login_required
+@response_cache.cached('crops')
 def get_crops():
     crops = Crop.query.all()
     return jsonify([crop.to_dict() for crop in crops])
@@ -313,13 +393,29 @@ def get_crops():
 
 @app.route('/api/crop-history', methods=['GET'])
 @api_login_required
+@response_cache.cached('crop_history', 'fields', 'crops')
 def get_crop_history():
+    # Один запрос с JOIN вместо ленивой загрузки поля и культуры для каждой строки
     field_id = request.args.get('field_id', type=int)
-    query = CropHistory.query
-    if field_id:
-        query = query.filter_by(field_id=field_id)
-    history = query.order_by(CropHistory.year.desc(), CropHistory.id.desc()).all()
-    return jsonify([h.to_dict() for h in history])
+    after_year = request.args.get('after_year', type=int)
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    # Ключ страницы - только пара целых чисел; иначе вместо следующей страницы вернулась бы первая
+    if ('after_year' in request.args or 'after_id' in request.args) and (after_year is None or after_id is None):
+        return jsonify({'error': 'Ключ страницы задается парой целых чисел after_year и after_id'}), 400
+    
+    query = CropHistory.listing_query(field_id=field_id, after_year=after_year, after_id=after_id)
+    if limit:
+        limit = min(max(limit, 1), CROP_HISTORY_MAX_PAGE_SIZE)
+        query = query.limit(limit)
+    history = [CropHistory.listing_row_to_dict(row) for row in query]
+    
+    response = jsonify(history)
+    # Ключ для следующей страницы: ?after_year=&after_id=
+    if limit and len(history) == limit:
+        response.headers['X-Next-After-Year'] = str(history[-1]['year'])
+        response.headers['X-Next-After-Id'] = str(history[-1]['id'])
+    return response
 
 
 @app.route('/api/crop-history', methods=['POST'])
@@ -336,12 +432,41 @@ def create_crop_history():
         )
         db.session.add(history)
         db.session.commit()
+        response_cache.invalidate('crop_history')
+        invalidate_field_recommendations(history.field_id)
+        schedule_model_retrain()
         return jsonify(history.to_dict()), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
 
 
+@app.route('/api/crop-history/import', methods=['POST'])
+@api_login_required
+def import_crop_history_stream():
+    # Массовая загрузка истории: CSV (field_name, crop_name, year, season, notes) или NDJSON,
+    # вместо названий можно указать field_id и crop_id. Записи с тем же (поле, год, сезон) обновляются.
+    # Ответ - NDJSON с отчетом после каждого пакета, последняя строка содержит done: true
+    fmt = request.args.get('format') or ('ndjson' if request.mimetype == 'application/x-ndjson' else 'csv')
+    if fmt not in HISTORY_FORMATS:
+        return jsonify({'error': f"Формат истории посевов: {', '.join(HISTORY_FORMATS)}"}), 400
+    batch_size = request.args.get('batch_size', HISTORY_BATCH_SIZE, type=int)
+    if batch_size < 1:
+        return jsonify({'error': 'Размер пакета должен быть положительным'}), 400
+
+    def on_commit(field_ids):
+        response_cache.invalidate('crop_history')
+        invalidate_field_recommendations()
+
+    def generate():
+        records = iter_history_records(request.stream, fmt)
+        for progress in import_crop_history(records, batch_size, on_commit):
+            yield json.dumps(progress, ensure_ascii=False) + '\n'
+        schedule_model_retrain()
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @app.route('/api/crop-history/<int:history_id>', methods=['DELETE'])
 @api_login_required
 def delete_crop_history(history_id):
@@ -349,6 +474,9 @@ def delete_crop_history(history_id):
     try:
         db.session.delete(history)
         db.session.commit()
+        response_cache.invalidate('crop_history')
+        invalidate_field_recommendations(history.field_id)
+        schedule_model_retrain()
         return jsonify({'message': 'Запись удалена'}), 200
     except Exception as e:
         db.session.rollback()
@@ -367,16 +495,18 @@ def get_field_recommendation():
     try:
         field = Field.query.get_or_404(field_id) # берём поле
         
-        history = CropHistory.query.filter_by(field_id=field_id).order_by( #Смотрим историю посева
-            CropHistory.year.desc()
-        ).all()
-        
-        crop_history = [h.to_dict() for h in history] # история для нейронки
+        crop_history = [ # история для нейронки (один запрос с JOIN)
+            CropHistory.listing_row_to_dict(row)
+            for row in CropHistory.listing_query(field_id=field_id)
+        ]
         
-        recommendation = recommender.generate_field_recommendation( # генерация
+        recommendation = get_recommender().generate_field_recommendation( # генерация
             field_name=field.name,
             field_geometry=field.geometry,
-            crop_history=crop_history
+            crop_history=crop_history,
+            center=field.centroid,
+            field_id=field.id,
+            history_id=crop_history[0]['id'] if crop_history else None
         )
         
         return jsonify(recommendation)
@@ -384,6 +514,133 @@ def get_field_recommendation():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/field-recommendations', methods=['GET'])
+@api_login_required
+def get_field_recommendations():
+    # Рекомендации для всех полей за один запрос: два запроса к БД и один predict_proba
+    try:
+        fields = Field.query.order_by(Field.id).all()
+        
+        history_rows = db.session.query(CropHistory.field_id, CropHistory.id, Crop.name).join(
+            Crop, CropHistory.crop_id == Crop.id
+        ).order_by(CropHistory.field_id, CropHistory.year.desc(), CropHistory.id.desc()).all()
+        
+        histories = {}
+        for field_id, history_id, crop_name in history_rows:
+            histories.setdefault(field_id, []).append({'id': history_id, 'crop_name': crop_name})
+        
+        recommendations = get_recommender().generate_field_recommendations_batch([
+            {
+                'field_name': field.name,
+                'field_geometry': field.geometry,
+                'crop_history': histories.get(field.id, []),
+                'center': field.centroid,
+                'field_id': field.id,
+                'history_id': histories[field.id][0]['id'] if field.id in histories else None
+            }
+            for field in fields
+        ])
+        
+        return jsonify([
+            dict(recommendation, field_id=field.id)
+            for field, recommendation in zip(fields, recommendations)
+        ])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/fields/<int:field_id>/rotation-plan', methods=['GET'])
+@api_login_required
+def get_field_rotation_plan(field_id):
+    # План севооборота на несколько лет с максимальной суммарной прибылью
+    field = Field.query.get_or_404(field_id)
+    years = request.args.get('years', 5, type=int)
+    if years < 1 or years > MAX_PLAN_YEARS:
+        return jsonify({'error': f'Горизонт планирования должен быть от 1 до {MAX_PLAN_YEARS} лет'}), 400
+    
+    last_history = CropHistory.query.filter_by(field_id=field_id).order_by(
+        CropHistory.year.desc(), CropHistory.id.desc()
+    ).first()
+    crops = Crop.query.order_by(Crop.id).all()
+    start_year = last_history.year + 1 if last_history else datetime.now().year
+    
+    try:
+        plan = plan_field_rotation(
+            crops=crops,
+            area=field.area or 1.0,
+            years=years,
+            last_crop=last_history.crop if last_history else None,
+            start_year=start_year
+        )
+        plan['field_id'] = field.id
+        plan['field_name'] = field.name
+        return jsonify(plan)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+def parse_crop_limits(value):
+    """Ограничения по культурам из тела запроса: {название культуры: число}"""
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise TypeError("Ограничения по культурам должны быть объектом")
+    limits = {name: float(limit) for name, limit in value.items()}
+    if not all(math.isfinite(limit) for limit in limits.values()):
+        raise ValueError("Ограничения по культурам должны быть конечными числами")
+    return limits
+
+
+@app.route('/api/farm/rotation-plan', methods=['POST'])
+@api_login_required
+def get_farm_rotation_plan():
+    # Распределение культур по всем полям хозяйства на следующий сезон с учетом
+    # контрактных объемов, ограничений площади по культурам и бюджета на семена
+    data = request.json or {}
+    field_ids = data.get('field_ids')
+    try:
+        min_tonnage = parse_crop_limits(data.get('min_tonnage'))
+        max_area = parse_crop_limits(data.get('max_area'))
+        seed_budget = data.get('seed_budget')
+        seed_budget = float(seed_budget) if seed_budget is not None else None
+        time_limit = float(data.get('time_limit', DEFAULT_TIME_LIMIT))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректные параметры планирования'}), 400
+    if not 0 < time_limit < float('inf'):
+        return jsonify({'error': 'Ограничение времени должно быть положительным'}), 400
+    
+    query = Field.query
+    if field_ids:
+        query = query.filter(Field.id.in_(field_ids))
+    fields = query.order_by(Field.id).all()
+    if not fields:
+        return jsonify({'error': 'Нет полей для планирования'}), 400
+    
+    # Последняя культура каждого поля одним запросом
+    row_number = db.func.row_number().over(
+        partition_by=CropHistory.field_id,
+        order_by=(CropHistory.year.desc(), CropHistory.id.desc())
+    ).label('rn')
+    latest = db.session.query(CropHistory.field_id, CropHistory.crop_id, row_number).subquery()
+    last_crop_ids = dict(db.session.query(latest.c.field_id, latest.c.crop_id).filter(latest.c.rn == 1).all())
+    crops = Crop.query.order_by(Crop.id).all()
+    crops_by_id = {crop.id: crop for crop in crops}
+    
+    try:
+        plan = plan_farm(
+            fields=fields,
+            last_crops=[crops_by_id.get(last_crop_ids.get(field.id)) for field in fields],
+            crops=crops,
+            min_tonnage=min_tonnage,
+            max_area=max_area,
+            seed_budget=seed_budget,
+            time_limit=time_limit
+        )
+        return jsonify(plan)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
 @app.route('/api/calculate', methods=['POST'])
 @api_login_required
 def calculate_economics():
@@ -425,30 +682,182 @@ def calculate_economics():
         return jsonify({'error': f'Ошибка расчета: {str(e)}'}), 500
 
 
+@app.route('/api/calculate/matrix', methods=['POST'])
+@api_login_required
+def calculate_economics_matrix():
+    # Экономика всех культур × всех предшественников × списка площадей одним запросом
+    data = request.json or {}
+    areas = data.get('areas') or ([data['area']] if data.get('area') else [])
+    crop_ids = data.get('crop_ids')
+    previous_crop_names = data.get('previous_crops')
+    
+    try:
+        areas = [float(area) for area in areas]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректные площади'}), 400
+    if not areas or any(area <= 0 for area in areas):
+        return jsonify({'error': 'Не указана площадь'}), 400
+    
+    all_crops = Crop.query.order_by(Crop.id).all()
+    wanted = set(crop_ids or ())
+    crops = [crop for crop in all_crops if crop.id in wanted] if wanted else all_crops
+    if not crops:
+        return jsonify({'error': 'Не найдены культуры'}), 400
+    
+    previous_crops = None
+    if previous_crop_names is not None:
+        crops_by_name = {crop.name: crop for crop in all_crops}
+        previous_crops = [crops_by_name.get(name) if name else None for name in previous_crop_names]
+    
+    try:
+        matrix = calculate_profit_matrix(crops, areas, previous_crops)
+        if previous_crops is None:
+            previous_crops = [None] + crops
+        
+        return jsonify({
+            'crops': [crop.name for crop in crops],
+            'previous_crops': [crop.name if crop else None for crop in previous_crops],
+            'areas': areas,
+            # Массивы формы [культура][предшественник][площадь]
+            'net_profit': matrix['net_profit'].round(2).tolist(),
+            'revenue': matrix['revenue'].round(2).tolist(),
+            'total_costs': matrix['total_costs'].round(2).tolist(),
+            'profitability': matrix['profitability'].round(2).tolist()
+        })
+    except Exception as e:
+        return jsonify({'error': f'Ошибка расчета: {str(e)}'}), 500
+
+
+@app.route('/api/calculate/simulate', methods=['POST'])
+@api_login_required
+def simulate_economics():
+    # Распределение прибыли по сценариям цены и урожайности (Монте-Карло)
+    data = request.json or {}
+    crop_ids = data.get('crop_ids')
+    previous_crop_names = data.get('previous_crops')
+    
+    try:
+        area = float(data.get('area', 0))
+        draws = int(data.get('draws', DEFAULT_SIMULATION_DRAWS))
+        seed = data.get('seed')
+        seed = int(seed) if seed is not None else None
+        percentiles = [float(p) for p in data.get('percentiles', SIMULATION_PERCENTILES)]
+        options = {
+            key: float(data[key])
+            for key in ('price_volatility', 'yield_volatility', 'correlation', 'confidence')
+            if data.get(key) is not None
+        }
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректные параметры моделирования'}), 400
+    if area <= 0:
+        return jsonify({'error': 'Не указана площадь'}), 400
+    if any(p < 0 or p > 100 for p in percentiles):
+        return jsonify({'error': 'Процентили должны быть от 0 до 100'}), 400
+    if not 0 < options.get('confidence', 0.95) < 1:
+        return jsonify({'error': 'Уровень доверия должен быть от 0 до 1'}), 400
+    
+    all_crops = Crop.query.order_by(Crop.id).all()
+    wanted = set(crop_ids or ())
+    crops = [crop for crop in all_crops if crop.id in wanted] if wanted else all_crops
+    if not crops:
+        return jsonify({'error': 'Не найдены культуры'}), 400
+    
+    previous_crops = None
+    if previous_crop_names is not None:
+        crops_by_name = {crop.name: crop for crop in all_crops}
+        previous_crops = [crops_by_name.get(name) if name else None for name in previous_crop_names]
+    
+    try:
+        result = simulate_profit_distribution(
+            crops, area, previous_crops,
+            draws=draws, seed=seed, percentiles=percentiles, **options
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if previous_crops is None:
+        previous_crops = [None] + crops
+    
+    return jsonify({
+        'crops': [crop.name for crop in crops],
+        'previous_crops': [crop.name if crop else None for crop in previous_crops],
+        'area': area,
+        'draws': draws,
+        'seed': seed,
+        # Массивы формы [культура][предшественник]
+        'expected_profit': result['expected_profit'].round(2).tolist(),
+        'deterministic_profit': result['deterministic_profit'].round(2).tolist(),
+        'std': result['std'].round(2).tolist(),
+        'value_at_risk': result['value_at_risk'].round(2).tolist(),
+        'prob_loss': result['prob_loss'].round(4).tolist(),
+        'percentiles': {
+            f'{p:g}': values.round(2).tolist()
+            for p, values in zip(percentiles, result['percentiles'])
+        }
+    })
+
+
 @app.route('/api/calculator/prices/crops', methods=['GET'])
 @api_login_required
 def get_current_crop_prices():
+    # Не кэшируется: last_updated и update_status зависят от текущего времени
     crops = Crop.query.all()
     prices = {crop.name: crop.market_price_per_ton for crop in crops}
+    # Средние цены за 30 дней из дневных агрегатов истории цен
+    averages = get_average_prices(days=30)
     
     # Получаем статус обновления цен
     status = get_price_update_status()
     
     return jsonify({
         'prices': prices,
+        'average_prices_30d': {crop.name: averages.get(crop.id) for crop in crops},
         'currency': 'RUB/тонна',
         'last_updated': datetime.now().isoformat(),
         'update_status': status
     })
 
 
+@app.route('/api/prices/<crop_name>/history', methods=['GET'])
+@api_login_required
+def get_crop_price_history(crop_name):
+    # История цен культуры по дневным, недельным или месячным агрегатам
+    crop = Crop.query.filter_by(name=crop_name).first()
+    if not crop:
+        return jsonify({'error': 'Культура не найдена'}), 404
+    
+    try:
+        start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'Даты from/to должны быть в формате ISO (YYYY-MM-DD)'}), 400
+    bucket = request.args.get('bucket', DEFAULT_BUCKET)
+    
+    try:
+        history = get_price_history(crop.id, start, end, bucket)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'crop': crop.name,
+        'bucket': bucket,
+        'from': start.isoformat() if start else None,
+        'to': end.isoformat() if end else None,
+        'history': history
+    })
+
+
 @app.route('/api/admin/update-prices', methods=['POST'])
 @api_login_required
 def manual_update_prices():
     """Ручное обновление цен (для администратора)"""
     try:
         force = request.json.get('force', False) if request.is_json else False
-        result = update_all_crop_prices(force=force)
+        result = run_price_update(force=force)
+        if result is None:
+            return jsonify({
+                'success': False,
+                'error': 'Обновление цен уже выполняется'
+            }), 409
         return jsonify({
             'success': True,
             'message': 'Цены успешно обновлены',
@@ -461,6 +870,58 @@ def manual_update_prices():
         }), 500
 
 
+@app.route('/api/admin/price-providers', methods=['GET'])
+@api_login_required
+def get_price_providers():
+    """Источники цен в порядке приоритета и их метрики (запросы, ошибки, кэш, время ответа)"""
+    return jsonify(get_provider_metrics())
+
+
+@app.route('/api/admin/cache-stats', methods=['GET'])
+@api_login_required
+def get_cache_stats():
+    """Статистика кэша ответов API и кэша рекомендаций (если модель уже загружена)"""
+    stats = {'responses': response_cache.stats()}
+    module = sys.modules.get('neural_network_recommender')
+    if module is not None:
+        stats['recommendations'] = dict(
+            module.recommender.recommendation_cache.stats(), model_version=module.recommender.model_version
+        )
+    return jsonify(stats)
+
+
+@app.route('/api/admin/model/versions', methods=['GET'])
+@api_login_required
+def get_model_versions():
+    """Версии рекомендательной модели: точность, время обучения, активная версия"""
+    return jsonify(model_retrainer.status())
+
+
+@app.route('/api/admin/model/retrain', methods=['POST'])
+@api_login_required
+def retrain_model():
+    # Переобучение в фоне; ?force=1 - независимо от числа новых записей истории
+    force = request.args.get('force', '1') not in ('0', 'false')
+    get_recommender()
+    if not model_retrainer.start(force=force):
+        return jsonify({'error': 'Переобучение уже выполняется'}), 409
+    return jsonify({'message': 'Переобучение запущено'}), 202
+
+
+@app.route('/api/admin/model/rollback', methods=['POST'])
+@api_login_required
+def rollback_model():
+    # {"version": N} - конкретная версия, без тела - предыдущая принятая
+    version = (request.get_json(silent=True) or {}).get('version')
+    try:
+        get_recommender()
+        return jsonify(model_retrainer.rollback(version))
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+
+
 @app.route('/api/admin/price-status', methods=['GET'])
 @api_login_required
 def get_price_status():
@@ -476,10 +937,11 @@ def get_price_status():
 
 @app.route('/api/calculator/crops/<crop_name>', methods=['GET'])
 @api_login_required
+@response_cache.cached('crops')
 def get_crop_details_for_calculator(crop_name: str):
     crop = Crop.query.filter_by(name=crop_name).first_or_404()
     
-    seed_rate = 200 if crop.category == "Зерновые" else (120 if crop.category == "Бобовые" else 100) # Норма высева (приблизительно)
+    seed_rate = get_seed_rate(crop.category) # Норма высева (приблизительно)
     
     return jsonify({
         'name': crop.name,
@@ -501,8 +963,8 @@ def init_db():
         db.create_all(bind_key='users')
         # Обучаем нейронну
         try:
-            recommender.train()
-            print("Нейронная сеть успешно обучена")
+            get_recommender().load_or_train()
+            print("Нейронная сеть успешно загружена")
         except Exception as e:
             print(f"Предупреждение: не удалось обучить нейронную сеть: {e}")
         seed_initial_crops()
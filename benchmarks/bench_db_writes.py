@@ -0,0 +1,127 @@
+"""Бенчмарк конкурентной записи: N процессов-клиентов одновременно добавляют записи
+истории посевов, каждая - отдельной транзакцией (как POST /api/crop-history).
+
+Сравниваются режимы SQLite:
+  - tuned: PRAGMA из config.get_sqlite_pragmas (WAL, synchronous=NORMAL, busy_timeout, mmap, кэш);
+  - default: настройки SQLite по умолчанию (SQLITE_TUNING=0).
+С --url бенчмарк выполняется на указанной базе (например, PostgreSQL); таблицы создаются,
+добавленные записи не удаляются.
+
+Запуск из корня проекта:
+    python benchmarks/bench_db_writes.py [--clients 1,4,8] [--writes 200] [--url postgresql://...]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {
+    'tuned': {'SQLITE_TUNING': '1'},
+    'default': {'SQLITE_TUNING': '0'},
+}
+
+
+def create_app(env_overrides):
+    # Переменные окружения задаются до init_app_db: config читает их при создании движков
+    os.environ.update(env_overrides)
+    from flask import Flask
+    from config import init_app_db
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_app_db(app)
+    return app
+
+
+def prepare(env_overrides):
+    # Схема и одно поле с культурой, на которые ссылаются записи истории
+    from config import db
+    from models import Crop, Field
+    app = create_app(env_overrides)
+    with app.app_context():
+        db.create_all()
+        field = Field.query.first()
+        if field is None:
+            field = Field(name='bench')
+            field.set_geometry({'type': 'Polygon', 'coordinates': [[[37, 55], [37.01, 55], [37.01, 55.01], [37, 55.01], [37, 55]]]})
+            db.session.add(field)
+        crop = Crop.query.first()
+        if crop is None:
+            crop = Crop(name='bench', category='зерновые', yield_per_ha=1, market_price_per_ton=1,
+                        seed_price_per_kg=1, fertilizer_cost_per_ha=1, other_costs_per_ha=1)
+            db.session.add(crop)
+        db.session.commit()
+        return field.id, crop.id
+
+
+def client(env_overrides, field_id, crop_id, writes, start, results):
+    from config import db
+    from models import CropHistory
+    app = create_app(env_overrides)
+    with app.app_context():
+        db.session.execute(db.select(CropHistory.id).limit(1)).all()  # соединение открыто заранее
+        start.wait()
+        began = time.monotonic()
+        done = errors = 0
+        for i in range(writes):
+            try:
+                db.session.add(CropHistory(field_id=field_id, crop_id=crop_id, year=2000 + i % 25, season='весна-лето'))
+                db.session.commit()
+                done += 1
+            except Exception:
+                db.session.rollback()
+                errors += 1
+        results.put((began, time.monotonic(), done, errors))
+
+
+def run(env_overrides, clients, writes):
+    field_id, crop_id = prepare(env_overrides)
+    ctx = multiprocessing.get_context('spawn')
+    start = ctx.Event()
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=client, args=(env_overrides, field_id, crop_id, writes, start, results))
+        for _ in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(2)  # клиенты импортируют модули и открывают соединения
+    start.set()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = max(row[1] for row in rows) - min(row[0] for row in rows)
+    done = sum(row[2] for row in rows)
+    errors = sum(row[3] for row in rows)
+    return done / elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', default='1,4,8')
+    parser.add_argument('--writes', type=int, default=200, help='записей на клиента')
+    parser.add_argument('--url', help='база данных вместо временных файлов SQLite')
+    args = parser.parse_args()
+    client_counts = [int(n) for n in args.clients.split(',')]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env_base = {'USERS_DATABASE_URL': f"sqlite:///{os.path.join(tmp, 'users.db')}"}
+        modes = {'url': {'DATABASE_URL': args.url}} if args.url else MODES
+
+        print(f"{'режим':<10} {'клиенты':>8} {'записей/с':>12} {'ошибки':>8}")
+        for mode, env in modes.items():
+            for clients in client_counts:
+                client_env = dict(env_base, **env)
+                if not args.url:
+                    # Отдельный файл на каждый замер: режим WAL сохраняется в файле базы
+                    client_env['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, f'{mode}-{clients}.db')}"
+                rate, errors = run(client_env, clients, args.writes)
+                print(f"{mode:<10} {clients:>8} {rate:>12.0f} {errors:>8}")
+
+
+if __name__ == '__main__':
+    main()
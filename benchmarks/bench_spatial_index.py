@@ -0,0 +1,83 @@
+"""Бенчмарк запроса полей по bbox: R*Tree против сканирования колонок bbox.
+
+Запуск из корня проекта:
+    python benchmarks/bench_spatial_index.py [--sizes 1000,10000,100000] [--repeat 200]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+from models import Field
+from spatial_index import ensure_spatial_index, filter_fields_by_bbox, _rtree_available
+
+
+def populate(engine, count, rng):
+    # Квадратные поля ~1 км, разбросанные по европейской части России
+    rows = []
+    for _ in range(count):
+        lon = rng.uniform(30, 60)
+        lat = rng.uniform(45, 65)
+        d = 0.01
+        rows.append({
+            'name': 'bench',
+            'geometry': json.dumps({'type': 'Polygon', 'coordinates': [[[lon, lat], [lon + d, lat], [lon + d, lat + d], [lon, lat + d], [lon, lat]]]}),
+            'area': 70.0,
+            'centroid_lat': lat + d / 2,
+            'centroid_lon': lon + d / 2,
+            'bbox_min_lon': lon,
+            'bbox_min_lat': lat,
+            'bbox_max_lon': lon + d,
+            'bbox_max_lat': lat + d
+        })
+    with engine.begin() as conn:
+        conn.execute(insert(Field.__table__), rows)
+
+
+def time_queries(engine, use_rtree, repeat, rng):
+    _rtree_available[str(engine.url)] = use_rtree
+    viewports = []
+    for _ in range(repeat):
+        lon = rng.uniform(30, 59.5)
+        lat = rng.uniform(45, 64.5)
+        viewports.append((lon, lat, lon + 0.5, lat + 0.5))
+    found = 0
+    with Session(engine) as session:
+        start = time.perf_counter()
+        for bbox in viewports:
+            found += len(filter_fields_by_bbox(session.query(Field.id), engine, bbox).all())
+        elapsed = time.perf_counter() - start
+    return elapsed / repeat * 1000, found / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'полей':>8} | {'R*Tree, мс':>11} | {'скан, мс':>9} | {'найдено':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Field.__table__.create(engine)
+        ensure_spatial_index(engine)
+        total = 0
+        for size in (int(s) for s in args.sizes.split(',')):
+            populate(engine, size - total, rng)
+            total = size
+            rtree_ms, found = time_queries(engine, True, args.repeat, rng)
+            scan_ms, _ = time_queries(engine, False, args.repeat, rng)
+            print(f"{size:>8} | {rtree_ms:>11.3f} | {scan_ms:>9.3f} | {found:>8.1f}")
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
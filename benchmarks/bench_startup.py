@@ -0,0 +1,74 @@
+"""Бенчмарк холодного запуска воркера: время `import app` и самые тяжелые модули
+по данным `python -X importtime`.
+
+Сравниваются режимы:
+  - fast: AUTO_MIGRATE=0, PRICE_SCHEDULER=off (миграции - отдельным шагом `python utils.py migrate`);
+  - auto: миграции при импорте и планировщик цен (как при `python app.py`).
+Отдельно измеряется отложенный импорт ML-стека (neural_network_recommender), который
+выполняется при первом запросе рекомендаций.
+
+Запуск из корня проекта (использует базу проекта; перед замером выполняется миграция):
+    python benchmarks/bench_startup.py [--repeat 5] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'fast': {'AUTO_MIGRATE': '0', 'PRICE_SCHEDULER': 'off'},
+    'auto': {'AUTO_MIGRATE': '1', 'PRICE_SCHEDULER': 'off'},
+}
+
+
+def run_importtime(module, env_overrides):
+    # Один запуск интерпретатора с -X importtime; возвращает {модуль: (self, cumulative)} в мкс
+    env = dict(os.environ, **env_overrides)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def measure(module, env_overrides, repeat):
+    runs = [run_importtime(module, env_overrides) for _ in range(repeat)]
+    totals = [run[module][1] for run in runs]
+    return statistics.median(totals), runs[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    subprocess.run([sys.executable, 'utils.py', 'migrate'], cwd=ROOT, check=True, capture_output=True)
+
+    for mode, env_overrides in MODES.items():
+        total, timings = measure('app', env_overrides, args.repeat)
+        print(f"\nimport app [{mode}]: {total / 1000:.0f} мс (медиана из {args.repeat})")
+        top_level = sorted(
+            ((name, cumulative) for name, (_, cumulative) in timings.items() if '.' not in name and name != 'app'),
+            key=lambda item: item[1], reverse=True
+        )[:args.top]
+        for name, cumulative in top_level:
+            print(f"  {name:<32} {cumulative / 1000:8.1f} мс")
+
+    total, _ = measure('neural_network_recommender', MODES['fast'], args.repeat)
+    print(f"\nОтложенный импорт neural_network_recommender (первый запрос рекомендаций): {total / 1000:.0f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,195 @@
-from typing import Dict, Optional
+from typing import Dict, Optional, Sequence
+import numpy as np
 from models import Crop
 
 
+# Категории культур для матриц севооборота; прочие категории - последний индекс
+ROTATION_CATEGORIES = ("Зерновые", "Бобовые", "Овощные")
+OTHER_CATEGORY_INDEX = len(ROTATION_CATEGORIES)
+# Индекс строки предшественника "нет предшественника"
+NO_PREVIOUS_INDEX = OTHER_CATEGORY_INDEX + 1
+
+# Матрицы влияния предшественника: строка - категория предшественника
+# (Зерновые, Бобовые, Овощные, прочие, нет предшественника), столбец - категория текущей культуры
+# (Зерновые, Бобовые, Овощные, прочие)
+ROTATION_YIELD_MATRIX = np.array([
+    [0.85, 1.10, 0.95, 0.95],  # после зерновых
+    [1.20, 1.10, 1.15, 1.10],  # после бобовых
+    [1.05, 1.05, 0.90, 0.90],  # после овощных
+    [1.00, 1.00, 1.00, 1.00],  # после прочих
+    [1.00, 1.00, 1.00, 1.00],  # без предшественника
+])
+ROTATION_FERTILIZER_MATRIX = np.array([
+    [1.20, 0.90, 1.05, 1.05],
+    [0.80, 0.90, 0.85, 0.90],
+    [0.95, 0.95, 1.10, 1.10],
+    [1.00, 1.00, 1.00, 1.00],
+    [1.00, 1.00, 1.00, 1.00],
+])
+
+# Параметры моделирования рисков по умолчанию: стандартные отклонения цены и урожайности
+# (доля от базового значения) и их корреляция. 0.0577 - стандартное отклонение равномерного
+# разброса ±10%, которым price_updater моделирует цены; высокий урожай обычно снижает цену
+SIMULATION_PRICE_VOLATILITY = 0.0577
+SIMULATION_YIELD_VOLATILITY = 0.15
+SIMULATION_CORRELATION = -0.3
+SIMULATION_PERCENTILES = (5, 25, 50, 75, 95)
+DEFAULT_SIMULATION_DRAWS = 100_000
+MAX_SIMULATION_DRAWS = 1_000_000
+
+# Норма высева по категории, кг/га (приблизительно)
+SEED_RATES = {"Зерновые": 200, "Бобовые": 120}
+DEFAULT_SEED_RATE = 100
+
+
+def get_category_index(category: Optional[str]) -> int:
+    """Индекс категории в матрицах севооборота (NO_PREVIOUS_INDEX для отсутствующего предшественника)"""
+    if not category:
+        return NO_PREVIOUS_INDEX
+    try:
+        return ROTATION_CATEGORIES.index(category)
+    except ValueError:
+        return OTHER_CATEGORY_INDEX
+
+
+def get_seed_rate(category: Optional[str]) -> int:
+    return SEED_RATES.get(category, DEFAULT_SEED_RATE)
+
+
 def get_rotation_multipliers(current_crop_category: str, previous_crop_category: Optional[str]) -> Dict[str, float]:
-    if not previous_crop_category:
-        return {"yield_impact": 1.0, "fertilizer_impact": 1.0}
-    
-    if previous_crop_category == "Бобовые":
-        if current_crop_category == "Зерновые":
-            return {"yield_impact": 1.20, "fertilizer_impact": 0.80}
-        elif current_crop_category == "Овощные":
-            return {"yield_impact": 1.15, "fertilizer_impact": 0.85}
-        else:
-            return {"yield_impact": 1.10, "fertilizer_impact": 0.90}
-    
-    elif previous_crop_category == "Зерновые":
-        if current_crop_category == "Зерновые":
-            return {"yield_impact": 0.85, "fertilizer_impact": 1.20}
-        elif current_crop_category == "Бобовые":
-            return {"yield_impact": 1.10, "fertilizer_impact": 0.90}
-        else:
-            return {"yield_impact": 0.95, "fertilizer_impact": 1.05}
-    
-    elif previous_crop_category == "Овощные":
-        if current_crop_category == "Зерновые":
-            return {"yield_impact": 1.05, "fertilizer_impact": 0.95}
-        elif current_crop_category == "Бобовые":
-            return {"yield_impact": 1.05, "fertilizer_impact": 0.95}
-        else:
-            return {"yield_impact": 0.90, "fertilizer_impact": 1.10}
-    
-    return {"yield_impact": 1.0, "fertilizer_impact": 1.0} # По умолчанию
+    previous_index = get_category_index(previous_crop_category)
+    current_index = min(get_category_index(current_crop_category), OTHER_CATEGORY_INDEX)
+    return {
+        "yield_impact": float(ROTATION_YIELD_MATRIX[previous_index, current_index]),
+        "fertilizer_impact": float(ROTATION_FERTILIZER_MATRIX[previous_index, current_index])
+    }
+
+
+def build_crop_arrays(crops: Sequence[Crop]) -> Dict[str, np.ndarray]:
+    """Параметры культур в виде массивов (по одному элементу на культуру)"""
+    return {
+        "category_index": np.array([min(get_category_index(c.category), OTHER_CATEGORY_INDEX) for c in crops], dtype=np.intp),
+        "base_yield": np.array([c.yield_per_ha or 0 for c in crops], dtype=np.float64),
+        "market_price": np.array([c.market_price_per_ton or 0 for c in crops], dtype=np.float64),
+        "seed_price": np.array([c.seed_price_per_kg or 0 for c in crops], dtype=np.float64),
+        "seed_rate": np.array([get_seed_rate(c.category) for c in crops], dtype=np.float64),
+        "fertilizer_cost": np.array([c.fertilizer_cost_per_ha or 0 for c in crops], dtype=np.float64),
+        "other_costs": np.array([c.other_costs_per_ha or 0 for c in crops], dtype=np.float64)
+    }
+
+
+def calculate_profit_matrix(
+    crops: Sequence[Crop],
+    areas: Sequence[float],
+    previous_crops: Optional[Sequence[Optional[Crop]]] = None
+) -> Dict[str, np.ndarray]:
+    """Экономика для всех сочетаний культура × предшественник × площадь за один вызов.
+    previous_crops - список предшественников (None - без предшественника); по умолчанию
+    "без предшественника" и все культуры из crops. Массивы результата имеют форму
+    (культуры, предшественники, площади)"""
+    if previous_crops is None:
+        previous_crops = [None] + list(crops)
+    previous_index = np.array([get_category_index(p.category if p else None) for p in previous_crops], dtype=np.intp)
+    return calculate_profit_grid(build_crop_arrays(crops), previous_index, areas)
+
+
+def calculate_profit_grid(params: Dict[str, np.ndarray], previous_index: np.ndarray, areas: Sequence[float]) -> Dict[str, np.ndarray]:
+    """Экономика по массивам культур (build_crop_arrays) и индексам категорий предшественников
+    (строки матриц севооборота). Массивы результата имеют форму (культуры, предшественники, площади)"""
+    area = np.asarray(areas, dtype=np.float64)[None, None, :]
+    previous_index = np.asarray(previous_index, dtype=np.intp)
+
+    # (предшественники, культуры) -> (культуры, предшественники, 1)
+    yield_multiplier = ROTATION_YIELD_MATRIX[previous_index[:, None], params["category_index"][None, :]].T[:, :, None]
+    fertilizer_multiplier = ROTATION_FERTILIZER_MATRIX[previous_index[:, None], params["category_index"][None, :]].T[:, :, None]
+
+    def per_crop(name):
+        return params[name][:, None, None]
+
+    # Расчет расходов
+    seed_cost = per_crop("seed_price") * per_crop("seed_rate") * area
+    fertilizer_cost = per_crop("fertilizer_cost") * fertilizer_multiplier * area
+    other_costs = per_crop("other_costs") * area
+    seed_cost, fertilizer_cost, other_costs = np.broadcast_arrays(seed_cost, fertilizer_cost, other_costs)
+    total_costs = seed_cost + fertilizer_cost + other_costs
+
+    # Расчет доходов
+    total_harvest = per_crop("base_yield") * yield_multiplier * area
+    revenue = total_harvest * per_crop("market_price")
+    net_profit = revenue - total_costs
+    profitability = np.divide(net_profit * 100, total_costs, out=np.zeros_like(net_profit), where=total_costs > 0)
+
+    return {
+        "revenue": revenue,
+        "total_costs": total_costs,
+        "net_profit": net_profit,
+        "profitability": profitability,
+        "total_harvest": total_harvest,
+        "seed_cost": seed_cost,
+        "fertilizer_cost": fertilizer_cost,
+        "other_costs": other_costs
+    }
+
+
+def simulate_profit_distribution(
+    crops: Sequence[Crop],
+    area: float,
+    previous_crops: Optional[Sequence[Optional[Crop]]] = None,
+    draws: int = DEFAULT_SIMULATION_DRAWS,
+    seed: Optional[int] = None,
+    price_volatility: float = SIMULATION_PRICE_VOLATILITY,
+    yield_volatility: float = SIMULATION_YIELD_VOLATILITY,
+    correlation: float = SIMULATION_CORRELATION,
+    percentiles: Sequence[float] = SIMULATION_PERCENTILES,
+    confidence: float = 0.95
+) -> Dict[str, np.ndarray]:
+    """Распределение чистой прибыли методом Монте-Карло: draws коррелированных сценариев
+    цены и урожайности для каждой культуры вокруг текущих значений Crop (расходы неизменны).
+    Массивы результата имеют форму (культуры, предшественники), percentiles - (процентили, культуры, предшественники)"""
+    if draws < 1 or draws > MAX_SIMULATION_DRAWS:
+        raise ValueError(f"Число сценариев должно быть от 1 до {MAX_SIMULATION_DRAWS}")
+    if not -1 <= correlation <= 1:
+        raise ValueError("Корреляция должна быть от -1 до 1")
+    if price_volatility < 0 or yield_volatility < 0:
+        raise ValueError("Волатильность не может быть отрицательной")
+    if previous_crops is None:
+        previous_crops = [None] + list(crops)
+    previous_index = np.array([get_category_index(p.category if p else None) for p in previous_crops], dtype=np.intp)
+    base = calculate_profit_grid(build_crop_arrays(crops), previous_index, [area])
+    revenue = base["revenue"][:, :, 0]
+    total_costs = base["total_costs"][:, :, 0]
+
+    # Коррелированные множители цены и урожайности (разложение Холецкого для пары величин)
+    rng = np.random.default_rng(seed)
+    z_price, z_other = rng.standard_normal((2, len(crops), draws))
+    z_yield = correlation * z_price + np.sqrt(1 - correlation ** 2) * z_other
+    price_factor = np.maximum(1 + price_volatility * z_price, 0)
+    yield_factor = np.maximum(1 + yield_volatility * z_yield, 0)
+    # Выручка сценария = базовая выручка × множитель, поэтому прибыль при любом предшественнике
+    # линейна по множителю культуры: достаточно одной отсортированной выборки на культуру
+    factor = np.sort(price_factor * yield_factor, axis=1)
+
+    quantile_index = np.clip(np.round(np.asarray(percentiles, dtype=np.float64) / 100 * (draws - 1)).astype(np.intp), 0, draws - 1)
+    factor_quantiles = factor[:, quantile_index].T[:, :, None]
+    tail_index = min(int(round((1 - confidence) * (draws - 1))), draws - 1)
+
+    mean = revenue * factor.mean(axis=1)[:, None] - total_costs
+    std = revenue * factor.std(axis=1)[:, None]
+    tail = revenue * factor[:, tail_index][:, None] - total_costs
+    # Убыток при множителе ниже точки безубыточности costs / revenue
+    breakeven = np.divide(total_costs, revenue, out=np.full_like(total_costs, np.inf), where=revenue > 0)
+    losses = np.stack([np.searchsorted(factor[c], breakeven[c], side='left') for c in range(len(crops))]) if len(crops) else np.zeros_like(breakeven)
+    prob_loss = np.where(revenue > 0, losses / draws, (total_costs > 0).astype(np.float64))
+
+    return {
+        "expected_profit": mean,
+        "std": std,
+        "percentiles": revenue[None, :, :] * factor_quantiles - total_costs[None, :, :],
+        # VaR - отклонение прибыли в худших (1 - confidence) сценариях от ожидаемой
+        "value_at_risk": mean - tail,
+        "prob_loss": prob_loss,
+        "deterministic_profit": base["net_profit"][:, :, 0]
+    }
 
 
 def calculate_profit_with_rotation(
@@ -44,7 +203,7 @@ def calculate_profit_with_rotation(
     fertilizer_cost_per_ha = crop.fertilizer_cost_per_ha
     other_costs_per_ha = crop.other_costs_per_ha
     
-    seed_rate = 200 if crop.category == "Зерновые" else (120 if crop.category == "Бобовые" else 100) # Норма высева приблизительно
+    seed_rate = get_seed_rate(crop.category) # Норма высева приблизительно
     
     previous_category = previous_crop.category if previous_crop else None
     rotation = get_rotation_multipliers(crop.category, previous_category)
@@ -0,0 +1,151 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from calculator_api import build_crop_arrays, calculate_profit_grid, get_category_index
+from models import Crop, Field
+
+# Ограничение времени решения по умолчанию, секунд
+DEFAULT_TIME_LIMIT = 30.0
+
+
+def build_field_columns(fields: Sequence[Field], last_crops: Sequence[Optional[Crop]], crops: Sequence[Crop]) -> Dict[str, np.ndarray]:
+    """Столбцы вариантов для каждого поля: прибыль, урожай и стоимость семян
+    при посеве каждой культуры (массивы формы (поля, культуры))"""
+    params = build_crop_arrays(crops)
+    states = np.array([get_category_index(c.category if c else None) for c in last_crops], dtype=np.intp)
+    area = np.array([f.area or 0 for f in fields], dtype=np.float64)
+
+    # Экономика на 1 га для каждой категории предшественника, затем выбор строки поля и умножение на площадь
+    unique_states, state_of_field = np.unique(states, return_inverse=True)
+    grid = calculate_profit_grid(params, unique_states, [1.0])
+
+    def per_field(name):
+        # (культуры, состояния) -> (поля, культуры)
+        return grid[name][:, state_of_field, 0].T * area[:, None]
+
+    return {
+        "area": area,
+        "net_profit": per_field("net_profit"),
+        "total_harvest": per_field("total_harvest"),
+        "seed_cost": per_field("seed_cost"),
+        "total_costs": per_field("total_costs")
+    }
+
+
+def solve_assignment(
+    columns: Dict[str, np.ndarray],
+    min_tonnage: Optional[Dict[int, float]] = None,
+    max_area: Optional[Dict[int, float]] = None,
+    seed_budget: Optional[float] = None,
+    time_limit: float = DEFAULT_TIME_LIMIT
+) -> Tuple[np.ndarray, bool]:
+    """Выбор одной культуры на каждое поле с максимальной суммарной прибылью (целочисленная
+    задача, решатель HiGHS из SciPy). min_tonnage/max_area - по индексу культуры.
+    Возвращает индекс культуры для каждого поля и признак оптимальности: False, если решатель
+    остановлен по time_limit и возвращен лучший найденный к этому моменту план"""
+    from scipy.optimize import Bounds, LinearConstraint, milp
+    from scipy.sparse import csr_matrix, identity, kron, vstack
+
+    profit = columns["net_profit"]
+    num_fields, num_crops = profit.shape
+    if num_fields == 0:
+        return np.zeros(0, dtype=np.intp), True
+
+    # Переменная x[f * num_crops + c] = 1, если на поле f сеется культура c
+    rows = [kron(identity(num_fields, format='csr'), np.ones((1, num_crops)), format='csr')]
+    lower = [np.ones(num_fields)]
+    upper = [np.ones(num_fields)]
+
+    def crop_row(values, crop_index):
+        # Строка ограничения, затрагивающая только переменные культуры crop_index
+        data = np.zeros((num_fields, num_crops))
+        data[:, crop_index] = values
+        return csr_matrix(data.reshape(1, -1))
+
+    for crop_index, tonnage in (min_tonnage or {}).items():
+        rows.append(crop_row(columns["total_harvest"][:, crop_index], crop_index))
+        lower.append(np.array([tonnage]))
+        upper.append(np.array([np.inf]))
+    for crop_index, area in (max_area or {}).items():
+        rows.append(crop_row(columns["area"], crop_index))
+        lower.append(np.array([-np.inf]))
+        upper.append(np.array([area]))
+    if seed_budget is not None:
+        rows.append(csr_matrix(columns["seed_cost"].reshape(1, -1)))
+        lower.append(np.array([-np.inf]))
+        upper.append(np.array([seed_budget]))
+
+    result = milp(
+        c=-profit.reshape(-1),
+        constraints=LinearConstraint(vstack(rows, format='csr'), np.concatenate(lower), np.concatenate(upper)),
+        integrality=np.ones(profit.size),
+        bounds=Bounds(0, 1),
+        options={'time_limit': time_limit}
+    )
+    if result.status == 2:
+        raise ValueError("Ограничения несовместимы: контрактные объемы, площади и бюджет на семена нельзя выполнить одновременно")
+    if result.x is None:
+        raise ValueError(f"План не найден: {result.message}")
+    return np.argmax(result.x.reshape(num_fields, num_crops), axis=1), result.status == 0
+
+
+def plan_farm(
+    fields: Sequence[Field],
+    last_crops: Sequence[Optional[Crop]],
+    crops: Sequence[Crop],
+    min_tonnage: Optional[Dict[str, float]] = None,
+    max_area: Optional[Dict[str, float]] = None,
+    seed_budget: Optional[float] = None,
+    time_limit: float = DEFAULT_TIME_LIMIT
+) -> Dict:
+    """Распределение культур по полям хозяйства на следующий сезон.
+    min_tonnage - контрактный объем по культуре (т), max_area - максимум площади по культуре (га),
+    seed_budget - общий бюджет на семена (руб). optimal=False и status='time_limit' в ответе -
+    план не доказанно оптимален: решатель остановлен по ограничению времени"""
+    crop_index = {crop.name: i for i, crop in enumerate(crops)}
+    unknown = [name for name in list(min_tonnage or {}) + list(max_area or {}) if name not in crop_index]
+    if unknown:
+        raise ValueError(f"Неизвестные культуры: {', '.join(unknown)}")
+
+    columns = build_field_columns(fields, last_crops, crops)
+    choice, optimal = solve_assignment(
+        columns,
+        min_tonnage={crop_index[name]: value for name, value in (min_tonnage or {}).items()},
+        max_area={crop_index[name]: value for name, value in (max_area or {}).items()},
+        seed_budget=seed_budget,
+        time_limit=time_limit
+    )
+
+    rows = np.arange(len(fields))
+    assignments: List[Dict] = []
+    for i, field in enumerate(fields):
+        c = choice[i]
+        assignments.append({
+            "field_id": field.id,
+            "field_name": field.name,
+            "area": field.area,
+            "previous_crop": last_crops[i].name if last_crops[i] else None,
+            "crop_id": crops[c].id,
+            "crop_name": crops[c].name,
+            "net_profit": round(float(columns["net_profit"][i, c]), 2),
+            "total_harvest": round(float(columns["total_harvest"][i, c]), 2)
+        })
+
+    crop_totals = {}
+    for c, crop in enumerate(crops):
+        mask = choice == c
+        if mask.any():
+            crop_totals[crop.name] = {
+                "fields": int(mask.sum()),
+                "area": round(float(columns["area"][mask].sum()), 2),
+                "total_harvest": round(float(columns["total_harvest"][rows[mask], c].sum()), 2),
+                "net_profit": round(float(columns["net_profit"][rows[mask], c].sum()), 2)
+            }
+
+    return {
+        "optimal": optimal,
+        "status": "optimal" if optimal else "time_limit",
+        "assignments": assignments,
+        "crop_totals": crop_totals,
+        "total_net_profit": round(float(columns["net_profit"][rows, choice].sum()), 2),
+        "total_seed_cost": round(float(columns["seed_cost"][rows, choice].sum()), 2)
+    }
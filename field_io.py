@@ -0,0 +1,286 @@
+import codecs
+import csv
+import io
+import json
+import sys
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import insert, select
+from config import db
+from geometry import build_zoom_levels, compute_geometry_metrics, parse_geometry
+from models import Field
+from spatial_index import filter_fields_by_bbox
+
+# Потоковый импорт и экспорт полей. Тело запроса читается порциями и разбирается
+# инкрементально, поля записываются пакетами (executemany) - в памяти не больше одного пакета.
+IMPORT_BATCH_SIZE = 500
+READ_CHUNK_SIZE = 64 * 1024
+# Максимальный размер одного объекта потока (символов) - некорректный или огромный объект
+# не должен затягивать в память остаток загрузки
+MAX_FEATURE_SIZE = 16 * 1024 * 1024
+# Ошибка разбора ближе этого расстояния к концу буфера - объект прочитан не полностью
+INCOMPLETE_TAIL = 64
+# Сколько ошибок отдельных объектов попадает в отчет
+MAX_REPORTED_ERRORS = 100
+EXPORT_FETCH_SIZE = 1000
+
+IMPORT_FORMATS = ('geojson', 'ndjson', 'csv')
+EXPORT_FORMATS = ('geojson', 'ndjson')
+
+# Тип содержимого запроса -> формат импорта
+CONTENT_TYPE_FORMATS = {
+    'application/geo+json': 'geojson',
+    'application/json': 'geojson',
+    'application/x-ndjson': 'ndjson',
+    'application/geo+json-seq': 'ndjson',
+    'text/csv': 'csv',
+}
+
+FIELD_NAME_MAX_LENGTH = Field.__table__.c.name.type.length
+
+
+class _JsonStream:
+    """Буфер текста из бинарного потока с разбором JSON-значений по одному (raw_decode)"""
+
+    def __init__(self, stream, chunk_size: int = READ_CHUNK_SIZE, max_value_size: int = MAX_FEATURE_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_value_size = max_value_size
+        # utf-8-sig: BOM в начале файла пропускается, многобайтовые символы на границе порций не рвутся
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.decoder_json = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: Optional[int] = None) -> bool:
+        if self.eof:
+            return False
+        chunk = self.stream.read(size or self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk or b'', final=not chunk)
+        self.pos = 0
+        self.eof = not chunk
+        return True
+
+    def peek(self) -> str:
+        """Следующий непробельный символ ('' в конце потока)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Некорректный JSON: ожидался один из символов {chars!r}, получено {char or 'конец файла'!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Следующее JSON-значение целиком. Недочитанное значение дочитывается порциями,
+        растущими вдвое (разбор с начала значения повторяется O(log n) раз)"""
+        self.peek()
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder_json.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # Ошибка не в конце буфера - JSON некорректен, дальше поток не читается
+                if not self._incomplete(e) or not self._grow(read_size):
+                    raise ValueError(f"Некорректный JSON: {e.msg}") from e
+                read_size *= 2
+                continue
+            # Число на границе порции могло быть прочитано не полностью
+            if end == len(self.buffer) and self._grow(read_size):
+                read_size *= 2
+                continue
+            self.pos = end
+            return value
+
+    def _incomplete(self, error: json.JSONDecodeError) -> bool:
+        return error.msg.startswith('Unterminated string') or len(self.buffer) - error.pos <= INCOMPLETE_TAIL
+
+    def _grow(self, size: int) -> bool:
+        # Следующая порция текущего значения; значение больше max_value_size - ошибка
+        if self.eof:
+            return False
+        if len(self.buffer) - self.pos > self.max_value_size:
+            raise ValueError(f"Объект больше {self.max_value_size} символов")
+        return self._fill(min(size, self.max_value_size + 1 - (len(self.buffer) - self.pos)))
+
+
+def iter_geojson(stream) -> Iterator[Tuple[int, Dict]]:
+    """Объекты FeatureCollection (или JSON-массива объектов) по одному: (номер, объект).
+    Остальные ключи FeatureCollection пропускаются"""
+    reader = _JsonStream(stream)
+    number = 0
+
+    def features():
+        nonlocal number
+        if reader.peek() == ']':
+            reader.pos += 1
+            return
+        while True:
+            number += 1
+            try:
+                feature = reader.value()
+            except ValueError as e:
+                raise ValueError(f"Объект {number}: {e}") from e
+            yield number, feature
+            if reader.expect(',]') == ']':
+                return
+
+    opening = reader.expect('{[')
+    if opening == '[':
+        yield from features()
+        return
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'features':
+            reader.expect('[')
+            yield from features()
+        else:
+            reader.value()
+        if reader.expect(',}') == '}':
+            return
+
+
+def iter_ndjson(stream) -> Iterator[Tuple[int, object]]:
+    """Строки NDJSON: (номер строки, объект или ValueError для некорректной строки)"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    for number, line in enumerate(text, 1):
+        line = line.strip().lstrip('\x1e')  # GeoJSON Text Sequences (RFC 8142)
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, ValueError(f"Некорректный JSON: {e.msg}")
+
+
+def iter_csv(stream) -> Iterator[Tuple[int, Dict]]:
+    """Строки CSV (номер строки данных, dict по заголовку)"""
+    # Геометрии полей длиннее ограничения модуля csv по умолчанию (128 КБ)
+    csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    for number, row in enumerate(csv.DictReader(text), 1):
+        yield number, row
+
+
+def iter_field_features(stream, fmt: str) -> Iterator[Tuple[int, object]]:
+    """Объекты полей из потока в формате geojson, ndjson или csv (колонки name и geometry)"""
+    if fmt == 'geojson':
+        return iter_geojson(stream)
+    if fmt == 'ndjson':
+        return iter_ndjson(stream)
+    if fmt == 'csv':
+        return ((number, {'properties': {'name': row.get('name')}, 'geometry': row.get('geometry')})
+                for number, row in iter_csv(stream))
+    raise ValueError(f"Неизвестный формат импорта: {fmt}")
+
+
+def _feature_name(properties: Dict) -> Optional[str]:
+    # Имя поля из свойств; атрибуты шейп-файлов часто записаны заглавными буквами
+    for key, value in properties.items():
+        if key.lower() == 'name' and value not in (None, ''):
+            return str(value).strip()
+    return None
+
+
+def field_row(feature) -> Dict:
+    """Строка таблицы fields из объекта GeoJSON: проверка, площадь, центроид, bbox и упрощенные
+    геометрии вычисляются на сервере (как Field.set_geometry)"""
+    if not isinstance(feature, dict):
+        raise ValueError("Объект поля должен быть Feature GeoJSON")
+    properties = feature.get('properties') or {}
+    name = _feature_name(properties) or _feature_name(feature)
+    if not name:
+        raise ValueError("Не указано название поля (properties.name)")
+    if len(name) > FIELD_NAME_MAX_LENGTH:
+        raise ValueError(f"Название поля длиннее {FIELD_NAME_MAX_LENGTH} символов")
+    geometry = feature.get('geometry')
+    if geometry in (None, ''):
+        raise ValueError("Не указана геометрия поля")
+    geometry = parse_geometry(geometry)
+    row = compute_geometry_metrics(geometry)
+    row['name'] = name
+    row['geometry'] = json.dumps(geometry, separators=(',', ':'))
+    row['geometry_lod'] = json.dumps(build_zoom_levels(geometry))
+    return row
+
+
+def import_fields(features: Iterable[Tuple[int, object]], batch_size: int = IMPORT_BATCH_SIZE,
+                  on_commit: Optional[Callable[[List[Dict]], None]] = None) -> Iterator[Dict]:
+    """Импорт полей пакетами: каждый пакет - один INSERT (executemany) и одна транзакция.
+    После каждого пакета отдает отчет о ходе импорта, последний отчет содержит done=True.
+    Некорректные объекты пропускаются и попадают в errors; при ошибке разбора потока импорт
+    останавливается, уже записанные пакеты сохраняются. on_commit(rows) - после фиксации пакета"""
+    progress = {'processed': 0, 'imported': 0, 'failed': 0, 'errors': [], 'done': False}
+    batch = []
+
+    def report_error(number, error):
+        progress['failed'] += 1
+        if len(progress['errors']) < MAX_REPORTED_ERRORS:
+            progress['errors'].append({'feature': number, 'error': str(error)})
+
+    def flush():
+        db.session.execute(insert(Field), batch)
+        db.session.commit()
+        progress['imported'] += len(batch)
+        if on_commit is not None:
+            on_commit(batch)
+        batch.clear()
+
+    try:
+        for number, feature in features:
+            progress['processed'] += 1
+            if isinstance(feature, Exception):
+                report_error(number, feature)
+                continue
+            try:
+                batch.append(field_row(feature))
+            except (ValueError, TypeError, KeyError, IndexError) as e:
+                report_error(number, e)
+                continue
+            if len(batch) >= batch_size:
+                flush()
+                yield dict(progress)
+        if batch:
+            flush()
+    except Exception as e:
+        db.session.rollback()
+        progress['error'] = str(e)
+    progress['done'] = True
+    yield progress
+
+
+def _feature_json(row) -> str:
+    # Геометрия хранится в виде текста GeoJSON и вставляется без повторного разбора
+    properties = json.dumps({
+        'name': row.name,
+        'area': row.area,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    }, ensure_ascii=False)
+    return f'{{"type":"Feature","id":{row.id},"properties":{properties},"geometry":{row.geometry}}}'
+
+
+def export_fields(fmt: str = 'geojson', bbox=None) -> Iterator[str]:
+    """Поля в GeoJSON FeatureCollection или NDJSON по частям; строки читаются из БД порциями"""
+    query = select(Field.id, Field.name, Field.area, Field.created_at, Field.geometry)
+    query = filter_fields_by_bbox(query, db.engine, bbox).order_by(Field.id)
+    rows = db.session.execute(query.execution_options(yield_per=EXPORT_FETCH_SIZE))
+    if fmt == 'ndjson':
+        for row in rows:
+            yield _feature_json(row) + '\n'
+        return
+    yield '{"type":"FeatureCollection","features":['
+    separator = ''
+    for row in rows:
+        yield separator + _feature_json(row)
+        separator = ',\n'
+    yield ']}\n'
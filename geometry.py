@@ -0,0 +1,273 @@
+import json
+import math
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+# Экваториальный радиус Земли (как в calculateArea в static/js/fields.js)
+EARTH_RADIUS_M = 6378137
+
+Ring = List[List[float]]
+Polygon = List[Ring]
+
+
+def parse_geometry(geometry: Union[str, Dict]) -> Dict:
+    """Разбор геометрии GeoJSON из строки или dict (допускается Feature
+    и FeatureCollection из одного объекта)"""
+    if isinstance(geometry, str):
+        geometry = json.loads(geometry)
+    if not isinstance(geometry, dict):
+        raise ValueError("Геометрия должна быть объектом GeoJSON")
+    if geometry.get('type') == 'FeatureCollection':
+        features = geometry.get('features') or []
+        if len(features) != 1 or not isinstance(features[0], dict):
+            raise ValueError("FeatureCollection должна содержать ровно один объект поля")
+        geometry = features[0]
+    if geometry.get('type') == 'Feature':
+        geometry = geometry.get('geometry') or {}
+    return geometry
+
+
+def get_polygons(geometry: Union[str, Dict]) -> List[Polygon]:
+    """Список полигонов (каждый - список колец) для Polygon и MultiPolygon"""
+    geometry = parse_geometry(geometry)
+    geometry_type = geometry.get('type')
+    coordinates = geometry.get('coordinates')
+    if geometry_type == 'Polygon':
+        polygons = [coordinates]
+    elif geometry_type == 'MultiPolygon':
+        polygons = coordinates
+    else:
+        raise ValueError(f"Неподдерживаемый тип геометрии: {geometry_type}")
+
+    if not polygons or not all(polygon and len(polygon[0]) >= 3 for polygon in polygons):
+        raise ValueError("Полигон должен содержать хотя бы три точки")
+    return polygons
+
+
+def _ring_geodesic_area(ring: Ring) -> float:
+    # Площадь кольца на сфере в м² (со знаком), та же формула, что и на клиенте
+    area = 0.0
+    n = len(ring)
+    for i in range(n):
+        lon1, lat1 = ring[i][0], ring[i][1]
+        lon2, lat2 = ring[(i + 1) % n][0], ring[(i + 1) % n][1]
+        area += math.radians(lon2 - lon1) * (2 + math.sin(math.radians(lat1)) + math.sin(math.radians(lat2)))
+    return area * EARTH_RADIUS_M * EARTH_RADIUS_M / 2
+
+
+def _polygon_geodesic_area(polygon: Polygon) -> float:
+    # Внешнее кольцо минус отверстия
+    outer = abs(_ring_geodesic_area(polygon[0]))
+    holes = sum(abs(_ring_geodesic_area(ring)) for ring in polygon[1:])
+    return max(outer - holes, 0.0)
+
+
+def geodesic_area_ha(geometry: Union[str, Dict]) -> float:
+    """Геодезическая площадь в гектарах"""
+    return sum(_polygon_geodesic_area(polygon) for polygon in get_polygons(geometry)) / 10000
+
+
+def _ring_centroid(ring: Ring) -> Tuple[float, float, float]:
+    # Планарная площадь (со знаком) и центроид кольца в координатах lon/lat
+    area2 = 0.0
+    cx = 0.0
+    cy = 0.0
+    n = len(ring)
+    for i in range(n):
+        x1, y1 = ring[i][0], ring[i][1]
+        x2, y2 = ring[(i + 1) % n][0], ring[(i + 1) % n][1]
+        cross = x1 * y2 - x2 * y1
+        area2 += cross
+        cx += (x1 + x2) * cross
+        cy += (y1 + y2) * cross
+    if area2 == 0:
+        return 0.0, 0.0, 0.0
+    return area2 / 2, cx / (3 * area2), cy / (3 * area2)
+
+
+def centroid(geometry: Union[str, Dict]) -> Tuple[float, float]:
+    """Центроид полигона (широта, долгота) с учетом отверстий и частей MultiPolygon"""
+    polygons = get_polygons(geometry)
+    total = 0.0
+    sum_x = 0.0
+    sum_y = 0.0
+    for polygon in polygons:
+        for index, ring in enumerate(polygon):
+            area, cx, cy = _ring_centroid(ring)
+            # Внешнее кольцо - с плюсом, отверстия - с минусом, независимо от направления обхода
+            weight = abs(area) if index == 0 else -abs(area)
+            total += weight
+            sum_x += cx * weight
+            sum_y += cy * weight
+
+    if total == 0:
+        # Вырожденный полигон - среднее по вершинам внешних колец
+        points = [point for polygon in polygons for point in polygon[0]]
+        return (sum(p[1] for p in points) / len(points), sum(p[0] for p in points) / len(points))
+    return sum_y / total, sum_x / total
+
+
+def bbox(geometry: Union[str, Dict]) -> Tuple[float, float, float, float]:
+    """Ограничивающий прямоугольник (min_lon, min_lat, max_lon, max_lat)"""
+    points = [point for polygon in get_polygons(geometry) for point in polygon[0]]
+    lons = [p[0] for p in points]
+    lats = [p[1] for p in points]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def compute_geometry_metrics(geometry: Union[str, Dict]) -> Dict[str, Optional[float]]:
+    """Площадь (га), центроид и bbox поля для сохранения в колонках Field"""
+    geometry = parse_geometry(geometry)
+    center_lat, center_lon = centroid(geometry)
+    min_lon, min_lat, max_lon, max_lat = bbox(geometry)
+    return {
+        'area': round(geodesic_area_ha(geometry), 2),
+        'centroid_lat': center_lat,
+        'centroid_lon': center_lon,
+        'bbox_min_lon': min_lon,
+        'bbox_min_lat': min_lat,
+        'bbox_max_lon': max_lon,
+        'bbox_max_lat': max_lat
+    }
+
+
+# Полосы масштабов карты: (максимальный zoom полосы, допуск упрощения в градусах).
+# Допуск ~ размер пикселя на верхней границе полосы; для zoom выше последней полосы
+# отдается исходная геометрия.
+SIMPLIFY_ZOOM_BANDS = (
+    (9, 360 / (256 * 2 ** 9)),
+    (13, 360 / (256 * 2 ** 13)),
+)
+
+# Точность квантования координат (знаков после запятой, ~0.1 м)
+COORDINATE_PRECISION = 6
+
+
+def tolerance_for_zoom(zoom: Optional[float]) -> Optional[float]:
+    """Допуск упрощения для масштаба карты (None - без упрощения)"""
+    if zoom is None:
+        return None
+    for max_zoom, tolerance in SIMPLIFY_ZOOM_BANDS:
+        if zoom <= max_zoom:
+            return tolerance
+    return None
+
+
+def _simplify_ring(ring: Ring, tolerance: float) -> Ring:
+    # Дуглас-Пекер для замкнутого кольца (итеративно, без рекурсии)
+    n = len(ring)
+    if n <= 4:
+        return ring
+    keep = [False] * n
+    keep[0] = keep[n - 1] = True
+    # Для замкнутого кольца первая и последняя точки совпадают: опорной берем самую дальнюю от первой
+    x0, y0 = ring[0][0], ring[0][1]
+    far = max(range(1, n - 1), key=lambda i: (ring[i][0] - x0) ** 2 + (ring[i][1] - y0) ** 2)
+    keep[far] = True
+    stack = [(0, far), (far, n - 1)]
+    tolerance_sq = tolerance * tolerance
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        ax, ay = ring[start][0], ring[start][1]
+        bx, by = ring[end][0], ring[end][1]
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        max_dist = -1.0
+        index = start
+        for i in range(start + 1, end):
+            px, py = ring[i][0], ring[i][1]
+            if length_sq == 0:
+                dist = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+                dist = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+            if dist > max_dist:
+                max_dist = dist
+                index = i
+        if max_dist > tolerance_sq:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    simplified = [point for point, kept in zip(ring, keep) if kept]
+    # Кольцо должно остаться многоугольником (минимум 3 различные точки + замыкающая)
+    return simplified if len(simplified) >= 4 else ring
+
+
+def _round_ring(ring: Ring) -> Ring:
+    return [[round(p[0], COORDINATE_PRECISION), round(p[1], COORDINATE_PRECISION)] for p in ring]
+
+
+def simplify_geometry(geometry: Union[str, Dict], tolerance: Optional[float]) -> Dict:
+    """Упрощение Polygon/MultiPolygon алгоритмом Дугласа-Пекера с квантованием координат.
+    Отверстия, которые схлопываются до размера меньше допуска, отбрасываются"""
+    geometry = parse_geometry(geometry)
+    polygons = get_polygons(geometry)
+    simplified = []
+    for polygon in polygons:
+        rings = []
+        for index, ring in enumerate(polygon):
+            if tolerance:
+                if index > 0:
+                    lons = [p[0] for p in ring]
+                    lats = [p[1] for p in ring]
+                    if max(lons) - min(lons) < tolerance and max(lats) - min(lats) < tolerance:
+                        continue
+                ring = _simplify_ring(ring, tolerance)
+            rings.append(_round_ring(ring))
+        simplified.append(rings)
+    if geometry.get('type') == 'MultiPolygon':
+        return {'type': 'MultiPolygon', 'coordinates': simplified}
+    return {'type': 'Polygon', 'coordinates': simplified[0]}
+
+
+@lru_cache(maxsize=4096)
+def simplified_geometry_json(geometry: str, tolerance: float) -> str:
+    """Упрощенная геометрия в виде строки GeoJSON (кэшируется для произвольных допусков)"""
+    return json.dumps(simplify_geometry(geometry, tolerance), separators=(',', ':'))
+
+
+def build_zoom_levels(geometry: Union[str, Dict]) -> Dict[str, str]:
+    """Упрощенные геометрии для каждой полосы масштабов (ключ - максимальный zoom полосы)"""
+    geometry = parse_geometry(geometry)
+    return {
+        str(max_zoom): json.dumps(simplify_geometry(geometry, tolerance), separators=(',', ':'))
+        for max_zoom, tolerance in SIMPLIFY_ZOOM_BANDS
+    }
+
+
+def _encode_value(value: int) -> str:
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def encode_polyline(ring: Ring, precision: int = COORDINATE_PRECISION) -> str:
+    """Кольцо в формате encoded polyline (порядок lat, lng как у Google/Leaflet)"""
+    factor = 10 ** precision
+    result = []
+    prev_lat = prev_lon = 0
+    for point in ring:
+        lat = int(round(point[1] * factor))
+        lon = int(round(point[0] * factor))
+        result.append(_encode_value(lat - prev_lat))
+        result.append(_encode_value(lon - prev_lon))
+        prev_lat, prev_lon = lat, lon
+    return ''.join(result)
+
+
+def encode_geometry(geometry: Union[str, Dict], precision: int = COORDINATE_PRECISION) -> Dict:
+    """Компактное представление Polygon/MultiPolygon: кольца в encoded polyline.
+    Декодируется на клиенте функцией decodeGeometry из static/js/common.js"""
+    geometry = parse_geometry(geometry)
+    return {
+        'type': geometry.get('type'),
+        'encoding': 'polyline',
+        'precision': precision,
+        'polygons': [[encode_polyline(ring, precision) for ring in polygon] for polygon in get_polygons(geometry)]
+    }
@@ -0,0 +1,253 @@
+import argparse
+import csv
+import json
+import sys
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+from sqlalchemy import bindparam, func, insert, select, update
+from config import db
+from field_io import MAX_REPORTED_ERRORS, iter_csv, iter_ndjson
+from models import Crop, CropHistory, Field
+
+# Массовая загрузка истории посевов (CSV или NDJSON из агрономической системы).
+# Названия полей и культур разрешаются через словари в памяти, записи с тем же
+# (field_id, year, season) обновляются, новые добавляются пакетами (executemany).
+HISTORY_BATCH_SIZE = 5000
+HISTORY_FORMATS = ('csv', 'ndjson')
+DEFAULT_SEASON = 'весна-лето'
+MIN_YEAR, MAX_YEAR = 1900, 2100
+
+SEASON_MAX_LENGTH = CropHistory.__table__.c.season.type.length
+
+_history_table = CropHistory.__table__
+
+
+def _update_statement(columns):
+    # UPDATE по первичному ключу для executemany (Core, без учета объектов сессии)
+    return update(_history_table).where(_history_table.c.id == bindparam('b_id')).values(
+        {name: bindparam(name) for name in columns}
+    )
+
+
+_UPDATE_WITH_NOTES = _update_statement(('field_id', 'crop_id', 'year', 'season', 'notes'))
+_UPDATE_WITHOUT_NOTES = _update_statement(('field_id', 'crop_id', 'year', 'season'))
+
+
+def _normalize_name(value) -> str:
+    return ' '.join(str(value).split()).casefold()
+
+
+def _add_name(by_name: Dict, name: str, value: int) -> None:
+    # Ключи - и исходное название (быстрый путь), и нормализованное (регистр, пробелы);
+    # название, встречающееся у нескольких объектов, отображается в None
+    for key in {name, _normalize_name(name)}:
+        by_name[key] = None if key in by_name and by_name[key] != value else value
+
+
+def load_lookup_maps() -> Tuple[Dict[str, int], Dict[str, Optional[int]], set, set]:
+    """Словари название -> id для культур и полей и множества существующих id"""
+    crops = {}
+    crop_ids = set()
+    for crop_id, name in db.session.execute(select(Crop.id, Crop.name)):
+        _add_name(crops, name, crop_id)
+        crop_ids.add(crop_id)
+    fields = {}
+    field_ids = set()
+    for field_id, name in db.session.execute(select(Field.id, Field.name)):
+        _add_name(fields, name, field_id)
+        field_ids.add(field_id)
+    return crops, fields, crop_ids, field_ids
+
+
+def load_existing_keys() -> Dict[Tuple[int, int, str], int]:
+    """(field_id, year, season) -> id существующей записи (при повторах - последней)"""
+    rows = db.session.execute(
+        select(CropHistory.field_id, CropHistory.year, CropHistory.season, func.max(CropHistory.id))
+        .group_by(CropHistory.field_id, CropHistory.year, CropHistory.season)
+    )
+    return {(field_id, year, season): history_id for field_id, year, season, history_id in rows}
+
+
+def _resolve_id(record: Dict, id_key: str, name_key: str, by_name: Dict, known_ids: set, not_found: str) -> int:
+    value = record.get(id_key)
+    if value not in (None, ''):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Некорректный {id_key}: {value}")
+        if value not in known_ids:
+            raise ValueError(not_found.format(f"с id {value}"))
+        return value
+    name = record.get(name_key)
+    if name in (None, ''):
+        raise ValueError(f"Не указано {name_key} или {id_key}")
+    key = name if name in by_name else _normalize_name(name)
+    if key not in by_name:
+        raise ValueError(not_found.format(f"«{name}»"))
+    if by_name[key] is None:
+        raise ValueError(f"Несколько полей с названием «{name}», укажите {id_key}")
+    return by_name[key]
+
+
+def history_row(record, crops: Dict, fields: Dict, crop_ids: set, field_ids: set) -> Dict:
+    """Проверенная строка crop_history из записи файла"""
+    if not isinstance(record, dict):
+        raise ValueError("Запись должна быть объектом")
+    field_id = _resolve_id(record, 'field_id', 'field_name', fields, field_ids, "Поле {} не найдено")
+    crop_id = _resolve_id(record, 'crop_id', 'crop_name', crops, crop_ids, "Культура {} не найдена")
+    try:
+        year = int(record.get('year'))
+    except (TypeError, ValueError):
+        raise ValueError(f"Некорректный год: {record.get('year')}")
+    if not MIN_YEAR <= year <= MAX_YEAR:
+        raise ValueError(f"Год вне диапазона {MIN_YEAR}-{MAX_YEAR}: {year}")
+    season = str(record.get('season') or DEFAULT_SEASON).strip()
+    if len(season) > SEASON_MAX_LENGTH:
+        raise ValueError(f"Сезон длиннее {SEASON_MAX_LENGTH} символов")
+    row = {'field_id': field_id, 'crop_id': crop_id, 'year': year, 'season': season}
+    notes = record.get('notes')
+    if notes not in (None, ''):
+        row['notes'] = str(notes)
+    return row
+
+
+def iter_history_records(stream, fmt: str) -> Iterator[Tuple[int, object]]:
+    """Записи истории из потока: (номер строки, dict или ValueError)"""
+    if fmt == 'csv':
+        return iter_csv(stream)
+    if fmt == 'ndjson':
+        return iter_ndjson(stream)
+    raise ValueError(f"Неизвестный формат истории посевов: {fmt}")
+
+
+def import_crop_history(records: Iterable[Tuple[int, object]], batch_size: int = HISTORY_BATCH_SIZE,
+                        on_commit: Optional[Callable[[set], None]] = None,
+                        on_reject: Optional[Callable[[int, object, str], None]] = None) -> Iterator[Dict]:
+    """Загрузка истории с upsert по (field_id, year, season): пакет - одна транзакция с одним
+    INSERT и одним UPDATE (executemany). При повторе ключа в файле побеждает последняя запись.
+    После каждого пакета отдает отчет, последний отчет содержит done=True.
+    on_commit(field_ids) - после фиксации пакета, on_reject(номер, запись, причина) - для каждого отказа"""
+    crops, fields, crop_ids, field_ids = load_lookup_maps()
+    existing = load_existing_keys()
+    progress = {'processed': 0, 'inserted': 0, 'updated': 0, 'rejected': 0, 'errors': [], 'done': False}
+    inserts: Dict[Tuple[int, int, str], Dict] = {}
+    updates: Dict[int, Dict] = {}
+
+    def reject(number, record, reason):
+        progress['rejected'] += 1
+        if len(progress['errors']) < MAX_REPORTED_ERRORS:
+            progress['errors'].append({'row': number, 'error': reason})
+        if on_reject is not None:
+            on_reject(number, record, reason)
+
+    def flush():
+        affected = {row['field_id'] for row in inserts.values()} | {row['field_id'] for row in updates.values()}
+        if inserts:
+            inserted = db.session.execute(
+                insert(CropHistory).returning(
+                    CropHistory.id, CropHistory.field_id, CropHistory.year, CropHistory.season,
+                    sort_by_parameter_order=True
+                ),
+                list(inserts.values())
+            )
+            for history_id, field_id, year, season in inserted:
+                existing[(field_id, year, season)] = history_id
+        if updates:
+            # executemany возможен только для строк с одинаковым набором колонок (notes - необязательная)
+            for statement, has_notes in ((_UPDATE_WITH_NOTES, True), (_UPDATE_WITHOUT_NOTES, False)):
+                rows = [row for row in updates.values() if ('notes' in row) == has_notes]
+                if rows:
+                    db.session.execute(statement, rows)
+        db.session.commit()
+        progress['inserted'] += len(inserts)
+        progress['updated'] += len(updates)
+        inserts.clear()
+        updates.clear()
+        if on_commit is not None:
+            on_commit(affected)
+
+    try:
+        for number, record in records:
+            progress['processed'] += 1
+            if isinstance(record, Exception):
+                reject(number, None, str(record))
+                continue
+            try:
+                row = history_row(record, crops, fields, crop_ids, field_ids)
+            except ValueError as e:
+                reject(number, record, str(e))
+                continue
+            key = (row['field_id'], row['year'], row['season'])
+            history_id = existing.get(key)
+            if history_id is None:
+                inserts[key] = dict({'notes': ''}, **row)
+            else:
+                updates[history_id] = dict(updates.get(history_id, {}), b_id=history_id, **row)
+            if len(inserts) + len(updates) >= batch_size:
+                flush()
+                yield dict(progress)
+        if inserts or updates:
+            flush()
+    except Exception as e:
+        db.session.rollback()
+        progress['error'] = str(e)
+    progress['done'] = True
+    yield progress
+
+
+def main(argv=None) -> int:
+    """Загрузка истории посевов из файла: python history_import.py history.csv [--rejects rejects.csv]"""
+    from flask import Flask
+    from config import init_app_db
+    from response_cache import response_cache
+
+    parser = argparse.ArgumentParser(
+        prog='python history_import.py', description='Загрузка истории посевов',
+        epilog='Кэш ответов веб-приложения сбрасывается только через общую базу RESPONSE_CACHE_DB '
+               '(тот же путь, что у воркеров). Без нее веб-приложение отдает прежнюю историю '
+               'до истечения RESPONSE_CACHE_TTL.'
+    )
+    parser.add_argument('path', help='CSV (field_name, crop_name, year, season, notes) или NDJSON')
+    parser.add_argument('--format', choices=HISTORY_FORMATS, help='по умолчанию - по расширению файла')
+    parser.add_argument('--batch-size', type=int, default=HISTORY_BATCH_SIZE)
+    parser.add_argument('--rejects', help='файл CSV для отклоненных строк (номер, причина, запись)')
+    args = parser.parse_args(argv)
+    fmt = args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    scope_warning = response_cache.scope_warning()
+    if scope_warning:
+        print(f"Внимание: {scope_warning}")
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_app_db(app)
+    # Отчет до начала загрузки: ошибка открытия файлов или чтения справочников тоже попадает в него
+    progress = {'errors': []}
+    rejects_file = None
+    try:
+        rejects_file = open(args.rejects, 'w', newline='', encoding='utf-8') if args.rejects else None
+        rejects_writer = csv.writer(rejects_file) if rejects_file else None
+
+        def on_reject(number, record, reason):
+            if rejects_writer is not None:
+                rejects_writer.writerow([number, reason, json.dumps(record, ensure_ascii=False)])
+
+        with app.app_context(), open(args.path, 'rb') as stream:
+            records = iter_history_records(stream, fmt)
+            for progress in import_crop_history(records, args.batch_size, on_reject=on_reject):
+                print(f"Обработано {progress['processed']}: добавлено {progress['inserted']}, "
+                      f"обновлено {progress['updated']}, отклонено {progress['rejected']}")
+    except Exception as e:
+        progress = dict(progress, error=str(e))
+    finally:
+        if rejects_file is not None:
+            rejects_file.close()
+    response_cache.invalidate('crop_history')
+    for error in progress['errors'][:10]:
+        print(f"  строка {error['row']}: {error['error']}")
+    if 'error' in progress:
+        print(f"Загрузка прервана: {progress['error']}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+from sqlalchemy import inspect, text
+from config import db
+from models import Field
+from price_history import backfill_price_observations
+from spatial_index import ensure_spatial_index
+
+
+def run_migrations():
+    """Создание таблиц и миграции схемы (идемпотентно). Вызывается в контексте приложения:
+    при импорте app (AUTO_MIGRATE=1) или отдельным шагом: python utils.py migrate"""
+    try:
+        db.create_all()
+        db.create_all(bind_key='users')
+        print("Таблицы базы данных успешно созданы")
+        
+        # Миграция: добавление колонки last_price_update, если её нет
+        try:
+            inspector = inspect(db.engine)
+            columns = [col['name'] for col in inspector.get_columns('crops')]
+            
+            if 'last_price_update' not in columns:
+                print("Добавление колонки last_price_update в таблицу crops...")
+                with db.engine.connect() as conn:
+                    conn.execute(text("ALTER TABLE crops ADD COLUMN last_price_update DATETIME"))
+                    conn.commit()
+                print("Колонка last_price_update успешно добавлена")
+                
+                # Устанавливаем старую дату (25 часов назад) для существующих записей
+                # Это позволит системе сразу обновить цены при первом запуске
+                with db.engine.connect() as conn:
+                    # Обновляем все записи, у которых дата NULL или очень свежая (вероятно, из предыдущей миграции)
+                    conn.execute(text("""
+                        UPDATE crops 
+                        SET last_price_update = datetime('now', '-25 hours') 
+                        WHERE last_price_update IS NULL 
+                           OR datetime(last_price_update) > datetime('now', '-1 hour')
+                    """))
+                    conn.commit()
+                print("Установлена дата обновления для существующих записей (25 часов назад для немедленного обновления)")
+            
+            # Геометрические характеристики полей, вычисляемые на сервере
+            field_columns = [col['name'] for col in inspector.get_columns('fields')]
+            geometry_columns = {
+                'centroid_lat': 'FLOAT', 'centroid_lon': 'FLOAT',
+                'bbox_min_lon': 'FLOAT', 'bbox_min_lat': 'FLOAT', 'bbox_max_lon': 'FLOAT', 'bbox_max_lat': 'FLOAT',
+                'geometry_lod': 'TEXT'
+            }
+            missing_columns = [name for name in geometry_columns if name not in field_columns]
+            if missing_columns:
+                print(f"Добавление колонок {', '.join(missing_columns)} в таблицу fields...")
+                with db.engine.connect() as conn:
+                    for name in missing_columns:
+                        conn.execute(text(f"ALTER TABLE fields ADD COLUMN {name} {geometry_columns[name]}"))
+                    conn.commit()
+            
+            # Заполнение площади, центроида, bbox и упрощенных геометрий для полей, сохраненных до их появления,
+            # и снятие обертки Feature/FeatureCollection с ранее сохраненных геометрий
+            fields_to_backfill = Field.query.filter(
+                (Field.centroid_lat.is_(None)) | (Field.geometry_lod.is_(None)) | Field.geometry.contains('Feature')
+            ).all()
+            for field in fields_to_backfill:
+                try:
+                    field.set_geometry(field.geometry)
+                except Exception as geometry_error:
+                    print(f"Не удалось вычислить геометрию поля {field.id}: {geometry_error}")
+            if fields_to_backfill:
+                db.session.commit()
+                print(f"Геометрия пересчитана для {len(fields_to_backfill)} полей")
+            
+            # Пространственный индекс (SQLite R*Tree) для запросов по bbox
+            ensure_spatial_index(db.engine)
+            
+            # Составные индексы истории посевов для keyset-пагинации (year desc, id desc)
+            with db.engine.connect() as conn:
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_crop_history_field_year_id ON crop_history (field_id, year, id)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_crop_history_year_id ON crop_history (year, id)"))
+                conn.commit()
+            
+            # История цен: текущие цены культур как первые наблюдения
+            backfilled = backfill_price_observations()
+            if backfilled:
+                print(f"История цен начата для {backfilled} культур")
+        except Exception as migration_error:
+            print(f"Предупреждение при миграции: {migration_error}")
+            
+    except Exception as e:
+        print(f"Предупреждение при создании таблиц: {e}")
@@ -0,0 +1,406 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func, select
+from config import db, get_model_versions_dir
+from models import Crop, CropHistory, Field
+from price_scheduler import ProcessLock
+
+# Фоновое переобучение рекомендательной модели на истории посевов пользователей.
+# Переходы культур на полях (предшественник -> культура) добавляют в обучение сочетания культур,
+# предшественников и климатических зон, которых нет в CSV. Наблюдаемого результата рекомендации
+# в истории нет, поэтому тип рекомендации для них выводится из правил севооборота (label_transition),
+# и на этих примерах модель не оценивается. Новая версия обучается в отдельном процессе; она принимается,
+# если на отложенной выборке CSV (экспертные метки, общие для всех версий) не хуже текущей,
+# и подменяется в работающем процессе. Версии хранятся для отката.
+
+# Сколько изменений истории (новых и удаленных записей) нужно для автоматического переобучения
+RETRAIN_MIN_NEW_OBSERVATIONS = int(os.getenv('RETRAIN_MIN_OBSERVATIONS', '200'))
+# Допустимое снижение точности новой версии относительно текущей на отложенной выборке CSV
+# (проверка от ухудшения, а не оценка пользы примеров из истории)
+RETRAIN_MAX_ACCURACY_DROP = 0.02
+# Как часто (сек) проверять необходимость переобучения после записи истории
+RETRAIN_CHECK_INTERVAL = 60
+# Сколько последних артефактов хранить (активная версия не удаляется)
+MODEL_VERSIONS_KEEP = 5
+# Как часто (сек) воркеры сверяют активную версию с versions.json
+VERSION_SYNC_INTERVAL = 30
+
+DEFAULT_SOIL_TYPE = 'чернозем'
+
+# Скрипт обучения в дочернем процессе
+TRAINING_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_training_worker.py')
+
+
+def label_transition(previous_category: str, previous_crop: str, category: str, crop: str) -> str:
+    """Тип рекомендации для перехода предшественник -> культура по правилам севооборота:
+    повтор культуры или овощи после овощей - защита растений, зерновые после зерновых - удобрение,
+    смена группы культур или посев после бобовых - севооборот, иначе - обработка почвы.
+    Метка эвристическая (не наблюдаемый результат), такие примеры используются только для обучения"""
+    if crop == previous_crop or (category == previous_category == 'овощные'):
+        return 'защита растений'
+    if category == previous_category == 'зерновые':
+        return 'удобрение'
+    if previous_category == 'бобовые' or category != previous_category:
+        return 'севооборот'
+    return 'обработка почвы'
+
+
+def export_history_observations(recommender) -> Tuple[List[Dict], int]:
+    """Размеченные примеры из истории посевов (в контексте приложения) и id последней записи истории.
+    Признаки вычисляются так же, как при выдаче рекомендаций полю"""
+    rows = db.session.execute(
+        select(
+            CropHistory.id, CropHistory.field_id, CropHistory.season, Crop.name,
+            Field.centroid_lat, Field.centroid_lon, Field.geometry
+        )
+        .join(Crop, CropHistory.crop_id == Crop.id)
+        .join(Field, CropHistory.field_id == Field.id)
+        .order_by(CropHistory.field_id, CropHistory.year, CropHistory.id)
+    )
+    observations = []
+    last_id = 0
+    previous = None
+    climate_zones = {}
+    for history_id, field_id, season, crop, lat, lon, geometry in rows:
+        last_id = max(last_id, history_id)
+        if previous is not None and previous[0] == field_id:
+            if field_id not in climate_zones:
+                center = (lat, lon) if lat is not None else recommender.get_field_center(geometry)
+                climate_zones[field_id] = recommender.get_climate_zone_from_coords(*center)
+            previous_crop = previous[1]
+            previous_category = recommender.get_crop_category(previous_crop)
+            category = recommender.get_crop_category(crop)
+            observations.append({
+                'crop': crop,
+                'climate_zone': climate_zones[field_id],
+                'soil_type': DEFAULT_SOIL_TYPE,
+                'last_crop_category': previous_category,
+                'last_crop': previous_crop,
+                'season': season or 'весна-лето',
+                'recommendation_type': label_transition(previous_category, previous_crop, category, crop)
+            })
+        previous = (field_id, crop)
+    return observations, last_id
+
+
+def train_candidate(csv_path: str, observations: List[Dict], work_dir: str) -> Dict:
+    """Обучение новой версии в отдельном процессе (model_training_worker.py): артефакт и отложенная выборка.
+    Дочерний процесс не импортирует приложение и не наследует потоки и соединения веб-процесса"""
+    import joblib
+    os.makedirs(work_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        observations_path = os.path.join(tmp, 'observations.joblib')
+        result_path = os.path.join(tmp, 'result.joblib')
+        joblib.dump(observations, observations_path)
+        subprocess.run(
+            [sys.executable, TRAINING_WORKER, os.path.abspath(csv_path), observations_path, result_path],
+            check=True
+        )
+        return joblib.load(result_path)
+
+
+class ModelRegistry:
+    """Версии модели в каталоге: v<N>.joblib и versions.json с метриками и активной версией"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or get_model_versions_dir()
+        self.index_path = os.path.join(self.directory, 'versions.json')
+
+    def lock(self) -> ProcessLock:
+        # Одно переобучение или откат одновременно на все процессы
+        return ProcessLock(os.path.join(self.directory, 'retrain.lock'))
+
+    def load(self) -> Dict:
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'active': None, 'versions': []}
+
+    def mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.index_path)
+        except OSError:
+            return None
+
+    def _save(self, index: Dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def artifact_path(self, version: int) -> str:
+        return os.path.join(self.directory, f'v{version}.joblib')
+
+    def add(self, artifact: Dict, info: Dict) -> Dict:
+        """Сохранение новой версии (артефакт пишется только для принятых версий)"""
+        index = self.load()
+        version = max([v['version'] for v in index['versions']], default=0) + 1
+        entry = dict(info, version=version, created_at=datetime.utcnow().isoformat())
+        if entry.get('status') == 'accepted':
+            import joblib
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.artifact_path(version)
+            joblib.dump(artifact, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            entry['artifact'] = os.path.basename(path)
+        index['versions'].append(entry)
+        self._prune(index)
+        self._save(index)
+        return entry
+
+    def _prune(self, index: Dict) -> None:
+        stored = [v for v in index['versions'] if v.get('artifact')]
+        for entry in stored[:-MODEL_VERSIONS_KEEP]:
+            if entry['version'] == index.get('active'):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, entry['artifact']))
+            except FileNotFoundError:
+                pass
+            entry['artifact'] = None
+
+    def set_active(self, version: int) -> None:
+        index = self.load()
+        index['active'] = version
+        self._save(index)
+
+    def get(self, version: int) -> Optional[Dict]:
+        return next((v for v in self.load()['versions'] if v['version'] == version), None)
+
+    def load_artifact(self, version: int) -> Dict:
+        import joblib
+        entry = self.get(version)
+        if entry is None or not entry.get('artifact'):
+            raise LookupError(f"Артефакт версии {version} не найден")
+        return joblib.load(os.path.join(self.directory, entry['artifact']), mmap_mode='r')
+
+
+class ModelRetrainer:
+    """Переобучение в фоне (обучение - в отдельном процессе), проверка на отложенной выборке,
+    подмена модели в глобальном recommender, откат и синхронизация версии между воркерами"""
+
+    def __init__(self, app, registry: Optional[ModelRegistry] = None):
+        self.app = app
+        self.registry = registry or ModelRegistry()
+        self.lock = threading.Lock()
+        # Установленная в процессе версия и состояние синхронизации с versions.json: меняются
+        # потоком переобучения (_activate) и потоками запросов (sync) только под этой блокировкой
+        self.version_lock = threading.Lock()
+        self.running = False
+        self.last_check = 0.0
+        self.last_result = None
+        self.installed_version = None
+        self.synced_mtime = None
+        self.last_sync = 0.0
+
+    @staticmethod
+    def _recommender():
+        from neural_network_recommender import recommender
+        return recommender
+
+    def start(self, force: bool = False) -> bool:
+        """Запуск переобучения в фоновом потоке. Без force - не чаще RETRAIN_CHECK_INTERVAL и только
+        при достаточном числе новых записей истории. False - переобучение уже идет или проверка отложена"""
+        with self.lock:
+            now = time.monotonic()
+            if self.running or (not force and now - self.last_check < RETRAIN_CHECK_INTERVAL):
+                return False
+            self.running = True
+            self.last_check = now
+        threading.Thread(target=self._run, args=(force,), name='model-retrain', daemon=True).start()
+        return True
+
+    def _history_changes(self) -> int:
+        """Число изменений истории с последнего обучения: новые записи и удаленные
+        (по числу записей, которое было при обучении)"""
+        index = self.registry.load()
+        last = max(index['versions'], key=lambda v: (v.get('last_history_id', 0), v['version']), default={})
+        last_id = last.get('last_history_id', 0)
+        added = db.session.query(func.count(CropHistory.id)).filter(CropHistory.id > last_id).scalar()
+        kept = db.session.query(func.count(CropHistory.id)).filter(CropHistory.id <= last_id).scalar()
+        deleted = max(0, last.get('history_rows', kept) - kept)
+        return added + deleted
+
+    def _run(self, force: bool) -> None:
+        try:
+            with self.app.app_context():
+                self.last_result = self.retrain(force)
+        except Exception as e:
+            print(f"[ПЕРЕОБУЧЕНИЕ] Ошибка: {e}")
+            self.last_result = {'status': 'failed', 'error': str(e)}
+        finally:
+            with self.lock:
+                self.running = False
+
+    def retrain(self, force: bool = False) -> Dict:
+        """Синхронное переобучение (в контексте приложения); обучение - в дочернем процессе"""
+        with self.registry.lock() as acquired:
+            if not acquired:
+                return {'status': 'busy'}
+            if not force and self._history_changes() < RETRAIN_MIN_NEW_OBSERVATIONS:
+                return {'status': 'skipped'}
+
+            recommender = self._recommender()
+            observations, last_history_id = export_history_observations(recommender)
+            history_rows = db.session.query(func.count(CropHistory.id)).filter(CropHistory.id <= last_history_id).scalar()
+            db.session.remove()  # соединение не держим на время обучения
+            started = time.monotonic()
+            print(f"[ПЕРЕОБУЧЕНИЕ] Обучение на CSV и {len(observations)} примерах из истории посевов...")
+            result = train_candidate(recommender.csv_path, observations, self.registry.directory)
+            duration = time.monotonic() - started
+
+            artifact, holdout = result['artifact'], result['holdout']
+            candidate_accuracy = artifact['metrics']['holdout_accuracy']
+            current_accuracy = None
+            if recommender.is_trained or recommender.load_model():
+                current_accuracy = recommender.evaluate(holdout)
+                self._register_baseline(recommender)
+            accepted = current_accuracy is None or candidate_accuracy >= current_accuracy - RETRAIN_MAX_ACCURACY_DROP
+
+            entry = self.registry.add(artifact, {
+                'status': 'accepted' if accepted else 'rejected',
+                'source': 'history',
+                'duration_seconds': round(duration, 2),
+                'holdout_accuracy': candidate_accuracy,
+                'previous_holdout_accuracy': current_accuracy,
+                'train_accuracy': artifact['metrics']['train_accuracy'],
+                'samples': artifact['metrics']['samples'],
+                'history_observations': len(observations),
+                'last_history_id': last_history_id,
+                'history_rows': history_rows
+            })
+            if accepted:
+                self._activate(entry['version'], artifact)
+            print(f"[ПЕРЕОБУЧЕНИЕ] Версия {entry['version']} {'принята' if accepted else 'отклонена'}: "
+                  f"точность на отложенной выборке CSV {candidate_accuracy:.3f} (текущая {current_accuracy}), {duration:.1f} с")
+            return entry
+
+    def _register_baseline(self, recommender) -> None:
+        # Модель, обученная только на CSV, - первая версия, чтобы к ней можно было откатиться
+        if self.registry.load()['versions']:
+            return
+        metrics = recommender.metrics
+        entry = self.registry.add(recommender.export_artifact(), {
+            'status': 'accepted',
+            'source': 'baseline',
+            'holdout_accuracy': metrics.get('holdout_accuracy'),
+            'train_accuracy': metrics.get('train_accuracy'),
+            'samples': metrics.get('samples'),
+            'duration_seconds': metrics.get('duration_seconds'),
+            'history_observations': 0,
+            'last_history_id': 0
+        })
+        self.registry.set_active(entry['version'])
+        with self.version_lock:
+            self.installed_version = entry['version']
+
+    def _activate(self, version: int, artifact: Dict) -> None:
+        recommender = self._recommender()
+        with self.version_lock:
+            recommender.install_artifact(artifact)
+            # Основной артефакт - для воркеров, которые запустятся позже
+            recommender.save_model()
+            self.registry.set_active(version)
+            self.installed_version = version
+            self.synced_mtime = self.registry.mtime()
+
+    def rollback(self, version: Optional[int] = None) -> Dict:
+        """Возврат к указанной (по умолчанию - предыдущей принятой) версии"""
+        with self.registry.lock() as acquired:
+            if not acquired:
+                raise RuntimeError("Переобучение или откат уже выполняется")
+            if version is None:
+                index = self.registry.load()
+                active = index.get('active') or 0
+                previous = [v['version'] for v in index['versions'] if v.get('artifact') and v['version'] < active]
+                if not previous:
+                    raise LookupError("Нет предыдущей версии для отката")
+                version = max(previous)
+            self._activate(version, self.registry.load_artifact(version))
+            print(f"[ПЕРЕОБУЧЕНИЕ] Активна версия {version}")
+            return self.registry.get(version)
+
+    def sync(self) -> None:
+        """Подхват версии, активированной другим процессом (не чаще VERSION_SYNC_INTERVAL).
+        Запрос не ждет: если версию сейчас меняет другой поток, проверка пропускается"""
+        if not self.version_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if now - self.last_sync < VERSION_SYNC_INTERVAL:
+                return
+            self.last_sync = now
+            mtime = self.registry.mtime()
+            if mtime is None or mtime == self.synced_mtime:
+                return
+            first_sync = self.synced_mtime is None
+            self.synced_mtime = mtime
+            active = self.registry.load().get('active')
+            if first_sync and self.installed_version is None:
+                # Процесс загрузил основной артефакт, сохраненный при активации этой версии
+                self.installed_version = active
+                return
+            if active is not None and active != self.installed_version:
+                try:
+                    self._recommender().install_artifact(self.registry.load_artifact(active))
+                    self.installed_version = active
+                    print(f"[ПЕРЕОБУЧЕНИЕ] Процесс {os.getpid()} перешел на версию {active}")
+                except Exception as e:
+                    print(f"[ПЕРЕОБУЧЕНИЕ] Не удалось загрузить версию {active}: {e}")
+        finally:
+            self.version_lock.release()
+
+    def status(self) -> Dict:
+        index = self.registry.load()
+        return {
+            'active': index.get('active'),
+            'installed': self.installed_version,
+            'running': self.running,
+            'last_result': self.last_result,
+            'versions': index['versions']
+        }
+
+
+def main(argv=None) -> int:
+    """Переобучение и управление версиями модели:
+    python model_retraining.py retrain [--force] | versions | rollback [версия]"""
+    from flask import Flask
+    from config import init_app_db
+
+    parser = argparse.ArgumentParser(prog='python model_retraining.py', description='Версии рекомендательной модели')
+    commands = parser.add_subparsers(dest='command', required=True)
+    retrain = commands.add_parser('retrain', help='переобучить на истории посевов')
+    retrain.add_argument('--force', action='store_true', help='независимо от числа новых записей истории')
+    commands.add_parser('versions', help='список версий')
+    rollback = commands.add_parser('rollback', help='вернуть предыдущую или указанную версию')
+    rollback.add_argument('version', type=int, nargs='?')
+    args = parser.parse_args(argv)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_app_db(app)
+    retrainer = ModelRetrainer(app)
+    with app.app_context():
+        if args.command == 'retrain':
+            result = retrainer.retrain(force=args.force)
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+            return 0 if result.get('status') in ('accepted', 'skipped') else 1
+        if args.command == 'rollback':
+            print(json.dumps(retrainer.rollback(args.version), ensure_ascii=False, indent=2))
+            return 0
+        print(json.dumps(retrainer.registry.load(), ensure_ascii=False, indent=2))
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
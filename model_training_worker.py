@@ -0,0 +1,23 @@
+import sys
+import joblib
+
+# Обучение новой версии рекомендательной модели в отдельном процессе (запускает model_retraining):
+#   python model_training_worker.py <crop_climate_data.csv> <примеры.joblib> <результат.joblib>
+# Импортируется только ML-модуль: приложение, миграции и планировщик цен в процессе обучения
+# не запускаются, независимо от того, как запущен веб-процесс (python app.py, gunicorn, cron).
+
+
+def main(argv=None) -> int:
+    csv_path, observations_path, result_path = argv if argv is not None else sys.argv[1:]
+    import pandas as pd
+    from neural_network_recommender import ModelTrainer
+
+    observations = joblib.load(observations_path)
+    extra = pd.DataFrame(observations) if observations else None
+    artifact, holdout = ModelTrainer(csv_path).train(extra_data=extra)
+    joblib.dump({'artifact': artifact, 'holdout': holdout}, result_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,10 @@
+import json
 from datetime import datetime
 from config import db
+from geometry import (
+	build_zoom_levels, compute_geometry_metrics, encode_geometry, parse_geometry, simplified_geometry_json,
+	SIMPLIFY_ZOOM_BANDS
+)
 from werkzeug.security import generate_password_hash, check_password_hash
 
 
@@ -10,17 +15,70 @@ class Field(db.Model):
 	geometry = db.Column(db.Text, nullable=False)
 	area = db.Column(db.Float)
 	created_at = db.Column(db.DateTime, default=datetime.utcnow)
+	# Вычисляются на сервере при сохранении геометрии (см. set_geometry)
+	centroid_lat = db.Column(db.Float)
+	centroid_lon = db.Column(db.Float)
+	bbox_min_lon = db.Column(db.Float)
+	bbox_min_lat = db.Column(db.Float)
+	bbox_max_lon = db.Column(db.Float)
+	bbox_max_lat = db.Column(db.Float)
+	# Упрощенные геометрии по полосам масштабов: JSON {"<max_zoom>": "<GeoJSON>"}
+	geometry_lod = db.Column(db.Text)
 
 	crop_history = db.relationship('CropHistory', backref='field', lazy=True, cascade='all, delete-orphan')
 
-	def to_dict(self):
-		return {
+	def set_geometry(self, geometry):
+		"""Сохранить геометрию и пересчитать площадь, центроид и bbox (Polygon/MultiPolygon).
+		Feature (и FeatureCollection из одного объекта) сохраняется как геометрия без обертки"""
+		geometry = parse_geometry(geometry)
+		metrics = compute_geometry_metrics(geometry)
+		self.geometry = json.dumps(geometry)
+		for name, value in metrics.items():
+			setattr(self, name, value)
+		self.geometry_lod = json.dumps(build_zoom_levels(geometry))
+
+	def geometry_for(self, zoom=None, tolerance=None):
+		"""Геометрия для масштаба карты (предвычисленная полоса) или для произвольного допуска"""
+		if tolerance:
+			return simplified_geometry_json(self.geometry, float(tolerance))
+		if zoom is not None and self.geometry_lod:
+			levels = json.loads(self.geometry_lod)
+			for max_zoom, _ in SIMPLIFY_ZOOM_BANDS:
+				if zoom <= max_zoom and str(max_zoom) in levels:
+					return levels[str(max_zoom)]
+		return self.geometry
+
+	@property
+	def centroid(self):
+		"""Центроид (широта, долгота) или None, если не вычислен"""
+		if self.centroid_lat is None or self.centroid_lon is None:
+			return None
+		return self.centroid_lat, self.centroid_lon
+
+	@property
+	def bbox(self):
+		"""Ограничивающий прямоугольник [min_lon, min_lat, max_lon, max_lat] или None"""
+		if self.bbox_min_lon is None:
+			return None
+		return [self.bbox_min_lon, self.bbox_min_lat, self.bbox_max_lon, self.bbox_max_lat]
+
+	def to_dict(self, zoom=None, tolerance=None, encoding=None, include_geometry=True):
+		"""zoom/tolerance - упрощенная геометрия; encoding='polyline' - компактная геометрия
+		в geometry_encoded вместо GeoJSON в geometry; include_geometry=False - без геометрии"""
+		data = {
 			'id': self.id,
 			'name': self.name,
-			'geometry': self.geometry,
+			'geometry': self.geometry_for(zoom, tolerance) if include_geometry else None,
 			'area': self.area,
+			'centroid': list(self.centroid) if self.centroid else None,
+			'bbox': self.bbox,
 			'created_at': self.created_at.isoformat() if self.created_at else None
 		}
+		if not include_geometry:
+			del data['geometry']
+		elif encoding == 'polyline':
+			data['geometry_encoded'] = encode_geometry(data.pop('geometry'))
+		return data
 
 
 class Crop(db.Model):
@@ -49,6 +107,63 @@ class Crop(db.Model):
 		}
 
 
+class PriceObservation(db.Model):
+	"""Наблюдение цены культуры (только добавление; текущая цена также хранится в Crop)"""
+	__tablename__ = 'price_observations'
+	id = db.Column(db.Integer, primary_key=True)
+	crop_id = db.Column(db.Integer, db.ForeignKey('crops.id'), nullable=False)
+	source = db.Column(db.String(50), nullable=False)
+	observed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+	market_price_per_ton = db.Column(db.Float)
+	seed_price_per_kg = db.Column(db.Float)
+
+	__table_args__ = (
+		db.Index('ix_price_observations_crop_observed', 'crop_id', 'observed_at'),
+	)
+
+	def to_dict(self):
+		return {
+			'id': self.id,
+			'crop_id': self.crop_id,
+			'source': self.source,
+			'observed_at': self.observed_at.isoformat() if self.observed_at else None,
+			'market_price_per_ton': self.market_price_per_ton,
+			'seed_price_per_kg': self.seed_price_per_kg
+		}
+
+
+class PriceRollup(db.Model):
+	"""Агрегат наблюдений цен за период (day/week/month), обновляется при каждой записи наблюдений"""
+	__tablename__ = 'price_rollups'
+	crop_id = db.Column(db.Integer, db.ForeignKey('crops.id'), primary_key=True)
+	bucket = db.Column(db.String(10), primary_key=True)
+	period_start = db.Column(db.DateTime, primary_key=True)
+	observations = db.Column(db.Integer, nullable=False, default=0)
+	market_sum = db.Column(db.Float, nullable=False, default=0)
+	market_min = db.Column(db.Float)
+	market_max = db.Column(db.Float)
+	market_last = db.Column(db.Float)
+	seed_sum = db.Column(db.Float, nullable=False, default=0)
+	seed_min = db.Column(db.Float)
+	seed_max = db.Column(db.Float)
+	seed_last = db.Column(db.Float)
+	last_observed_at = db.Column(db.DateTime)
+
+	def to_dict(self):
+		return {
+			'period_start': self.period_start.isoformat(),
+			'observations': self.observations,
+			'market_price_avg': round(self.market_sum / self.observations, 2) if self.observations else None,
+			'market_price_min': self.market_min,
+			'market_price_max': self.market_max,
+			'market_price_last': self.market_last,
+			'seed_price_avg': round(self.seed_sum / self.observations, 2) if self.observations else None,
+			'seed_price_min': self.seed_min,
+			'seed_price_max': self.seed_max,
+			'seed_price_last': self.seed_last
+		}
+
+
 class CropHistory(db.Model):
 	__tablename__ = 'crop_history'
 	id = db.Column(db.Integer, primary_key=True)
@@ -61,6 +176,53 @@ class CropHistory(db.Model):
 
 	crop = db.relationship('Crop', backref='history')
 
+	# Индексы под сортировку (year desc, id desc) с фильтром по полю и без него
+	__table_args__ = (
+		db.Index('ix_crop_history_field_year_id', 'field_id', 'year', 'id'),
+		db.Index('ix_crop_history_year_id', 'year', 'id'),
+	)
+
+	@staticmethod
+	def listing_query(field_id=None, after_year=None, after_id=None):
+		"""Проекция истории с названиями поля и культуры одним запросом, порядок (year desc, id desc).
+		after_year/after_id - ключ последней строки предыдущей страницы (keyset-пагинация)"""
+		query = db.session.query(
+			CropHistory.id,
+			CropHistory.field_id,
+			Field.name.label('field_name'),
+			CropHistory.crop_id,
+			Crop.name.label('crop_name'),
+			CropHistory.year,
+			CropHistory.season,
+			CropHistory.notes,
+			CropHistory.created_at
+		).outerjoin(Field, CropHistory.field_id == Field.id).outerjoin(Crop, CropHistory.crop_id == Crop.id)
+		if field_id:
+			query = query.filter(CropHistory.field_id == field_id)
+		if (after_year is None) != (after_id is None):
+			raise ValueError("Ключ страницы задается парой after_year и after_id")
+		if after_year is not None:
+			query = query.filter(db.or_(
+				CropHistory.year < after_year,
+				db.and_(CropHistory.year == after_year, CropHistory.id < after_id)
+			))
+		return query.order_by(CropHistory.year.desc(), CropHistory.id.desc())
+
+	@staticmethod
+	def listing_row_to_dict(row):
+		"""Строка из listing_query в формате to_dict"""
+		return {
+			'id': row.id,
+			'field_id': row.field_id,
+			'field_name': row.field_name,
+			'crop_id': row.crop_id,
+			'crop_name': row.crop_name,
+			'year': row.year,
+			'season': row.season,
+			'notes': row.notes,
+			'created_at': row.created_at.isoformat() if row.created_at else None
+		}
+
 	def to_dict(self):
 		return {
 			'id': self.id,
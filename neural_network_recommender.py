@@ -3,90 +3,302 @@ import numpy as np
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
+import gc
 import os
 import json
 import random
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import joblib
+from types import MappingProxyType
+from geometry import centroid
+
+# Версия формата сохраненной модели (увеличивать при изменении структуры артефакта)
+MODEL_ARTIFACT_VERSION = 1
+
+# Категориальные признаки модели в порядке столбцов матрицы (last_crop - если есть в данных)
+CATEGORICAL_FEATURES = ('crop', 'climate_zone', 'soil_type', 'last_crop_category', 'season')
+
+# Значения признаков по умолчанию при инференсе
+FEATURE_DEFAULTS = MappingProxyType({'soil_type': 'чернозем', 'season': 'весна-лето'})
+
+# Кэш готовых рекомендаций по состоянию поля: число записей и время жизни записи (сек)
+RECOMMENDATION_CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', '2048'))
+RECOMMENDATION_CACHE_TTL = float(os.getenv('RECOMMENDATION_CACHE_TTL', '3600'))
+
+
+class InferenceEncoder:
+    """Неизменяемый кодировщик признаков для инференса.
+    Категории переводятся сразу в отмасштабированные значения через словари, неизвестные значения
+    попадают в отдельную корзину (код len(classes_)). Не использует pandas и не меняет энкодеры модели."""
+    __slots__ = ('feature_names', 'class_names', '_maps', '_unknown')
+
+    def __init__(self, label_encoders, scaler, model_classes):
+        feature_names = CATEGORICAL_FEATURES + (('last_crop',) if 'last_crop' in label_encoders else ())
+        mean = scaler.mean_ if getattr(scaler, 'mean_', None) is not None else np.zeros(len(feature_names))
+        scale = scaler.scale_ if getattr(scaler, 'scale_', None) is not None else np.ones(len(feature_names))
+
+        maps = []
+        unknown = []
+        for i, feature in enumerate(feature_names):
+            classes = label_encoders[feature].classes_
+            maps.append(MappingProxyType({
+                str(value): float((code - mean[i]) / scale[i]) for code, value in enumerate(classes)
+            }))
+            unknown.append(float((len(classes) - mean[i]) / scale[i]))
+
+        # Название типа рекомендации для каждого столбца predict_proba
+        type_classes = label_encoders['recommendation_type'].classes_
+        class_names = tuple(str(type_classes[c]) for c in model_classes)
+
+        object.__setattr__(self, 'feature_names', feature_names)
+        object.__setattr__(self, 'class_names', class_names)
+        object.__setattr__(self, '_maps', tuple(maps))
+        object.__setattr__(self, '_unknown', tuple(unknown))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("InferenceEncoder неизменяем")
+
+    def transform(self, rows):
+        """Матрица признаков для predict_proba.
+        rows - последовательность кортежей или двумерный массив NumPy в порядке feature_names"""
+        if isinstance(rows, np.ndarray):
+            rows = rows.tolist()
+        X = np.empty((len(rows), len(self.feature_names)), dtype=np.float64)
+        for j, (mapping, unknown) in enumerate(zip(self._maps, self._unknown)):
+            get = mapping.get
+            X[:, j] = [get(row[j], unknown) for row in rows]
+        return X
+
+
+def build_text_index(df):
+    """Неизменяемый индекс текстов рекомендаций для поиска без сканирования CSV"""
+    by_last_crop = {}
+    by_category = {}
+    by_zone = {}
+    has_last_crop = 'last_crop' in df.columns
+    columns = ['crop', 'climate_zone', 'last_crop_category', 'recommendation_type', 'recommendation_text']
+    if has_last_crop:
+        columns.append('last_crop')
+    for row in df[columns].itertuples(index=False):
+        text = row.recommendation_text
+        if has_last_crop:
+            by_last_crop.setdefault((row.crop, row.climate_zone, row.last_crop, row.recommendation_type), []).append(text)
+        by_category.setdefault((row.crop, row.climate_zone, row.last_crop_category, row.recommendation_type), []).append(text)
+        by_zone.setdefault((row.crop, row.climate_zone), []).append(text)
+
+    def freeze(index):
+        return MappingProxyType({key: tuple(texts) for key, texts in index.items()})
+
+    return MappingProxyType({
+        'last_crop': freeze(by_last_crop),
+        'last_crop_category': freeze(by_category),
+        'climate_zone': freeze(by_zone)
+    })
+
+
+class InferenceSnapshot:
+    """Неизменяемый снимок обученной модели: модель, энкодеры, кодировщик признаков, индекс текстов
+    и версия. Один снимок читают все потоки без блокировок; новая модель - новый снимок, который
+    подменяет прежний одним присваиванием. Загруженный до fork снимок воркеры разделяют copy-on-write"""
+    __slots__ = ('model', 'label_encoders', 'scaler', 'encoder', 'csv_hash', 'metrics', 'texts', 'texts_mtime', 'version')
+
+    def __init__(self, artifact, texts, texts_mtime, version):
+        model = artifact['model']
+        values = {
+            'model': model,
+            'label_encoders': MappingProxyType(dict(artifact['label_encoders'])),
+            'scaler': artifact['scaler'],
+            'encoder': InferenceEncoder(artifact['label_encoders'], artifact['scaler'], model.classes_),
+            'csv_hash': artifact['csv_hash'],
+            'metrics': MappingProxyType(dict(artifact.get('metrics') or {})),
+            'texts': texts,
+            'texts_mtime': texts_mtime,
+            'version': version
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("InferenceSnapshot неизменяем")
+
+    def with_texts(self, texts, texts_mtime):
+        """Тот же снимок модели с новым индексом текстов (после изменения CSV)"""
+        snapshot = object.__new__(InferenceSnapshot)
+        for name in self.__slots__:
+            object.__setattr__(snapshot, name, getattr(self, name))
+        object.__setattr__(snapshot, 'texts', texts)
+        object.__setattr__(snapshot, 'texts_mtime', texts_mtime)
+        return snapshot
+
+    def export_artifact(self):
+        """Модель с энкодерами, скейлером, хешем CSV и метриками (формат ModelTrainer.save)"""
+        return {
+            'csv_hash': self.csv_hash,
+            'model': self.model,
+            'label_encoders': dict(self.label_encoders),
+            'scaler': self.scaler,
+            'metrics': dict(self.metrics)
+        }
+
+    def predict_proba(self, rows):
+        """Вероятности типов рекомендаций (столбцы - encoder.class_names).
+        rows - список dict с ключами crop, climate_zone, soil_type, last_crop_category, last_crop, season"""
+        X_scaled = self.encoder.transform([
+            tuple(row.get(feature) or FEATURE_DEFAULTS.get(feature) for feature in self.encoder.feature_names)
+            for row in rows
+        ])
+        return self.model.predict_proba(X_scaled)
+
+    def evaluate(self, records):
+        """Доля верно предсказанных типов рекомендаций на размеченных записях
+        (dict с признаками и recommendation_type)"""
+        if not records:
+            return None
+        predicted = np.argmax(self.predict_proba(records), axis=1)
+        class_names = self.encoder.class_names
+        hits = sum(class_names[p] == r['recommendation_type'] for p, r in zip(predicted, records))
+        return hits / len(records)
+
+    def pick_text(self, crop, climate_zone, recommendation_type, last_crop_category, last_crop=None):
+        """Выбор текста рекомендации по приоритетам: предшественник, категория предшественника, зона"""
+        candidates = None
+        if last_crop:
+            candidates = self.texts['last_crop'].get((crop, climate_zone, last_crop, recommendation_type))
+        if not candidates:
+            candidates = self.texts['last_crop_category'].get((crop, climate_zone, last_crop_category, recommendation_type))
+        if not candidates:
+            candidates = self.texts['climate_zone'].get((crop, climate_zone))
+        if not candidates:
+            return None
+        return random.choice(candidates)
+
+
+class ModelTrainer:
+    """Обучение, сохранение и загрузка артефактов модели. Общего состояния не имеет: каждое обучение
+    создает новые энкодеры, скейлер и модель и возвращает их артефактом"""
 
-class CropRecommender:
     def __init__(self, csv_path='crop_climate_data.csv'):
         self.csv_path = csv_path
-        self.model = None
-        self.label_encoders = {}
-        self.scaler = StandardScaler()
-        self.is_trained = False
-        self.last_recommendations = {}
-        
+
     def load_data(self):
         # Загрузка данных из CSV
         if not os.path.exists(self.csv_path):
             raise FileNotFoundError(f"CSV файл не найден: {self.csv_path}")
         return pd.read_csv(self.csv_path)
-    
+
+    def csv_mtime(self):
+        return os.path.getmtime(self.csv_path) if os.path.exists(self.csv_path) else None
+
+    def load_texts(self):
+        """Индекс текстов рекомендаций из CSV и время изменения CSV, по которому он построен"""
+        mtime = self.csv_mtime()
+        return build_text_index(self.load_data()), mtime
+
+    def compute_csv_hash(self):
+        """SHA-256 обучающего CSV для проверки актуальности сохраненной модели"""
+        if not os.path.exists(self.csv_path):
+            raise FileNotFoundError(f"CSV файл не найден: {self.csv_path}")
+        digest = hashlib.sha256()
+        with open(self.csv_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def save(self, artifact, path):
+        """Сохранение артефакта (модель, энкодеры, скейлер, хеш CSV, метрики) в один файл"""
+        artifact = dict(artifact, version=MODEL_ARTIFACT_VERSION, trained_at=datetime.utcnow().isoformat())
+        # Без сжатия, чтобы массивы деревьев можно было загружать через mmap
+        tmp_path = path + '.tmp'
+        joblib.dump(artifact, tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def load(self, path, mmap_mode='r'):
+        """Артефакт модели или None, если он отсутствует или устарел"""
+        if not os.path.exists(path):
+            return None
+        try:
+            artifact = joblib.load(path, mmap_mode=mmap_mode)
+        except Exception as e:
+            print(f"Не удалось загрузить модель из {path}: {e}")
+            return None
+
+        if artifact.get('version') != MODEL_ARTIFACT_VERSION:
+            print(f"Версия артефакта модели {artifact.get('version')} не поддерживается")
+            return None
+        if artifact.get('csv_hash') != self.compute_csv_hash():
+            print("Обучающий CSV изменился, сохраненная модель устарела")
+            return None
+        return artifact
+
     def prepare_features(self, df):
-        # Подготовка признаков для обучения
+        # Подготовка признаков для обучения: новые энкодеры на каждый вызов (на инференсе - InferenceEncoder)
         # Если есть колонка last_crop, она, иначе только last_crop_category
-        categorical_features = ['crop', 'climate_zone', 'soil_type', 'last_crop_category', 'season']
+        categorical_features = list(CATEGORICAL_FEATURES)
         if 'last_crop' in df.columns:
             categorical_features.append('last_crop')
-        
+
+        label_encoders = {}
+        columns = []
         for feature in categorical_features:
-            if feature not in self.label_encoders:
-                self.label_encoders[feature] = LabelEncoder()
-                df[feature + '_encoded'] = self.label_encoders[feature].fit_transform(df[feature])
-            else:
-                # новые значения если их нет
-                unique_values = set(df[feature].unique())
-                known_values = set(self.label_encoders[feature].classes_)
-                if unique_values - known_values:
-                    # Расширение энкодера
-                    all_values = list(known_values) + list(unique_values - known_values)
-                    self.label_encoders[feature] = LabelEncoder()
-                    self.label_encoders[feature].fit(all_values)
-                try:
-                    df[feature + '_encoded'] = self.label_encoders[feature].transform(df[feature])
-                except ValueError:
-                    most_common = df[feature].mode()[0] if len(df[feature].mode()) > 0 else df[feature].iloc[0] # Самое частое значение
-                    df[feature] = df[feature].apply(lambda x: x if x in self.label_encoders[feature].classes_ else most_common)
-                    df[feature + '_encoded'] = self.label_encoders[feature].transform(df[feature])
-        
+            label_encoders[feature] = LabelEncoder()
+            columns.append(label_encoders[feature].fit_transform(df[feature]))
+
         # Признаки для модели
-        feature_columns = [f + '_encoded' for f in categorical_features]
-        X = df[feature_columns].values
-        
+        X = np.column_stack(columns)
+
         # Кодируем целевую переменную (тип рекомендации)
+        y = None
         if 'recommendation_type' in df.columns:
-            if 'recommendation_type' not in self.label_encoders:
-                self.label_encoders['recommendation_type'] = LabelEncoder()
-                y = self.label_encoders['recommendation_type'].fit_transform(df['recommendation_type'])
-            else:
-                y = self.label_encoders['recommendation_type'].transform(df['recommendation_type'])
-            return X, y
-        else:
-            return X, None
-    
-    def train(self):
-        # Обучение модели
+            label_encoders['recommendation_type'] = LabelEncoder()
+            y = label_encoders['recommendation_type'].fit_transform(df['recommendation_type'])
+        return X, y, label_encoders
+
+    def train(self, extra_data=None):
+        """Обучение новой модели. extra_data - дополнительные размеченные примеры (DataFrame с колонками
+        признаков и recommendation_type, например из истории посевов), они идут только в обучающую выборку.
+        Отложенная выборка - всегда одни и те же 20% строк CSV: ее метки не выведены из правил приложения,
+        и ни одна версия модели на ней не обучалась, поэтому на ней можно сравнивать версии.
+        Возвращает артефакт и отложенную выборку в исходном виде"""
+        started = datetime.utcnow()
         df = self.load_data()
-        X, y = self.prepare_features(df)
-        
-        # Разделение на обучающую и тестовую выборку
+        csv_hash = self.compute_csv_hash()
+        csv_samples = len(df)
+        # Разделение строк CSV (по индексам, чтобы сохранить исходные строки теста); стратификация
+        # по исходным меткам, чтобы разбиение не зависело от дополнительных примеров
+        csv_indices = np.arange(csv_samples)
         try:
-            unique, counts = np.unique(y, return_counts=True)
+            unique, counts = np.unique(df['recommendation_type'], return_counts=True)
             min_class_count = counts.min() if len(counts) > 0 else 0
             use_stratify = min_class_count >= 2
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=0.2, random_state=42, stratify=y if use_stratify else None
+            train_idx, test_idx = train_test_split(
+                csv_indices, test_size=0.2, random_state=42,
+                stratify=df['recommendation_type'] if use_stratify else None
             )
         except ValueError:
             # На всякий (запасной вариант)
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=0.2, random_state=42, stratify=None
+            train_idx, test_idx = train_test_split(
+                csv_indices, test_size=0.2, random_state=42, stratify=None
             )
-        
-        X_train_scaled = self.scaler.fit_transform(X_train)
-        X_test_scaled = self.scaler.transform(X_test)
-        
-        self.model = RandomForestClassifier(
+
+        extra_samples = 0
+        if extra_data is not None and len(extra_data):
+            extra_samples = len(extra_data)
+            df = pd.concat([df, extra_data], ignore_index=True)
+            train_idx = np.concatenate([train_idx, np.arange(csv_samples, len(df))])
+        X, y, label_encoders = self.prepare_features(df)
+
+        X_train, X_test, y_train, y_test = X[train_idx], X[test_idx], y[train_idx], y[test_idx]
+
+        scaler = StandardScaler()
+        X_train_scaled = scaler.fit_transform(X_train)
+        X_test_scaled = scaler.transform(X_test)
+
+        model = RandomForestClassifier(
             n_estimators=400,
             max_depth=None,
             min_samples_leaf=2,
@@ -95,124 +307,397 @@ class CropRecommender:
             random_state=42,
             n_jobs=-1
         )
-        self.model.fit(X_train_scaled, y_train)
-        
-        self.is_trained = True
-        
+        model.fit(X_train_scaled, y_train)
+
         # Оценка качества обучения
-        train_score = self.model.score(X_train_scaled, y_train)
-        test_score = self.model.score(X_test_scaled, y_test)
-        
+        train_score = model.score(X_train_scaled, y_train)
+        test_score = model.score(X_test_scaled, y_test)
         print(f"Модель обучена. Точность на обучающей выборке: {train_score:.2f}, на тестовой: {test_score:.2f}")
-        
+
+        feature_columns = [c for c in CATEGORICAL_FEATURES + ('last_crop',) if c in df.columns]
+        holdout = df.iloc[test_idx][feature_columns + ['recommendation_type']].to_dict('records')
+        artifact = {
+            'csv_hash': csv_hash,
+            'model': model,
+            'label_encoders': label_encoders,
+            'scaler': scaler,
+            'metrics': {
+                'train_accuracy': float(train_score),
+                'holdout_accuracy': float(test_score),
+                'samples': int(len(df)),
+                'extra_samples': extra_samples,
+                'duration_seconds': (datetime.utcnow() - started).total_seconds()
+            }
+        }
+        return artifact, holdout
+
+
+class HitCounters:
+    """Счетчики попаданий и промахов кэша без блокировок на чтении: у каждого потока свои счетчики,
+    stats суммирует их. Блокировка берется один раз при первом обращении потока; тогда же счетчики
+    завершившихся потоков переносятся в общий итог, чтобы список не рос"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.finished = [0, 0]
+
+    def _counts(self):
+        counts = getattr(self.local, 'counts', None)
+        if counts is None:
+            counts = self.local.counts = [0, 0]
+            with self.lock:
+                alive = []
+                for thread, thread_counts in self.threads:
+                    if thread.is_alive():
+                        alive.append((thread, thread_counts))
+                    else:
+                        self.finished[0] += thread_counts[0]
+                        self.finished[1] += thread_counts[1]
+                alive.append((threading.current_thread(), counts))
+                self.threads = alive
+        return counts
+
+    def hit(self):
+        self._counts()[0] += 1
+
+    def miss(self):
+        self._counts()[1] += 1
+
+    def totals(self):
+        with self.lock:
+            hits, misses = self.finished
+            for _, counts in self.threads:
+                hits += counts[0]
+                misses += counts[1]
+        return hits, misses
+
+
+class RecommendationCache:
+    """Ограниченный кэш рекомендаций с TTL и вытеснением давно не запрошенных записей.
+    Ключ - (field_id, хеш названия и геометрии, id последней записи истории, версия модели):
+    любое изменение поля, новая запись истории или перезагрузка модели дают новый ключ.
+    Удаление записей истории ключ может не изменить, поэтому записи поля сбрасываются явно
+    (invalidate_field); TTL ограничивает устаревание в других процессах.
+    Чтение - операция словаря без блокировок, попадание только отмечает запись как использованную.
+    Записи меняются под блокировкой; при переполнении вытесняется приближение LRU (алгоритм
+    «второго шанса»): запись, запрошенная после прошлого обхода, переносится в конец очереди
+    вместо вытеснения"""
+
+    def __init__(self, maxsize=RECOMMENDATION_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Ключ -> [время записи, значение, признак обращения]
+        self.items = {}
+        self.lock = threading.Lock()
+        self.counters = HitCounters()
+
+    @staticmethod
+    def make_key(field_id, field_name, field_geometry, history_id, model_version):
+        geometry = field_geometry if isinstance(field_geometry, str) else json.dumps(field_geometry, sort_keys=True)
+        digest = hashlib.sha1(f"{field_name}\x00{geometry}".encode('utf-8')).hexdigest()
+        return (field_id, digest, history_id, model_version)
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is not None and time.monotonic() - item[0] < self.ttl:
+            item[2] = True
+            self.counters.hit()
+            return item[1]
+        self.counters.miss()
+        return None
+
+    def put(self, key, value):
+        with self.lock:
+            now = time.monotonic()
+            self.items.pop(key, None)
+            self.items[key] = [now, value, False]
+            # Начало очереди: устаревшие записи удаляются, при переполнении использованные
+            # переносятся в конец (один раз до следующего обращения), остальные вытесняются
+            while self.items:
+                oldest = next(iter(self.items))
+                item = self.items[oldest]
+                if now - item[0] >= self.ttl:
+                    del self.items[oldest]
+                elif len(self.items) <= self.maxsize:
+                    break
+                elif item[2]:
+                    item[2] = False
+                    del self.items[oldest]
+                    self.items[oldest] = item
+                else:
+                    del self.items[oldest]
+
+    def invalidate_field(self, field_id):
+        """Сброс всех рекомендаций поля (после изменения его истории или геометрии)"""
+        with self.lock:
+            for key in [key for key in self.items if key[0] == field_id]:
+                del self.items[key]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        hits, misses = self.counters.totals()
+        return {
+            'entries': len(self.items),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': hits,
+            'misses': misses
+        }
+
+
+class LastRecommendations:
+    """Последние выданные рекомендации полей (для устойчивости рекомендаций).
+    Ключ - id поля; название - только для полей без id (у разных полей названия могут совпадать).
+    Размер ограничен; запись под блокировкой, чтение без нее (одна операция словаря)"""
+
+    def __init__(self, maxsize=RECOMMENDATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(field_id, field_name):
+        return ('id', field_id) if field_id is not None else ('name', field_name)
+
+    def get(self, key, default=None):
+        return self.items.get(key, default)
+
+    def put(self, key, entry):
+        with self.lock:
+            self.items[key] = entry
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class CropRecommender:
+    """Рекомендации для полей. Модель - неизменяемый InferenceSnapshot, который потоки читают без
+    блокировок. Загрузка, обучение и замена снимка выполняются одним потоком под train_lock:
+    одновременные первые запросы ждут одно обучение, а не запускают каждый свое"""
+
+    def __init__(self, csv_path='crop_climate_data.csv', model_path='crop_recommender.joblib'):
+        self.csv_path = csv_path
+        self.model_path = model_path
+        self.trainer = ModelTrainer(csv_path)
+        self.snapshot = None
+        self.train_lock = threading.RLock()
+        self.last_recommendations = LastRecommendations()
+        self.recommendation_cache = RecommendationCache()
+
+    @property
+    def is_trained(self):
+        return self.snapshot is not None
+
+    @property
+    def model_version(self):
+        # Версия модели в процессе: увеличивается при каждой загрузке или обучении
+        snapshot = self.snapshot
+        return snapshot.version if snapshot is not None else 0
+
+    @property
+    def metrics(self):
+        snapshot = self.snapshot
+        return dict(snapshot.metrics) if snapshot is not None else {}
+
+    def export_artifact(self):
+        """Текущая модель с энкодерами, скейлером, хешем CSV и метриками (формат install_artifact)"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            raise RuntimeError("Модель не обучена")
+        return snapshot.export_artifact()
+
+    def save_model(self, path=None):
+        """Сохранение модели, энкодеров, скейлера и хеша CSV в один артефакт"""
+        return self.trainer.save(self.export_artifact(), path or self.model_path)
+
+    def load_model(self, path=None, mmap_mode='r'):
+        """Загрузка артефакта модели. Возвращает False, если артефакт отсутствует или устарел"""
+        artifact = self.trainer.load(path or self.model_path, mmap_mode)
+        if artifact is None:
+            return False
+        self.install_artifact(artifact)
+        return True
+
+    def install_artifact(self, artifact):
+        """Замена модели в работающем процессе (артефакт в формате save_model). Запросы, начатые
+        на прежнем снимке, дочитывают его; новые получают новый снимок"""
+        with self.train_lock:
+            texts, texts_mtime = self.trainer.load_texts()
+            self.snapshot = InferenceSnapshot(artifact, texts, texts_mtime, self.model_version + 1)
+            # Рекомендации прежней модели больше не действительны
+            self.recommendation_cache.clear()
+
+    def load_or_train(self, path=None):
+        """Загрузка сохраненной модели, переобучение и сохранение только при изменении CSV"""
+        with self.train_lock:
+            if self.load_model(path):
+                return self
+            self.train()
+            try:
+                self.save_model(path)
+            except Exception as e:
+                print(f"Не удалось сохранить модель: {e}")
         return self
-    
+
+    def train(self, extra_data=None):
+        # Обучение модели (см. ModelTrainer.train) и установка ее в процессе
+        with self.train_lock:
+            artifact, _ = self.trainer.train(extra_data)
+            self.install_artifact(artifact)
+        return self
+
+    def get_snapshot(self):
+        """Текущий снимок модели. При первом обращении модель загружается или обучается одним потоком,
+        остальные ждут его результата"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self.train_lock:
+                if self.snapshot is None:
+                    self.load_or_train()
+                snapshot = self.snapshot
+        elif snapshot.texts_mtime != self.trainer.csv_mtime():
+            snapshot = self._refresh_texts()
+        return snapshot
+
+    def _refresh_texts(self):
+        # CSV изменился: индекс текстов перестраивает один поток, остальные пока читают прежний снимок
+        if not self.train_lock.acquire(blocking=False):
+            return self.snapshot
+        try:
+            texts, texts_mtime = self.trainer.load_texts()
+            self.snapshot = self.snapshot.with_texts(texts, texts_mtime)
+            return self.snapshot
+        finally:
+            self.train_lock.release()
+
+    def preload(self):
+        """Загрузка модели до запуска воркеров (gunicorn --preload): воркеры разделяют снимок
+        copy-on-write. gc.freeze исключает загруженные объекты из сборки мусора, которая иначе
+        записывала бы в их страницы и копировала их в каждый воркер"""
+        self.get_snapshot()
+        gc.freeze()
+        return self
+
+    def evaluate(self, records, snapshot=None):
+        """Доля верно предсказанных типов рекомендаций на размеченных записях
+        (dict с признаками и recommendation_type); snapshot - по умолчанию текущая модель"""
+        return (snapshot or self.get_snapshot()).evaluate(records)
+
+    def _loaded_snapshot(self):
+        # Снимок модели или None (резервные рекомендации), если модель не удалось загрузить или обучить
+        try:
+            return self.get_snapshot()
+        except Exception as e:
+            print(f"Ошибка обучения модели: {e}")
+            return None
+
     def get_recommendation(self, crop, climate_zone, soil_type='чернозем', last_crop_category='зерновые', last_crop=None, season='весна-лето', num_variants=3, diversity=0.7):
         # Получение рекомендации
-        if not self.is_trained:
-            try:
-                self.train()
-            except Exception as e:
-                print(f"Ошибка обучения модели: {e}")
-                base = self._get_fallback_recommendation(crop, climate_zone, last_crop_category)
-                base['variants'] = [base['recommendation_text']]
-                return base # Возвращаем базовую рекомендацию без обучения
-        
-        # DataFrame с одним примером
-        data = {
-            'crop': [crop],
-            'climate_zone': [climate_zone],
-            'soil_type': [soil_type],
-            'last_crop_category': [last_crop_category],
-            'season': [season]
+        row = {
+            'crop': crop,
+            'climate_zone': climate_zone,
+            'soil_type': soil_type,
+            'last_crop_category': last_crop_category,
+            'last_crop': last_crop,
+            'season': season
         }
-        if last_crop:
-            data['last_crop'] = [last_crop]
-        df = pd.DataFrame(data)
-        
-        try:
-            X, _ = self.prepare_features(df) # признак
-            X_scaled = self.scaler.transform(X)
-            
-            class_index = self.model.predict(X_scaled)[0]
-            recommendation_type_name = self.label_encoders['recommendation_type'].inverse_transform([class_index])[0] # Предсказывает тип рекомендации
-            probabilities = self.model.predict_proba(X_scaled)[0] # вероятности
-            df_full = self.load_data() # Рекомендации из CSV
-            
-            # Функция поиска текста по приоритетам
-            def pick_text_for_type(target_type_name):
-                if last_crop and 'last_crop' in df_full.columns:
-                    q = df_full[
-                        (df_full['crop'] == crop) &
-                        (df_full['climate_zone'] == climate_zone) &
-                        (df_full.get('last_crop', '') == last_crop) &
-                        (df_full['recommendation_type'] == target_type_name)
-                    ]
-                    if len(q) > 0:
-                        return q.sample(1, random_state=random.randint(0, 10**6)).iloc[0]['recommendation_text']
-                q = df_full[
-                    (df_full['crop'] == crop) &
-                    (df_full['climate_zone'] == climate_zone) &
-                    (df_full['last_crop_category'] == last_crop_category) &
-                    (df_full['recommendation_type'] == target_type_name)
-                ]
-                if len(q) > 0:
-                    return q.sample(1, random_state=random.randint(0, 10**6)).iloc[0]['recommendation_text']
-                q = df_full[
-                    (df_full['crop'] == crop) &
-                    (df_full['climate_zone'] == climate_zone)
-                ]
-                if len(q) > 0:
-                    return q.sample(1, random_state=random.randint(0, 10**6)).iloc[0]['recommendation_text']
-                return None
-            
-            # Базовый вариант 
-            base_text = pick_text_for_type(recommendation_type_name)
-            if not base_text:
-                base = self._get_fallback_recommendation(crop, climate_zone, last_crop_category)
-                base['variants'] = [base['recommendation_text']]
-                return base
-
-            # Генеротор списка вариантов
-            num_classes = len(probabilities)
-            k = max(1, int(1 + diversity * (num_classes - 1)))
-            top_indices = np.argsort(probabilities)[::-1][:k]
-            variant_texts = []
-            used = set()
-
-            for idx in top_indices:
-                type_name = self.label_encoders['recommendation_type'].inverse_transform([idx])[0]
-                txt = pick_text_for_type(type_name)
-                if txt:
-                    diverse_txts = self._diversify_text(txt, type_name, crop, last_crop_category)
-                    for t in diverse_txts:
-                        if t not in used:
-                            variant_texts.append(t)
-                            used.add(t)
-                        if len(variant_texts) >= num_variants:
-                            break
-                if len(variant_texts) >= num_variants:
-                    break
+        return self._recommend(self._loaded_snapshot(), [row], num_variants, diversity)[0]
 
-            if not variant_texts:
-                variant_texts = [base_text]
+    def get_recommendations_batch(self, rows, num_variants=3, diversity=0.7):
+        """Рекомендации для многих примеров за один вызов predict_proba.
+        rows - список dict с ключами crop, climate_zone, soil_type, last_crop_category, last_crop, season"""
+        if not rows:
+            return []
+        return self._recommend(self._loaded_snapshot(), rows, num_variants, diversity)
 
-            # Сначала ищем с учетом конкретного предшественника, если он указан
+    def _recommend(self, snapshot, rows, num_variants=3, diversity=0.7):
+        # Рекомендации по одному снимку модели (одна матрица вероятностей на все строки);
+        # без снимка или при ошибке - резервные рекомендации
+        def fallback(row):
+            base = self._get_fallback_recommendation(row['crop'], row['climate_zone'], row['last_crop_category'])
+            base['variants'] = [base['recommendation_text']]
+            return base
 
-            recommendation_text = variant_texts[0]
-            
-            return {
-                'recommendation_type': recommendation_type_name,
-                'recommendation_text': recommendation_text,
-                'confidence': float(max(probabilities)),
-                'variants': variant_texts
-            }
+        if not rows:
+            return []
+        if snapshot is None:
+            return [fallback(row) for row in rows]
+        try:
+            probabilities = snapshot.predict_proba(rows)
         except Exception as e:
-            print(f"Ошибка получения рекомендации: {e}")
+            print(f"Ошибка получения рекомендаций: {e}")
+            return [fallback(row) for row in rows]
+
+        results = []
+        for row, row_probabilities in zip(rows, probabilities):
+            try:
+                results.append(self._build_recommendation(
+                    snapshot, row_probabilities, row['crop'], row['climate_zone'], row['last_crop_category'],
+                    row.get('last_crop'), num_variants, diversity
+                ))
+            except Exception as e:
+                print(f"Ошибка получения рекомендации: {e}")
+                results.append(fallback(row))
+        return results
+
+    def _build_recommendation(self, snapshot, probabilities, crop, climate_zone, last_crop_category, last_crop, num_variants, diversity):
+        # Выбор текста и вариантов по вероятностям классов одной строки
+        class_names = snapshot.encoder.class_names
+        class_index = int(np.argmax(probabilities))
+        recommendation_type_name = class_names[class_index] # Предсказывает тип рекомендации
+
+        # Функция поиска текста по приоритетам (через индекс, без сканирования CSV)
+        def pick_text_for_type(target_type_name):
+            return snapshot.pick_text(crop, climate_zone, target_type_name, last_crop_category, last_crop)
+
+        # Базовый вариант
+        base_text = pick_text_for_type(recommendation_type_name)
+        if not base_text:
             base = self._get_fallback_recommendation(crop, climate_zone, last_crop_category)
-            base['variants'] = [base['recommendation_text']] # В случае ошибки возвращаем общую рекомендацию
+            base['variants'] = [base['recommendation_text']]
             return base
-    
+
+        # Генеротор списка вариантов
+        num_classes = len(probabilities)
+        k = max(1, int(1 + diversity * (num_classes - 1)))
+        top_indices = np.argsort(probabilities)[::-1][:k]
+        variant_texts = []
+        used = set()
+
+        for idx in top_indices:
+            type_name = class_names[idx]
+            txt = pick_text_for_type(type_name)
+            if txt:
+                diverse_txts = self._diversify_text(txt, type_name, crop, last_crop_category)
+                for t in diverse_txts:
+                    if t not in used:
+                        variant_texts.append(t)
+                        used.add(t)
+                    if len(variant_texts) >= num_variants:
+                        break
+            if len(variant_texts) >= num_variants:
+                break
+
+        if not variant_texts:
+            variant_texts = [base_text]
+
+        recommendation_text = variant_texts[0]
+
+        return {
+            'recommendation_type': recommendation_type_name,
+            'recommendation_text': recommendation_text,
+            'confidence': float(max(probabilities)),
+            'variants': variant_texts
+        }
+
     def _get_fallback_recommendation(self, crop, climate_zone, last_crop_category):
         # Резервная рекомендация при ошибках
         recommendations = {
@@ -294,123 +779,201 @@ class CropRecommender:
         }
         return categories.get(crop_name, 'зерновые')
     
-    def generate_field_recommendation(self, field_name, field_geometry, crop_history):
-        """Генерация рекомендации для поля на основе его истории и координат"""
-        # Извлекаем координаты из геометрии
+    def get_field_center(self, field_geometry):
+        """Центр поля (широта, долгота) по геометрии GeoJSON"""
         try:
-            geometry = json.loads(field_geometry) if isinstance(field_geometry, str) else field_geometry
-            if geometry['type'] == 'Polygon' and len(geometry['coordinates']) > 0:
-                # Берем центр полигона
-                coords = geometry['coordinates'][0]
-                center_lat = sum(coord[1] for coord in coords) / len(coords)
-                center_lon = sum(coord[0] for coord in coords) / len(coords)
-            else:
-                # По умолчанию центральная Россия
-                center_lat = 55.7558
-                center_lon = 37.6173
-        except:
-            center_lat = 55.7558
-            center_lon = 37.6173
-        
-        # Определяем климатическую зону
-        climate_zone = self.get_climate_zone_from_coords(center_lat, center_lon)
-        
-        # Если истории нет
-        if not crop_history or len(crop_history) == 0:
-            message = f"{field_name}: Сначала добавьте хотя бы одну культуру в историю поля."
-            result = {
-                'field_name': field_name,
-                'recommended_crop': None,
-                'message': message,
-                'recommendation_type': 'info',
-                'confidence': None,
-                'variants': [message],
-            }
-            # Сохранение последней рекомендации
-            self.last_recommendations[field_name] = {
-                'input': {
-                    'climate_zone': climate_zone,
-                    'last_crop_category': None,
-                    'last_crop_name': None,
-                    'recommended_crop': None
-                },
-                'result': result
-            }
-            return result
-        
-        # Анализиз истории посевов
+            return centroid(field_geometry)
+        except Exception:
+            # По умолчанию центральная Россия
+            return 55.7558, 37.6173
+
+    def suggest_next_crop(self, last_crop):
+        """Следующая культура по правилам севооборота"""
+        rotation_suggestions = {
+            'Пшеница': ['Горох', 'Фасоль', 'Свекла', 'Подсолнечник'],
+            'Ячмень': ['Горох', 'Фасоль', 'Свекла', 'Рапс'],
+            'Овес': ['Горох', 'Фасоль', 'Пшеница', 'Картофель'],
+            'Рожь': ['Горох', 'Фасоль', 'Картофель', 'Свекла'],
+            'Горох': ['Пшеница', 'Ячмень', 'Кукуруза', 'Подсолнечник'],
+            'Фасоль': ['Пшеница', 'Ячмень', 'Кукуруза', 'Свекла'],
+            'Соя': ['Пшеница', 'Ячмень', 'Кукуруза', 'Подсолнечник'],
+            'Кукуруза': ['Горох', 'Фасоль', 'Пшеница', 'Соя'],
+            'Картофель': ['Горох', 'Фасоль', 'Овес', 'Пшеница'],
+            'Свекла': ['Пшеница', 'Ячмень', 'Горох', 'Овес'],
+            'Морковь': ['Пшеница', 'Ячмень', 'Овес', 'Горох'],
+            'Капуста': ['Пшеница', 'Ячмень', 'Овес', 'Горох'],
+            'Томаты': ['Горох', 'Фасоль', 'Пшеница', 'Овес'],
+            'Огурцы': ['Горох', 'Фасоль', 'Пшеница', 'Овес'],
+            'Лук': ['Пшеница', 'Ячмень', 'Овес', 'Горох'],
+            'Подсолнечник': ['Пшеница', 'Ячмень', 'Горох', 'Овес'],
+            'Рапс': ['Пшеница', 'Ячмень', 'Горох', 'Овес'],
+            'Гречиха': ['Пшеница', 'Ячмень', 'Горох', 'Овес'],
+            'Люцерна': ['Пшеница', 'Ячмень', 'Кукуруза', 'Подсолнечник'],
+            'Клевер': ['Пшеница', 'Ячмень', 'Кукуруза', 'Овес']
+        }
+        suggested_crops = rotation_suggestions.get(last_crop, ['Пшеница', 'Горох', 'Свекла'])
+        return suggested_crops[0]
+
+    def _prepare_field_context(self, field_name, field_geometry, crop_history, center=None):
+        # Климатическая зона и данные о предшественнике для поля
+        # center - заранее вычисленный центроид (Field.centroid), тогда геометрия не разбирается
+        center_lat, center_lon = center if center else self.get_field_center(field_geometry)
+        context = {
+            'field_name': field_name,
+            'climate_zone': self.get_climate_zone_from_coords(center_lat, center_lon),
+            'last_crop_category': None,
+            'last_crop_name': None,
+            'recommended_crop': None
+        }
         if crop_history and len(crop_history) > 0:
             last_crop = crop_history[0].get('crop_name', '')
-            last_crop_category = self.get_crop_category(last_crop)
-            
-            rotation_suggestions = {
-                'Пшеница': ['Горох', 'Фасоль', 'Свекла', 'Подсолнечник'],
-                'Ячмень': ['Горох', 'Фасоль', 'Свекла', 'Рапс'],
-                'Овес': ['Горох', 'Фасоль', 'Пшеница', 'Картофель'],
-                'Рожь': ['Горох', 'Фасоль', 'Картофель', 'Свекла'],
-                'Горох': ['Пшеница', 'Ячмень', 'Кукуруза', 'Подсолнечник'],
-                'Фасоль': ['Пшеница', 'Ячмень', 'Кукуруза', 'Свекла'],
-                'Соя': ['Пшеница', 'Ячмень', 'Кукуруза', 'Подсолнечник'],
-                'Кукуруза': ['Горох', 'Фасоль', 'Пшеница', 'Соя'],
-                'Картофель': ['Горох', 'Фасоль', 'Овес', 'Пшеница'],
-                'Свекла': ['Пшеница', 'Ячмень', 'Горох', 'Овес'],
-                'Морковь': ['Пшеница', 'Ячмень', 'Овес', 'Горох'],
-                'Капуста': ['Пшеница', 'Ячмень', 'Овес', 'Горох'],
-                'Томаты': ['Горох', 'Фасоль', 'Пшеница', 'Овес'],
-                'Огурцы': ['Горох', 'Фасоль', 'Пшеница', 'Овес'],
-                'Лук': ['Пшеница', 'Ячмень', 'Овес', 'Горох'],
-                'Подсолнечник': ['Пшеница', 'Ячмень', 'Горох', 'Овес'],
-                'Рапс': ['Пшеница', 'Ячмень', 'Горох', 'Овес'],
-                'Гречиха': ['Пшеница', 'Ячмень', 'Горох', 'Овес'],
-                'Люцерна': ['Пшеница', 'Ячмень', 'Кукуруза', 'Подсолнечник'],
-                'Клевер': ['Пшеница', 'Ячмень', 'Кукуруза', 'Овес']
-            }
-            
-            suggested_crops = rotation_suggestions.get(last_crop, ['Пшеница', 'Горох', 'Свекла'])
-            recommended_crop = suggested_crops[0]
-        
-        last_crop_name = crop_history[0].get('crop_name', '') if crop_history and len(crop_history) > 0 else None
-        
-        recommendation = self.get_recommendation(
-            crop=recommended_crop,
-            climate_zone=climate_zone,
-            soil_type='чернозем', 
-            last_crop_category=last_crop_category,
-            last_crop=last_crop_name,  
-            season='весна-лето',
-            num_variants=3,
-            diversity=0.7
-        )
-        
+            context['last_crop_name'] = last_crop
+            context['last_crop_category'] = self.get_crop_category(last_crop)
+            context['recommended_crop'] = self.suggest_next_crop(last_crop)
+        return context
+
+    def _empty_history_result(self, context):
+        # Если истории нет
+        field_name = context['field_name']
+        message = f"{field_name}: Сначала добавьте хотя бы одну культуру в историю поля."
+        return {
+            'field_name': field_name,
+            'recommended_crop': None,
+            'message': message,
+            'recommendation_type': 'info',
+            'confidence': None,
+            'variants': [message],
+        }
+
+    def _field_result(self, context, recommendation):
         # Финальное сообщение
+        field_name = context['field_name']
         message = f"{field_name}: {recommendation['recommendation_text']}"
-        
-        result = {
+        return {
             'field_name': field_name,
-            'recommended_crop': recommended_crop,
+            'recommended_crop': context['recommended_crop'],
             'message': message,
             'recommendation_type': recommendation['recommendation_type'],
             'confidence': recommendation['confidence'],
             'variants': recommendation.get('variants', [recommendation['recommendation_text']])
         }
 
-        # Сохраняем последнюю рекомендацию
-        self.last_recommendations[field_name] = {
+    def _remember_recommendation(self, context, result, field_id=None):
+        # Сохранение последней рекомендации
+        entry = {
             'input': {
-                'climate_zone': climate_zone,
-                'last_crop_category': last_crop_category,
-                'last_crop_name': last_crop_name,
-                'recommended_crop': recommended_crop
+                'climate_zone': context['climate_zone'],
+                'last_crop_category': context['last_crop_category'],
+                'last_crop_name': context['last_crop_name'],
+                'recommended_crop': context['recommended_crop']
             },
             'result': result
         }
+        self.last_recommendations.put(LastRecommendations.make_key(field_id, context['field_name']), entry)
+        return entry
+
+    def _context_row(self, context):
+        # Признаки модели для рекомендуемой культуры поля
+        return {
+            'crop': context['recommended_crop'],
+            'climate_zone': context['climate_zone'],
+            'soil_type': 'чернозем',
+            'last_crop_category': context['last_crop_category'],
+            'last_crop': context['last_crop_name'],
+            'season': 'весна-лето'
+        }
+
+    def _cache_key(self, field_id, field_name, field_geometry, history_id, snapshot):
+        # Без field_id рекомендация не кэшируется, резервные рекомендации без модели - тоже.
+        # Версия в ключе - версия снимка, на котором рекомендация получена
+        if field_id is None or snapshot is None:
+            return None
+        return self.recommendation_cache.make_key(field_id, field_name, field_geometry, history_id, snapshot.version)
+
+    def _cached_recommendation(self, key):
+        # Попадание в кэш тоже становится последней рекомендацией поля (поле могло вернуться
+        # к прежнему состоянию). Запись под блокировкой - только если последней была другая
+        # рекомендация; повторные попадания - только чтение
+        entry = self.recommendation_cache.get(key) if key is not None else None
+        if entry is None:
+            return None
+        last_key = LastRecommendations.make_key(key[0], None)
+        if self.last_recommendations.get(last_key) is not entry:
+            self.last_recommendations.put(last_key, entry)
+        return entry['result']
+
+    def _cache_recommendation(self, key, entry):
+        if key is not None:
+            self.recommendation_cache.put(key, entry)
 
+    def generate_field_recommendation(self, field_name, field_geometry, crop_history, center=None,
+                                      field_id=None, history_id=None):
+        """Генерация рекомендации для поля на основе его истории и координат.
+        field_id и history_id (id последней записи истории) включают кэширование результата"""
+        snapshot = self.snapshot
+        cached = self._cached_recommendation(self._cache_key(field_id, field_name, field_geometry, history_id, snapshot))
+        if cached is not None:
+            return cached
+
+        context = self._prepare_field_context(field_name, field_geometry, crop_history, center)
+
+        if context['recommended_crop'] is None:
+            result = self._empty_history_result(context)
+        else:
+            snapshot = self._loaded_snapshot()
+            recommendation = self._recommend(snapshot, [self._context_row(context)], num_variants=3, diversity=0.7)[0]
+            result = self._field_result(context, recommendation)
+
+        entry = self._remember_recommendation(context, result, field_id)
+        self._cache_recommendation(self._cache_key(field_id, field_name, field_geometry, history_id, snapshot), entry)
         return result
 
-    def update_field_history_and_get_recommendation(self, field_name, field_geometry, crop_history):
+    def generate_field_recommendations_batch(self, fields):
+        """Рекомендации для многих полей: одна матрица признаков и один вызов predict_proba.
+        fields - список dict с ключами field_name, field_geometry, crop_history (история по убыванию года)
+        и необязательными center (центроид поля), field_id и history_id (для кэша).
+        Поля, найденные в кэше, в матрицу признаков не попадают"""
+        snapshot = self.snapshot
+        results = [None] * len(fields)
+        pending = []
+        for i, f in enumerate(fields):
+            key = self._cache_key(f.get('field_id'), f['field_name'], f['field_geometry'], f.get('history_id'), snapshot)
+            results[i] = self._cached_recommendation(key)
+            if results[i] is None:
+                pending.append(i)
+
+        contexts = {
+            i: self._prepare_field_context(
+                fields[i]['field_name'], fields[i]['field_geometry'], fields[i]['crop_history'], fields[i].get('center')
+            )
+            for i in pending
+        }
+        rows = [self._context_row(contexts[i]) for i in pending if contexts[i]['recommended_crop'] is not None]
+        if rows:
+            snapshot = self._loaded_snapshot()
+        recommendations = iter(self._recommend(snapshot, rows, num_variants=3, diversity=0.7))
+
+        for i in pending:
+            context = contexts[i]
+            if context['recommended_crop'] is None:
+                result = self._empty_history_result(context)
+            else:
+                result = self._field_result(context, next(recommendations))
+            f = fields[i]
+            entry = self._remember_recommendation(context, result, f.get('field_id'))
+            self._cache_recommendation(
+                self._cache_key(f.get('field_id'), f['field_name'], f['field_geometry'], f.get('history_id'), snapshot), entry
+            )
+            results[i] = result
+        return results
+
+    def update_field_history_and_get_recommendation(self, field_name, field_geometry, crop_history, center=None,
+                                                    field_id=None, history_id=None):
         """После обновления истории поля пересчитать и вернуть новую или старую рекомендацию в зависимости от актуальности"""
-        previous = self.last_recommendations.get(field_name, {}).get('result')
-        new_result = self.generate_field_recommendation(field_name, field_geometry, crop_history)
+        previous = self.last_recommendations.get(LastRecommendations.make_key(field_id, field_name), {}).get('result')
+        new_result = self.generate_field_recommendation(
+            field_name, field_geometry, crop_history, center, field_id=field_id, history_id=history_id
+        )
 
         if not previous:
             return new_result
@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import case, func, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from config import db
+from models import Crop, PriceObservation, PriceRollup
+
+# Периоды агрегатов цен. Агрегаты обновляются инкрементально в той же транзакции,
+# что и запись наблюдений, поэтому чтение истории не сканирует сырые наблюдения
+ROLLUP_BUCKETS = ('day', 'week', 'month')
+DEFAULT_BUCKET = 'day'
+
+
+def bucket_start(timestamp: datetime, bucket: str) -> datetime:
+    """Начало периода, в который попадает timestamp (неделя - с понедельника)"""
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    raise ValueError(f"Неизвестный период: {bucket}")
+
+
+def _aggregate(observations: Iterable[Dict]) -> List[Dict]:
+    # Агрегаты пакета наблюдений по (культура, период, начало периода)
+    rollups = {}
+    for obs in observations:
+        market = obs['market_price_per_ton']
+        seed = obs['seed_price_per_kg']
+        for bucket in ROLLUP_BUCKETS:
+            key = (obs['crop_id'], bucket, bucket_start(obs['observed_at'], bucket))
+            row = rollups.get(key)
+            if row is None:
+                rollups[key] = {
+                    'crop_id': key[0], 'bucket': key[1], 'period_start': key[2],
+                    'observations': 1,
+                    'market_sum': market, 'market_min': market, 'market_max': market, 'market_last': market,
+                    'seed_sum': seed, 'seed_min': seed, 'seed_max': seed, 'seed_last': seed,
+                    'last_observed_at': obs['observed_at']
+                }
+                continue
+            row['observations'] += 1
+            row['market_sum'] += market
+            row['market_min'] = min(row['market_min'], market)
+            row['market_max'] = max(row['market_max'], market)
+            row['seed_sum'] += seed
+            row['seed_min'] = min(row['seed_min'], seed)
+            row['seed_max'] = max(row['seed_max'], seed)
+            if obs['observed_at'] >= row['last_observed_at']:
+                row['market_last'] = market
+                row['seed_last'] = seed
+                row['last_observed_at'] = obs['observed_at']
+    return list(rollups.values())
+
+
+def _upsert_rollups(rows: List[Dict]) -> None:
+    # INSERT ... ON CONFLICT DO UPDATE (SQLite и PostgreSQL) с объединением агрегатов
+    dialect = db.session.get_bind(mapper=PriceRollup.__mapper__).dialect.name
+    if dialect == 'postgresql':
+        statement = postgresql.insert(PriceRollup)
+        least, greatest = func.least, func.greatest
+    elif dialect == 'sqlite':
+        statement = sqlite.insert(PriceRollup)
+        # В SQLite min/max с несколькими аргументами - скалярные функции
+        least, greatest = func.min, func.max
+    else:
+        raise RuntimeError(f"Агрегаты цен не поддерживаются для {dialect}")
+
+    table = PriceRollup.__table__.c
+    new = statement.excluded
+    is_newer = new.last_observed_at >= table.last_observed_at
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.crop_id, table.bucket, table.period_start],
+        set_={
+            'observations': table.observations + new.observations,
+            'market_sum': table.market_sum + new.market_sum,
+            'market_min': least(table.market_min, new.market_min),
+            'market_max': greatest(table.market_max, new.market_max),
+            'market_last': case((is_newer, new.market_last), else_=table.market_last),
+            'seed_sum': table.seed_sum + new.seed_sum,
+            'seed_min': least(table.seed_min, new.seed_min),
+            'seed_max': greatest(table.seed_max, new.seed_max),
+            'seed_last': case((is_newer, new.seed_last), else_=table.seed_last),
+            'last_observed_at': greatest(table.last_observed_at, new.last_observed_at)
+        }
+    )
+    db.session.execute(statement, rows)
+
+
+def record_price_observations(observations: List[Dict]) -> int:
+    """Пакетная запись наблюдений {crop_id, source, observed_at, market_price_per_ton, seed_price_per_kg}
+    и обновление агрегатов. Фиксация транзакции - на вызывающей стороне"""
+    if not observations:
+        return 0
+    db.session.execute(insert(PriceObservation), observations)
+    _upsert_rollups(_aggregate(observations))
+    return len(observations)
+
+
+def backfill_price_observations() -> int:
+    """Первое наблюдение для каждой культуры из текущих цен Crop (если истории еще нет)"""
+    if db.session.query(PriceObservation.id).first() is not None:
+        return 0
+    observations = [
+        {
+            'crop_id': crop.id,
+            'source': 'initial',
+            'observed_at': crop.last_price_update or datetime.utcnow(),
+            'market_price_per_ton': crop.market_price_per_ton or 0,
+            'seed_price_per_kg': crop.seed_price_per_kg or 0
+        }
+        for crop in db.session.query(
+            Crop.id, Crop.market_price_per_ton, Crop.seed_price_per_kg, Crop.last_price_update
+        )
+    ]
+    count = record_price_observations(observations)
+    db.session.commit()
+    return count
+
+
+def get_price_history(
+    crop_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: str = DEFAULT_BUCKET
+) -> List[Dict]:
+    """История цен культуры по агрегатам периода bucket в интервале [start, end]"""
+    if bucket not in ROLLUP_BUCKETS:
+        raise ValueError(f"Период должен быть одним из: {', '.join(ROLLUP_BUCKETS)}")
+    query = PriceRollup.query.filter(PriceRollup.crop_id == crop_id, PriceRollup.bucket == bucket)
+    if start is not None:
+        query = query.filter(PriceRollup.period_start >= bucket_start(start, bucket))
+    if end is not None:
+        query = query.filter(PriceRollup.period_start <= end)
+    return [rollup.to_dict() for rollup in query.order_by(PriceRollup.period_start)]
+
+
+def get_average_prices(days: int = 30) -> Dict[int, float]:
+    """Средняя рыночная цена каждой культуры за последние days дней (по дневным агрегатам)"""
+    since = bucket_start(datetime.utcnow() - timedelta(days=days), 'day')
+    rows = db.session.query(
+        PriceRollup.crop_id,
+        func.sum(PriceRollup.market_sum),
+        func.sum(PriceRollup.observations)
+    ).filter(
+        PriceRollup.bucket == 'day',
+        PriceRollup.period_start >= since
+    ).group_by(PriceRollup.crop_id).all()
+    return {crop_id: round(total / count, 2) for crop_id, total, count in rows if count}
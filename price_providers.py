@@ -0,0 +1,478 @@
+import csv
+import json
+import os
+import random
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from config import get_price_providers_config
+
+# Источники цен культур. Провайдер реализует fetch(crop_name, timeout); общая логика
+# (ограничение частоты, повторы, метрики) - в PriceProvider.get_prices. Новые типы
+# регистрируются декоратором register_provider и подключаются через PRICE_PROVIDERS
+# без изменений в price_updater.
+
+# Максимум одновременных соединений к одному хосту в общем пуле
+HTTP_POOL_SIZE = 8
+
+# Время жизни ответа по умолчанию, если источник не прислал Cache-Control, секунд
+DEFAULT_RESPONSE_TTL = 3600
+
+# Ответы HTTP, после которых запрос повторяется (кроме них - любой 5xx)
+RETRY_STATUS_CODES = frozenset({429})
+
+# Маппинг названий культур для поиска цен
+CROP_NAME_MAPPING = {
+    'Пшеница': ['пшеница', 'wheat', 'зерно пшеницы'],
+    'Ячмень': ['ячмень', 'barley', 'зерно ячменя'],
+    'Горох': ['горох', 'peas', 'горох продовольственный'],
+    'Фасоль': ['фасоль', 'beans', 'фасоль продовольственная'],
+    'Кукуруза': ['кукуруза', 'corn', 'зерно кукурузы'],
+    'Картофель': ['картофель', 'potato', 'картофель продовольственный'],
+    'Люцерна': ['люцерна', 'alfalfa', 'семена люцерны'],
+    'Клевер': ['клевер', 'clover', 'семена клевера'],
+    'Овес': ['овес', 'oats', 'зерно овса'],
+    'Свекла': ['свекла', 'beet', 'сахарная свекла']
+}
+
+# Базовые цены за тонну (в рублях) - средние рыночные цены
+BASE_MARKET_PRICES = {
+    'Пшеница': 18000,
+    'Ячмень': 15000,
+    'Горох': 25000,
+    'Фасоль': 30000,
+    'Кукуруза': 14000,
+    'Картофель': 15000,
+    'Люцерна': 8000,
+    'Клевер': 7000,
+    'Овес': 14000,
+    'Свекла': 12000
+}
+
+# Базовые цены семян за кг (в рублях)
+BASE_SEED_PRICES = {
+    'Пшеница': 25,
+    'Ячмень': 20,
+    'Горох': 50,
+    'Фасоль': 60,
+    'Кукуруза': 120,
+    'Картофель': 30,
+    'Люцерна': 200,
+    'Клевер': 150,
+    'Овес': 22,
+    'Свекла': 35
+}
+
+# Общий пул HTTP-соединений для всех источников цен
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Общая сессия requests с пулом соединений (потокобезопасна для GET-запросов)"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+        return _http_session
+
+
+def match_crop_name(names, crop_name: str) -> Optional[str]:
+    """Ключ из names, соответствующий культуре (по названию или синонимам из CROP_NAME_MAPPING)"""
+    aliases = {crop_name.lower(), *CROP_NAME_MAPPING.get(crop_name, [])}
+    for name in names:
+        if str(name).strip().lower() in aliases:
+            return name
+    return None
+
+
+def parse_prices(record) -> Optional[Dict[str, float]]:
+    """Цены из записи источника (ключи market_price_per_ton и seed_price_per_kg)"""
+    if not isinstance(record, dict):
+        return None
+    try:
+        return {
+            'market_price_per_ton': round(float(record['market_price_per_ton']), 2),
+            'seed_price_per_kg': round(float(record['seed_price_per_kg']), 2)
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate токенов в секунду, не более capacity подряд"""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ProviderMetrics:
+    """Счетчики провайдера: запросы, ошибки, попадания в кэш, время ответа"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.not_modified = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_error = None
+
+    def record(self, latency: float, error: Optional[Exception] = None) -> None:
+        with self.lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if error is not None:
+                self.errors += 1
+                self.last_error = str(error)
+
+    def record_cache(self, not_modified: bool = False) -> None:
+        with self.lock:
+            if not_modified:
+                self.not_modified += 1
+            else:
+                self.cache_hits += 1
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'cache_hits': self.cache_hits,
+                'not_modified': self.not_modified,
+                'avg_latency_ms': round(self.total_latency / self.requests * 1000, 1) if self.requests else None,
+                'max_latency_ms': round(self.max_latency * 1000, 1),
+                'last_error': self.last_error
+            }
+
+
+class ResponseCache:
+    """Кэш HTTP-ответов: в пределах TTL ответ берется из памяти, после - условный запрос
+    с If-None-Match/If-Modified-Since (304 продлевает срок без повторной загрузки)"""
+
+    def __init__(self, ttl: float = DEFAULT_RESPONSE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: Dict[Tuple, Dict] = {}
+        # Блокировки по ключу: параллельные запросы одного документа ждут первый, а не дублируют его
+        self.key_locks: Dict[Tuple, threading.Lock] = {}
+
+    def _ttl_from_headers(self, headers) -> float:
+        match = re.search(r'max-age=(\d+)', headers.get('Cache-Control', ''))
+        return float(match.group(1)) if match else self.ttl
+
+    def get_json(self, url: str, timeout: float, metrics: ProviderMetrics, params: Optional[Dict] = None):
+        key = (url, tuple(sorted((params or {}).items())))
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            return self._get_json(key, url, timeout, metrics, params)
+
+    def _get_json(self, key: Tuple, url: str, timeout: float, metrics: ProviderMetrics, params: Optional[Dict]):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry['expires_at'] > time.monotonic():
+            metrics.record_cache()
+            return entry['data']
+
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        started = time.monotonic()
+        try:
+            response = get_http_session().get(url, params=params, headers=headers, timeout=timeout)
+            if response.status_code != 304:
+                response.raise_for_status()
+        except requests.RequestException as e:
+            metrics.record(time.monotonic() - started, e)
+            raise
+        metrics.record(time.monotonic() - started)
+
+        if response.status_code == 304 and entry:
+            metrics.record_cache(not_modified=True)
+            data = entry['data']
+        else:
+            data = response.json()
+        with self.lock:
+            self.entries[key] = {
+                'data': data,
+                'etag': response.headers.get('ETag') or (entry or {}).get('etag'),
+                'last_modified': response.headers.get('Last-Modified') or (entry or {}).get('last_modified'),
+                'expires_at': time.monotonic() + self._ttl_from_headers(response.headers)
+            }
+        return data
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Временная ошибка источника: соединение, таймаут, 429 или 5xx. Другие ответы 4xx
+    и ошибки разбора ответа повторный запрос не исправит"""
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status is not None and (status in RETRY_STATUS_CODES or status >= 500)
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class PriceProvider:
+    """Базовый провайдер цен: ограничение частоты, таймаут, повторы с экспоненциальной
+    задержкой при временных ошибках (is_transient_error) и метрики. Подклассы реализуют fetch"""
+
+    def __init__(self, name: str, rate: float = 5.0, burst: int = 5, timeout: float = 10.0,
+                 retries: int = 2, backoff: float = 0.5):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.bucket = TokenBucket(rate, burst)
+        self.metrics = ProviderMetrics()
+
+    def fetch(self, crop_name: str, timeout: float) -> Optional[Dict[str, float]]:
+        raise NotImplementedError
+
+    def get_prices(self, crop_name: str) -> Optional[Dict[str, float]]:
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                return self.fetch(crop_name, timeout=self.timeout)
+            except (requests.RequestException, OSError, ValueError) as e:
+                if attempt == self.retries or not is_transient_error(e):
+                    print(f"Источник {self.name}: не удалось получить цены для {crop_name}: {e}")
+                    return None
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        return None
+
+    def describe(self) -> Dict:
+        return {'name': self.name, 'type': getattr(self, 'provider_type', None), 'metrics': self.metrics.to_dict()}
+
+
+# Реестр типов провайдеров: имя типа -> класс
+PROVIDER_TYPES: Dict[str, type] = {}
+
+
+def register_provider(provider_type: str):
+    """Декоратор регистрации класса провайдера под именем типа (ключ type в PRICE_PROVIDERS)"""
+    def decorator(cls):
+        cls.provider_type = provider_type
+        PROVIDER_TYPES[provider_type] = cls
+        return cls
+    return decorator
+
+
+@register_provider('random')
+class RandomPriceProvider(PriceProvider):
+    """Офлайн-генератор: базовая цена ±10% (используется, когда другие источники недоступны)"""
+
+    def __init__(self, name: str = 'offline', variation: float = 0.10, **kwargs):
+        kwargs.setdefault('rate', 1000.0)
+        kwargs.setdefault('burst', 1000)
+        super().__init__(name, **kwargs)
+        self.variation = variation
+
+    def fetch(self, crop_name: str, timeout: float) -> Optional[Dict[str, float]]:
+        started = time.monotonic()
+        if crop_name not in BASE_MARKET_PRICES:
+            self.metrics.record(time.monotonic() - started)
+            return None
+        variation = random.uniform(1 - self.variation, 1 + self.variation)
+        self.metrics.record(time.monotonic() - started)
+        return {
+            'market_price_per_ton': round(BASE_MARKET_PRICES[crop_name] * variation, 2),
+            'seed_price_per_kg': round(BASE_SEED_PRICES[crop_name] * variation, 2)
+        }
+
+
+@register_provider('http_json')
+class HttpJsonPriceProvider(PriceProvider):
+    """HTTP-источник JSON. Если url содержит {crop}, запрос делается на каждую культуру и ответ -
+    запись цен; иначе один документ {культура: {market_price_per_ton, seed_price_per_kg}}
+    на все культуры (загружается один раз за TTL)"""
+
+    def __init__(self, name: str, url: str, ttl: float = DEFAULT_RESPONSE_TTL, params: Optional[Dict] = None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.url = url
+        self.params = params or {}
+        self.cache = ResponseCache(ttl)
+
+    def fetch(self, crop_name: str, timeout: float) -> Optional[Dict[str, float]]:
+        if '{crop}' in self.url:
+            data = self.cache.get_json(self.url.format(crop=requests.utils.quote(crop_name)), timeout, self.metrics, self.params)
+            return parse_prices(data)
+        data = self.cache.get_json(self.url, timeout, self.metrics, self.params)
+        if not isinstance(data, dict):
+            raise ValueError("Ответ источника должен быть объектом JSON")
+        key = match_crop_name(data.keys(), crop_name)
+        return parse_prices(data[key]) if key is not None else None
+
+
+@register_provider('csv')
+class CsvPriceProvider(PriceProvider):
+    """Файл CSV (столбцы crop, market_price_per_ton, seed_price_per_kg), выгружаемый на диск.
+    Перечитывается только при изменении времени модификации файла"""
+
+    def __init__(self, name: str, path: str, delimiter: str = ',', **kwargs):
+        kwargs.setdefault('rate', 1000.0)
+        kwargs.setdefault('burst', 1000)
+        kwargs.setdefault('retries', 0)
+        super().__init__(name, **kwargs)
+        self.path = path
+        self.delimiter = delimiter
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.prices: Dict[str, Dict[str, float]] = {}
+
+    def _load(self) -> Dict[str, Dict[str, float]]:
+        mtime = os.path.getmtime(self.path)
+        with self.lock:
+            if mtime == self.mtime:
+                self.metrics.record_cache()
+                return self.prices
+            started = time.monotonic()
+            prices = {}
+            with open(self.path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f, delimiter=self.delimiter):
+                    parsed = parse_prices(row)
+                    if row.get('crop') and parsed:
+                        prices[row['crop']] = parsed
+            self.metrics.record(time.monotonic() - started)
+            self.prices = prices
+            self.mtime = mtime
+            return prices
+
+    def fetch(self, crop_name: str, timeout: float) -> Optional[Dict[str, float]]:
+        try:
+            prices = self._load()
+        except OSError as e:
+            self.metrics.record(0.0, e)
+            raise
+        key = match_crop_name(prices.keys(), crop_name)
+        return prices[key] if key is not None else None
+
+
+def create_provider(config: Dict) -> PriceProvider:
+    """Провайдер по описанию {"type": ..., "name": ..., <параметры конструктора>}"""
+    options = dict(config)
+    provider_type = options.pop('type', None)
+    if provider_type not in PROVIDER_TYPES:
+        raise ValueError(f"Неизвестный тип источника цен: {provider_type}")
+    options.setdefault('name', provider_type)
+    return PROVIDER_TYPES[provider_type](**options)
+
+
+_providers: Optional[List[PriceProvider]] = None
+_providers_lock = threading.Lock()
+
+
+def get_providers() -> List[PriceProvider]:
+    """Провайдеры из конфигурации (PRICE_PROVIDERS) в порядке приоритета; офлайн-генератор - последним"""
+    global _providers
+    with _providers_lock:
+        if _providers is None:
+            providers = []
+            for config in get_price_providers_config():
+                try:
+                    providers.append(create_provider(config))
+                except Exception as e:
+                    print(f"Источник цен {config} пропущен: {e}")
+            if not any(isinstance(p, RandomPriceProvider) for p in providers):
+                providers.append(RandomPriceProvider())
+            _providers = providers
+        return _providers
+
+
+def set_providers(providers: Optional[List[PriceProvider]]) -> None:
+    """Замена списка провайдеров (None - перечитать конфигурацию при следующем обращении)"""
+    global _providers
+    with _providers_lock:
+        _providers = providers
+
+
+def get_provider_metrics() -> List[Dict]:
+    return [provider.describe() for provider in get_providers()]
+
+
+class _StubPriceHandler(BaseHTTPRequestHandler):
+    # Локальный источник для разработки: GET /prices - цены всех культур с ETag,
+    # который меняется раз в period секунд
+    period = 3600
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/prices':
+            self.send_error(404)
+            return
+        epoch = int(time.time() // self.period)
+        etag = f'"{epoch}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        rng = random.Random(epoch)
+        body = json.dumps({
+            crop: {
+                'market_price_per_ton': round(price * rng.uniform(0.9, 1.1), 2),
+                'seed_price_per_kg': round(BASE_SEED_PRICES[crop] * rng.uniform(0.9, 1.1), 2)
+            }
+            for crop, price in BASE_MARKET_PRICES.items()
+        }, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(epoch * self.period, usegmt=True))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_stub_server(host: str = '127.0.0.1', port: int = 8765) -> ThreadingHTTPServer:
+    """Запуск локального источника цен в фоновом потоке (для разработки и проверки провайдеров)"""
+    server = ThreadingHTTPServer((host, port), _StubPriceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) >= 2 and sys.argv[1] == 'stub-server':
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+        server = ThreadingHTTPServer(('127.0.0.1', port), _StubPriceHandler)
+        print(f"Локальный источник цен: http://127.0.0.1:{port}/prices")
+        print(f'PRICE_PROVIDERS=[{{"type": "http_json", "name": "stub", "url": "http://127.0.0.1:{port}/prices"}}]')
+        server.serve_forever()
+    else:
+        print("Использование: python price_providers.py stub-server [port]")
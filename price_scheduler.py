@@ -0,0 +1,200 @@
+import argparse
+import atexit
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from config import db, get_price_scheduler_lock_path, get_price_scheduler_mode
+from models import Crop
+from price_updater import PRICE_UPDATE_INTERVAL, update_all_crop_prices
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Планировщик цен работает только в одном процессе - лидере, захватившем файловую блокировку.
+# Остальные воркеры периодически пытаются ее захватить и становятся лидером, если прежний
+# процесс завершился (блокировку снимает ОС). Сами обновления дополнительно защищены
+# отдельной блокировкой, чтобы не пересекаться с запуском из cron или вручную.
+LEADER_RETRY_SECONDS = 60
+
+
+class ProcessLock:
+    """Неблокирующая межпроцессная блокировка на файле (снимается ОС при завершении процесса)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.handle = None
+
+    def acquire(self) -> bool:
+        if self.handle is not None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        handle = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self.handle = handle
+        return True
+
+    def release(self) -> None:
+        if self.handle is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self.handle.seek(0)
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def run_price_update(force: bool = False) -> Optional[Dict[str, int]]:
+    """Обновление цен, если его не выполняет другой процесс (None - обновление уже идет).
+    Вызывается в контексте приложения"""
+    with ProcessLock(get_price_scheduler_lock_path() + '.run') as acquired:
+        if not acquired:
+            print("Обновление цен уже выполняется другим процессом")
+            return None
+        return update_all_crop_prices(force=force)
+
+
+def _needs_forced_refresh() -> bool:
+    # Если все культуры обновлены недавно (вероятно, результат миграции) - принудительное обновление
+    first = db.session.query(Crop.last_price_update).order_by(Crop.id).first()
+    if not first or not first.last_price_update:
+        return False
+    return datetime.utcnow() - first.last_price_update < PRICE_UPDATE_INTERVAL
+
+
+def _startup_price_update(app) -> None:
+    with app.app_context():
+        try:
+            force = _needs_forced_refresh()
+            if force:
+                print("\n[ИНИЦИАЛИЗАЦИЯ] Обнаружены недавно обновленные культуры (миграция).")
+                print("[ИНИЦИАЛИЗАЦИЯ] Выполняется принудительное обновление цен...")
+            print("\n[ИНИЦИАЛИЗАЦИЯ] Первичное обновление цен...")
+            run_price_update(force=force)
+            print("[ИНИЦИАЛИЗАЦИЯ] Первичное обновление завершено\n")
+        except Exception as e:
+            print(f"[ИНИЦИАЛИЗАЦИЯ] Ошибка при первичном обновлении цен: {e}\n")
+
+
+def _scheduled_price_update(app) -> None:
+    with app.app_context():
+        try:
+            print("\n[ПЛАНИРОВЩИК] Запуск автоматического обновления цен...")
+            run_price_update(force=False)
+            print("[ПЛАНИРОВЩИК] Обновление цен завершено\n")
+        except Exception as e:
+            print(f"[ПЛАНИРОВЩИК] Ошибка при обновлении цен: {e}\n")
+
+
+class PriceScheduler:
+    """Выборы лидера и запуск APScheduler в процессе-лидере"""
+
+    def __init__(self, app, lock_path: Optional[str] = None):
+        self.app = app
+        self.lock = ProcessLock(lock_path or get_price_scheduler_lock_path())
+        self.scheduler = None
+        self.stopped = threading.Event()
+
+    @property
+    def is_leader(self) -> bool:
+        return self.scheduler is not None
+
+    def try_become_leader(self) -> bool:
+        if self.is_leader:
+            return True
+        if not self.lock.acquire():
+            return False
+        scheduler = BackgroundScheduler(daemon=True)
+        # Первичное обновление - сразу в фоне, затем каждые 24 часа
+        scheduler.add_job(
+            func=_startup_price_update,
+            args=[self.app],
+            id='startup_crop_prices',
+            name='Первичное обновление цен на культуры'
+        )
+        scheduler.add_job(
+            func=_scheduled_price_update,
+            args=[self.app],
+            trigger=IntervalTrigger(hours=24),
+            id='update_crop_prices',
+            name='Обновление цен на культуры каждые 24 часа',
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1
+        )
+        scheduler.start()
+        self.scheduler = scheduler
+        print(f"[ПЛАНИРОВЩИК] Процесс {os.getpid()} - лидер, планировщик цен запущен")
+        return True
+
+    def _election_loop(self) -> None:
+        while not self.stopped.wait(LEADER_RETRY_SECONDS):
+            if self.try_become_leader():
+                return
+
+    def start(self) -> 'PriceScheduler':
+        if not self.try_become_leader():
+            threading.Thread(target=self._election_loop, name='price-scheduler-election', daemon=True).start()
+        atexit.register(self.shutdown)
+        return self
+
+    def shutdown(self) -> None:
+        self.stopped.set()
+        if self.scheduler is not None:
+            self.scheduler.shutdown(wait=False)
+            self.scheduler = None
+        self.lock.release()
+
+
+def start_price_scheduler(app) -> Optional[PriceScheduler]:
+    """Запуск планировщика цен в режиме PRICE_SCHEDULER (auto - один лидер, off - не запускать)"""
+    if get_price_scheduler_mode() == 'off':
+        return None
+    return PriceScheduler(app).start()
+
+
+def main(argv=None) -> int:
+    """Однократное обновление цен (для cron): python -m price_updater [--force]"""
+    from flask import Flask
+    from config import init_app_db
+
+    parser = argparse.ArgumentParser(prog='python -m price_updater', description='Обновление цен на культуры')
+    parser.add_argument('--force', action='store_true', help='обновить цены всех культур независимо от даты')
+    args = parser.parse_args(argv)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_app_db(app)
+    with app.app_context():
+        db.create_all()
+        result = run_price_update(force=args.force)
+    if result is None:
+        return 1
+    return 1 if result['failed'] else 0
@@ -1,143 +1,94 @@
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, Optional
-import time
-import random
-from flask import current_app
+from sqlalchemy import update
+from typing import Dict, Iterable, List, Optional
 from config import db
 from models import Crop
+from price_history import record_price_observations
+from price_providers import get_providers
+from response_cache import response_cache
 
 
-# Маппинг названий культур для поиска цен
-CROP_NAME_MAPPING = {
-    'Пшеница': ['пшеница', 'wheat', 'зерно пшеницы'],
-    'Ячмень': ['ячмень', 'barley', 'зерно ячменя'],
-    'Горох': ['горох', 'peas', 'горох продовольственный'],
-    'Фасоль': ['фасоль', 'beans', 'фасоль продовольственная'],
-    'Кукуруза': ['кукуруза', 'corn', 'зерно кукурузы'],
-    'Картофель': ['картофель', 'potato', 'картофель продовольственный'],
-    'Люцерна': ['люцерна', 'alfalfa', 'семена люцерны'],
-    'Клевер': ['клевер', 'clover', 'семена клевера'],
-    'Овес': ['овес', 'oats', 'зерно овса'],
-    'Свекла': ['свекла', 'beet', 'сахарная свекла']
-}
-
-
-def get_price_from_agro_api(crop_name: str) -> Optional[Dict[str, float]]:
-    try:
-        # Базовые цены за тонну (в рублях) - средние рыночные цены
-        base_prices = {
-            'Пшеница': 18000,
-            'Ячмень': 15000,
-            'Горох': 25000,
-            'Фасоль': 30000,
-            'Кукуруза': 14000,
-            'Картофель': 15000,
-            'Люцерна': 8000,
-            'Клевер': 7000,
-            'Овес': 14000,
-            'Свекла': 12000
-        }
-        
-        # Базовые цены семян за кг (в рублях)
-        base_seed_prices = {
-            'Пшеница': 25,
-            'Ячмень': 20,
-            'Горох': 50,
-            'Фасоль': 60,
-            'Кукуруза': 120,
-            'Картофель': 30,
-            'Люцерна': 200,
-            'Клевер': 150,
-            'Овес': 22,
-            'Свекла': 35
-        }
-        
-        if crop_name not in base_prices:
-            return None
-        
-        variation = random.uniform(0.90, 1.10)
-        market_price = base_prices[crop_name] * variation
-        seed_price = base_seed_prices[crop_name] * variation
-        
-        return {
-            'market_price_per_ton': round(market_price, 2),
-            'seed_price_per_kg': round(seed_price, 2)
-        }
-    except Exception as e:
-        print(f"Ошибка при получении цен для {crop_name}: {e}")
-        return None
-
-
-def get_price_from_web_scraping(crop_name: str) -> Optional[Dict[str, float]]:
-    try:
-        return get_price_from_agro_api(crop_name)
-    except Exception as e:
-        print(f"Ошибка при веб-скрапинге для {crop_name}: {e}")
-        return None
-
-
-def update_crop_prices(crop: Crop, force: bool = False) -> bool:
-    try:
-        # Проверяем, нужно ли обновление
-        if not force:
-            if crop.last_price_update:
-                time_since_update = datetime.utcnow() - crop.last_price_update
-                if time_since_update < timedelta(hours=24):
-                    return False  # Обновление не требуется
-        
-        # Пытаемся получить цены из разных источников
-        prices = None
-        
-        # Сначала пробуем API
-        prices = get_price_from_agro_api(crop.name)
-        
-        # Если API не сработал, пробуем веб-скрапинг
-        if not prices:
-            prices = get_price_from_web_scraping(crop.name)
-        
+# Интервал между обновлениями цен культуры
+PRICE_UPDATE_INTERVAL = timedelta(hours=24)
+
+# Число параллельных запросов цен
+PRICE_FETCH_WORKERS = 8
+
+
+def fetch_crop_prices(crop_name: str) -> Optional[Dict[str, float]]:
+    """Цены культуры из первого источника, который их вернул (без обращения к БД).
+    В результат добавляется название источника (source)"""
+    for provider in get_providers():
+        prices = provider.get_prices(crop_name)
         if prices:
-            # Обновляем цены в базе данных
-            crop.market_price_per_ton = prices['market_price_per_ton']
-            crop.seed_price_per_kg = prices['seed_price_per_kg']
-            crop.last_price_update = datetime.utcnow()
-            
-            db.session.commit()
-            print(f"✓ Обновлены цены для {crop.name}: "
-                  f"рынок={prices['market_price_per_ton']} руб/т, "
-                  f"семена={prices['seed_price_per_kg']} руб/кг")
-            return True
-        else:
-            print(f"✗ Не удалось получить цены для {crop.name}")
-            return False
-            
-    except Exception as e:
-        print(f"Ошибка при обновлении цен для {crop.name}: {e}")
-        db.session.rollback()
-        return False
+            return dict(prices, source=provider.name)
+    return None
 
 
-def update_all_crop_prices(force: bool = False) -> Dict[str, int]:
-    crops = Crop.query.all()
-    updated = 0
-    skipped = 0
+def _price_update_row(crop_id: int, prices: Dict[str, float], updated_at: datetime) -> Dict:
+    return {
+        'id': crop_id,
+        'market_price_per_ton': prices['market_price_per_ton'],
+        'seed_price_per_kg': prices['seed_price_per_kg'],
+        'last_price_update': updated_at
+    }
+
+
+def _price_observation(crop_id: int, prices: Dict[str, float], observed_at: datetime) -> Dict:
+    return {
+        'crop_id': crop_id,
+        'source': prices.get('source', 'unknown'),
+        'observed_at': observed_at,
+        'market_price_per_ton': prices['market_price_per_ton'],
+        'seed_price_per_kg': prices['seed_price_per_kg']
+    }
+
+
+def update_crop_prices(crops: Iterable, force: bool = False) -> Dict[str, int]:
+    """Обновление цен указанных культур (объекты или строки с id, name и last_price_update).
+    Запросы к источникам - параллельно, запись - одним UPDATE и одной транзакцией"""
+    crops = list(crops)
+    due = [crop for crop in crops if force or should_update_crop(crop)]
+    skipped = len(crops) - len(due)
     failed = 0
     
     print(f"\n{'='*60}")
-    print(f"Начало обновления цен для {len(crops)} культур")
+    print(f"Начало обновления цен для {len(crops)} культур (к обновлению: {len(due)})")
     print(f"{'='*60}")
     
-    for crop in crops:
+    # Запросы к источникам - параллельно (частота ограничивается по каждому источнику),
+    # запись в БД - одним UPDATE и пакетом наблюдений цен в конце
+    rows: List[Dict] = []
+    observations: List[Dict] = []
+    if due:
+        with ThreadPoolExecutor(max_workers=min(PRICE_FETCH_WORKERS, len(due))) as executor:
+            results = executor.map(fetch_crop_prices, [crop.name for crop in due])
+            updated_at = datetime.utcnow()
+            for crop, prices in zip(due, results):
+                if prices:
+                    rows.append(_price_update_row(crop.id, prices, updated_at))
+                    observations.append(_price_observation(crop.id, prices, updated_at))
+                    print(f"✓ Получены цены для {crop.name}: "
+                          f"рынок={prices['market_price_per_ton']} руб/т, "
+                          f"семена={prices['seed_price_per_kg']} руб/кг")
+                else:
+                    print(f"✗ Не удалось получить цены для {crop.name}")
+                    failed += 1
+    
+    if rows:
         try:
-            if update_crop_prices(crop, force=force):
-                updated += 1
-            else:
-                skipped += 1
+            # Текущие цены в Crop и наблюдения в истории - одной транзакцией
+            db.session.execute(update(Crop), rows)
+            record_price_observations(observations)
+            db.session.commit()
+            response_cache.invalidate('crops')
         except Exception as e:
-            print(f"Ошибка при обработке {crop.name}: {e}")
-            failed += 1
-        # Небольшая задержка между запросами, чтобы не перегружать источники
-        time.sleep(0.5)
+            print(f"Ошибка при сохранении цен: {e}")
+            db.session.rollback()
+            failed += len(rows)
+            rows = []
+    updated = len(rows)
     
     print(f"\n{'='*60}")
     print(f"Обновление завершено:")
@@ -154,12 +105,17 @@ def update_all_crop_prices(force: bool = False) -> Dict[str, int]:
     }
 
 
+def update_all_crop_prices(force: bool = False) -> Dict[str, int]:
+    # Для отбора нужны только id, название и дата обновления
+    return update_crop_prices(db.session.query(Crop.id, Crop.name, Crop.last_price_update).all(), force)
+
+
 def should_update_crop(crop: Crop) -> bool:
     if not crop.last_price_update:
         return True
     
     time_since_update = datetime.utcnow() - crop.last_price_update
-    return time_since_update >= timedelta(hours=24)
+    return time_since_update >= PRICE_UPDATE_INTERVAL
 
 
 def get_price_update_status() -> Dict:
@@ -181,3 +137,9 @@ def get_price_update_status() -> Dict:
     
     return status
 
+
+if __name__ == '__main__':
+    # Однократное обновление цен для cron: python -m price_updater [--force]
+    import sys
+    from price_scheduler import main
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+from flask import current_app, request
+from config import get_response_cache_config
+
+# Кэш ответов read-mostly API. Каждая запись помечена тегами данных ('fields', 'crops',
+# 'crop_history'); обработчики записи вызывают invalidate(тег), что увеличивает версию тега.
+# Запись действительна, пока версии ее тегов не изменились (и не истек TTL).
+# Версии и записи хранятся в памяти процесса (LRU) и, если задан RESPONSE_CACHE_DB, в общей
+# базе SQLite, чтобы инвалидация в одном воркере (или в cron-процессе обновления цен)
+# была видна всем остальным.
+
+# Заголовки ответа, которые сохраняются вместе с телом
+CACHED_HEADER_PREFIX = 'X-'
+# Как часто (сек) процесс удаляет из общей базы устаревшие и лишние записи
+SHARED_PURGE_INTERVAL = 30
+
+
+class LRUCache:
+    """Потокобезопасный LRU-словарь ограниченного размера"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class SQLiteCacheBackend:
+    """Общее хранилище версий тегов и записей кэша в файле SQLite (для нескольких процессов).
+    Ключ записи - путь с параметрами запроса (bbox, zoom, ...), поэтому записи не только
+    перезаписываются: устаревшие (старше ttl) и самые старые сверх maxsize удаляются при записи,
+    не чаще SHARED_PURGE_INTERVAL"""
+
+    def __init__(self, path: str, ttl: float = 300, maxsize: int = 10000):
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.local = threading.local()
+        self.purge_lock = threading.Lock()
+        self.last_purge = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS tag_versions (tag TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, versions TEXT NOT NULL, "
+                "created_at REAL NOT NULL, etag TEXT NOT NULL, mimetype TEXT, headers TEXT, body BLOB NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_created_at ON entries (created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def versions(self, tags: Sequence[str]) -> Dict[str, int]:
+        rows = self._connect().execute(
+            f"SELECT tag, version FROM tag_versions WHERE tag IN ({','.join('?' * len(tags))})", tuple(tags)
+        ).fetchall()
+        return dict(rows)
+
+    def bump(self, tags: Iterable[str]) -> None:
+        conn = self._connect()
+        conn.executemany(
+            "INSERT INTO tag_versions (tag, version) VALUES (?, 1) "
+            "ON CONFLICT(tag) DO UPDATE SET version = version + 1",
+            [(tag,) for tag in tags]
+        )
+
+    def get(self, key: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT versions, created_at, etag, mimetype, headers, body FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'versions': tuple(json.loads(row[0])),
+            'created_at': row[1],
+            'etag': row[2],
+            'mimetype': row[3],
+            'headers': json.loads(row[4] or '{}'),
+            'body': row[5]
+        }
+
+    def put(self, key: str, entry: Dict) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO entries (key, versions, created_at, etag, mimetype, headers, body) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, json.dumps(entry['versions']), entry['created_at'], entry['etag'],
+             entry['mimetype'], json.dumps(entry['headers']), entry['body'])
+        )
+        self._purge()
+
+    def _purge(self) -> None:
+        # Один процесс-поток за интервал; остальные записывают без очистки
+        now = time.time()
+        with self.purge_lock:
+            if now - self.last_purge < SHARED_PURGE_INTERVAL:
+                return
+            self.last_purge = now
+        conn = self._connect()
+        conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM entries WHERE created_at <= ("
+            "SELECT created_at FROM entries ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+            (self.maxsize,)
+        )
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM entries")
+
+
+class ResponseCache:
+    """Кэш ответов с тегами, строгими ETag и ответом 304 на If-None-Match"""
+
+    def __init__(self, maxsize: int = 512, ttl: float = 300, shared_path: Optional[str] = None,
+                 shared_maxsize: int = 10000):
+        self.ttl = ttl
+        self.entries = LRUCache(maxsize)
+        self.local_versions: Dict[str, int] = {}
+        # Версии тегов и счетчики статистики (обновляются из потоков запросов)
+        self.lock = threading.Lock()
+        self.shared = SQLiteCacheBackend(shared_path, ttl, shared_maxsize) if shared_path else None
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @classmethod
+    def from_config(cls) -> 'ResponseCache':
+        return cls(**get_response_cache_config())
+
+    def scope_warning(self) -> Optional[str]:
+        """Предупреждение для журнала, если сброс кэша не виден другим процессам (нет RESPONSE_CACHE_DB)"""
+        if self.shared is not None:
+            return None
+        return (f"RESPONSE_CACHE_DB не задан: сброс кэша ответов действует только в этом процессе, "
+                f"другие воркеры и процессы отдают прежние ответы до {self.ttl:g} с (RESPONSE_CACHE_TTL)")
+
+    def versions(self, tags: Sequence[str]) -> Tuple[int, ...]:
+        if self.shared is not None:
+            versions = self.shared.versions(tags)
+        else:
+            with self.lock:
+                versions = dict(self.local_versions)
+        return tuple(versions.get(tag, 0) for tag in tags)
+
+    def invalidate(self, *tags: str) -> None:
+        """Сброс всех записей с указанными тегами (вызывается после фиксации изменений)"""
+        with self.lock:
+            for tag in tags:
+                self.local_versions[tag] = self.local_versions.get(tag, 0) + 1
+        if self.shared is not None:
+            try:
+                self.shared.bump(tags)
+            except sqlite3.Error as e:
+                print(f"Не удалось сбросить общий кэш ответов ({', '.join(tags)}): {e}")
+
+    def clear(self) -> None:
+        self.entries.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def _valid(self, entry: Optional[Dict], versions: Tuple[int, ...]) -> bool:
+        return (
+            entry is not None
+            and tuple(entry['versions']) == versions
+            and time.time() - entry['created_at'] < self.ttl
+        )
+
+    def get(self, key: str, versions: Tuple[int, ...]) -> Optional[Dict]:
+        entry = self.entries.get(key)
+        if self._valid(entry, versions):
+            return entry
+        if self.shared is not None:
+            entry = self.shared.get(key)
+            if self._valid(entry, versions):
+                self.entries.put(key, entry)
+                return entry
+        return None
+
+    def put(self, key: str, versions: Tuple[int, ...], response) -> Dict:
+        body = response.get_data()
+        entry = {
+            'versions': versions,
+            'created_at': time.time(),
+            'etag': hashlib.sha256(body).hexdigest()[:32],
+            'mimetype': response.mimetype,
+            'headers': {k: v for k, v in response.headers.items() if k.startswith(CACHED_HEADER_PREFIX)},
+            'body': body
+        }
+        self.entries.put(key, entry)
+        if self.shared is not None:
+            try:
+                self.shared.put(key, entry)
+            except sqlite3.Error as e:
+                print(f"Не удалось сохранить ответ в общий кэш: {e}")
+        return entry
+
+    def _count(self, counter: str) -> None:
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            stats = {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'shared': self.shared is not None
+            }
+        if self.shared is not None:
+            try:
+                stats['shared_entries'] = self.shared.count()
+            except sqlite3.Error:
+                pass
+        return stats
+
+    def cached(self, *tags: str):
+        """Декоратор GET-обработчика: ответ 200 кэшируется по пути и параметрам запроса"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = request.full_path
+                versions = self.versions(tags)
+                entry = self.get(key, versions)
+                if entry is None:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    entry = self.put(key, versions, response)
+                    self._count('misses')
+                else:
+                    self._count('hits')
+                return self._respond(entry)
+            return wrapper
+        return decorator
+
+    def _respond(self, entry: Dict):
+        if request.if_none_match.contains(entry['etag']):
+            self._count('not_modified')
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+            response.headers.update(entry['headers'])
+        response.set_etag(entry['etag'])
+        # Данные доступны только авторизованным пользователям; браузер проверяет актуальность по ETag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+response_cache = ResponseCache.from_config()
@@ -0,0 +1,88 @@
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from calculator_api import (
+    build_crop_arrays, calculate_profit_grid, get_category_index, ROTATION_YIELD_MATRIX
+)
+from models import Crop
+
+# Максимальный горизонт планирования, лет
+MAX_PLAN_YEARS = 30
+
+# Состояния динамического программирования - строки матриц севооборота
+# (категория предшественника: Зерновые, Бобовые, Овощные, прочие, нет предшественника)
+NUM_STATES = ROTATION_YIELD_MATRIX.shape[0]
+
+
+def build_state_profit_table(crops: Sequence[Crop], area: float) -> np.ndarray:
+    """Чистая прибыль культуры при каждом состоянии предшественника, форма (культуры, состояния)"""
+    grid = calculate_profit_grid(build_crop_arrays(crops), np.arange(NUM_STATES), [area])
+    return grid["net_profit"][:, :, 0]
+
+
+def optimize_rotation(
+    crops: Sequence[Crop],
+    area: float,
+    years: int,
+    previous_category: Optional[str] = None,
+    profit_table: Optional[np.ndarray] = None
+) -> Dict:
+    """Последовательность культур на years лет с максимальной суммарной чистой прибылью.
+    Прибыль культуры зависит только от категории предшественника, поэтому задача решается
+    динамическим программированием по состояниям (год, категория предшественника):
+    O(years × состояния × культуры) вместо перебора всех последовательностей"""
+    if not crops:
+        raise ValueError("Нет культур для планирования")
+    if years < 1 or years > MAX_PLAN_YEARS:
+        raise ValueError(f"Горизонт планирования должен быть от 1 до {MAX_PLAN_YEARS} лет")
+
+    profit = build_state_profit_table(crops, area) if profit_table is None else profit_table
+    # Состояние после посева культуры - ее категория
+    next_state = build_crop_arrays(crops)["category_index"]
+
+    # value[t, s] - лучшая прибыль за годы t..years-1 при предшественнике s; choice - выбранная культура
+    value = np.zeros((years + 1, NUM_STATES))
+    choice = np.zeros((years, NUM_STATES), dtype=np.intp)
+    for t in range(years - 1, -1, -1):
+        # total[s, c] = прибыль культуры c после s + лучшее продолжение из категории c
+        total = profit.T + value[t + 1][next_state][None, :]
+        choice[t] = np.argmax(total, axis=1)
+        value[t] = total[np.arange(NUM_STATES), choice[t]]
+
+    state = get_category_index(previous_category)
+    plan: List[Dict] = []
+    for t in range(years):
+        c = choice[t, state]
+        plan.append({
+            "crop_id": crops[c].id,
+            "crop_name": crops[c].name,
+            "category": crops[c].category,
+            "net_profit": round(float(profit[c, state]), 2)
+        })
+        state = next_state[c]
+
+    return {
+        "plan": plan,
+        "total_net_profit": round(float(value[0, get_category_index(previous_category)]), 2)
+    }
+
+
+def plan_field_rotation(
+    crops: Sequence[Crop],
+    area: float,
+    years: int,
+    last_crop: Optional[Crop] = None,
+    start_year: Optional[int] = None
+) -> Dict:
+    """План севооборота поля начиная с года start_year после культуры last_crop"""
+    result = optimize_rotation(crops, area, years, last_crop.category if last_crop else None)
+    if start_year is not None:
+        for offset, step in enumerate(result["plan"]):
+            step["year"] = start_year + offset
+    result.update({
+        "area": area,
+        "years": years,
+        "previous_crop": last_crop.name if last_crop else None,
+        "start_year": start_year
+    })
+    return result
+
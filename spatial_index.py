@@ -0,0 +1,120 @@
+from typing import Optional, Tuple
+from sqlalchemy import and_, column, table, text
+from models import Field
+
+# Пространственный индекс полей: виртуальная таблица SQLite R*Tree по bbox поля.
+# Синхронизируется с таблицей fields триггерами, поэтому любые вставки, изменения
+# и удаления (через ORM или SQL) сразу отражаются в индексе.
+RTREE_TABLE = 'fields_rtree'
+
+fields_rtree = table(
+    RTREE_TABLE,
+    column('id'),
+    column('min_lon'),
+    column('max_lon'),
+    column('min_lat'),
+    column('max_lat')
+)
+
+_RTREE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} USING rtree(id, min_lon, max_lon, min_lat, max_lat)",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fields_rtree_insert AFTER INSERT ON fields
+    WHEN NEW.bbox_min_lon IS NOT NULL
+    BEGIN
+        INSERT INTO {RTREE_TABLE} VALUES (NEW.id, NEW.bbox_min_lon, NEW.bbox_max_lon, NEW.bbox_min_lat, NEW.bbox_max_lat);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fields_rtree_update AFTER UPDATE OF bbox_min_lon, bbox_min_lat, bbox_max_lon, bbox_max_lat ON fields
+    BEGIN
+        DELETE FROM {RTREE_TABLE} WHERE id = OLD.id;
+        INSERT INTO {RTREE_TABLE}
+        SELECT NEW.id, NEW.bbox_min_lon, NEW.bbox_max_lon, NEW.bbox_min_lat, NEW.bbox_max_lat
+        WHERE NEW.bbox_min_lon IS NOT NULL;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS fields_rtree_delete AFTER DELETE ON fields
+    BEGIN
+        DELETE FROM {RTREE_TABLE} WHERE id = OLD.id;
+    END
+    """
+]
+
+# Кэш: есть ли R*Tree в базе (по URL движка)
+_rtree_available = {}
+
+
+def parse_bbox(value: str) -> Tuple[float, float, float, float]:
+    """Разбор параметра bbox=minLon,minLat,maxLon,maxLat"""
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError("bbox должен иметь вид minLon,minLat,maxLon,maxLat")
+    min_lon, min_lat, max_lon, max_lat = (float(p) for p in parts)
+    if min_lon > max_lon or min_lat > max_lat:
+        raise ValueError("В bbox минимальные координаты больше максимальных")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def ensure_spatial_index(engine) -> bool:
+    """Создание R*Tree, триггеров и заполнение индекса для существующих полей.
+    Возвращает False, если база не SQLite или модуль rtree недоступен"""
+    if engine.dialect.name != 'sqlite':
+        _rtree_available[str(engine.url)] = False
+        return False
+    try:
+        with engine.connect() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+            ), {'name': RTREE_TABLE}).first() is not None
+            for statement in _RTREE_DDL:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text(f"""
+                    INSERT INTO {RTREE_TABLE}
+                    SELECT id, bbox_min_lon, bbox_max_lon, bbox_min_lat, bbox_max_lat
+                    FROM fields WHERE bbox_min_lon IS NOT NULL
+                """))
+            conn.commit()
+    except Exception as e:
+        print(f"Пространственный индекс недоступен: {e}")
+        _rtree_available[str(engine.url)] = False
+        return False
+    _rtree_available[str(engine.url)] = True
+    return True
+
+
+def has_spatial_index(engine) -> bool:
+    """Есть ли в базе R*Tree полей (результат кэшируется)"""
+    key = str(engine.url)
+    if key not in _rtree_available:
+        if engine.dialect.name != 'sqlite':
+            _rtree_available[key] = False
+        else:
+            with engine.connect() as conn:
+                _rtree_available[key] = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ), {'name': RTREE_TABLE}).first() is not None
+    return _rtree_available[key]
+
+
+def filter_fields_by_bbox(query, engine, bbox: Optional[Tuple[float, float, float, float]]):
+    """Ограничение запроса Field полями, bbox которых пересекается с bbox"""
+    if bbox is None:
+        return query
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if has_spatial_index(engine):
+        return query.join(fields_rtree, fields_rtree.c.id == Field.id).filter(
+            fields_rtree.c.min_lon <= max_lon,
+            fields_rtree.c.max_lon >= min_lon,
+            fields_rtree.c.min_lat <= max_lat,
+            fields_rtree.c.max_lat >= min_lat
+        )
+    # Без R*Tree (например, PostgreSQL) - сравнение по колонкам bbox
+    return query.filter(and_(
+        Field.bbox_min_lon <= max_lon,
+        Field.bbox_max_lon >= min_lon,
+        Field.bbox_min_lat <= max_lat,
+        Field.bbox_max_lat >= min_lat
+    ))
@@ -177,6 +177,62 @@ function displayCalculatorResult(result) {
     container.innerHTML = html;
 }
 
+// Сравнение всех культур и предшественников для указанной площади
+document.getElementById('compare-btn').addEventListener('click', async function() {
+    const area = parseFloat(document.getElementById('calc-area').value);
+    
+    if (!area || area <= 0) {
+        return;
+    }
+    
+    try {
+        const response = await fetch('/api/calculate/matrix', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                areas: [area]
+            })
+        });
+        
+        if (response.ok) {
+            const matrix = await response.json();
+            displayComparisonTable(matrix);
+        }
+    } catch (error) {
+        console.error('Ошибка сравнения культур:', error);
+    }
+});
+
+// Таблица прибыли: строки - культуры, столбцы - предшественники
+function displayComparisonTable(matrix) {
+    const container = document.getElementById('comparison-table');
+    const header = matrix.previous_crops.map(name => `<th>${name ? escapeHtml(name) : 'Без предшественника'}</th>`).join('');
+    const rows = matrix.crops.map((cropName, i) => {
+        const cells = matrix.net_profit[i].map(values => {
+            const profit = values[0];
+            return `<td style="color: ${profit >= 0 ? '#15803d' : '#b91c1c'};">${formatCurrency(profit)}</td>`;
+        }).join('');
+        return `<tr><td><strong>${escapeHtml(cropName)}</strong></td>${cells}</tr>`;
+    }).join('');
+    
+    container.innerHTML = `
+        <h3>Чистая прибыль для ${matrix.areas[0]} га, руб.</h3>
+        <table>
+            <thead>
+                <tr>
+                    <th>Культура / Предшественник</th>
+                    ${header}
+                </tr>
+            </thead>
+            <tbody>
+                ${rows}
+            </tbody>
+        </table>
+    `;
+}
+
 // Инициализация
 document.addEventListener('DOMContentLoaded', function() {
     loadCrops();
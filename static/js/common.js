@@ -15,3 +15,41 @@ function formatCurrency(amount) {
     return new Intl.NumberFormat('ru-RU').format(amount);
 }
 
+
+// Декодирование одного кольца из encoded polyline в координаты GeoJSON [lng, lat]
+function decodePolyline(encoded, precision) {
+    const factor = Math.pow(10, precision);
+    const coordinates = [];
+    let index = 0, lat = 0, lng = 0;
+    while (index < encoded.length) {
+        const deltas = [];
+        for (let k = 0; k < 2; k++) {
+            let result = 0, shift = 0, byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result |= (byte & 0x1f) << shift;
+                shift += 5;
+            } while (byte >= 0x20);
+            deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
+        }
+        lat += deltas[0];
+        lng += deltas[1];
+        coordinates.push([lng / factor, lat / factor]);
+    }
+    return coordinates;
+}
+
+// Декодирование компактной геометрии поля (encoding=polyline) в объект GeoJSON
+function decodeGeometry(encoded) {
+    const polygons = encoded.polygons.map(rings => rings.map(ring => decodePolyline(ring, encoded.precision)));
+    if (encoded.type === 'MultiPolygon') {
+        return { type: 'MultiPolygon', coordinates: polygons };
+    }
+    return { type: 'Polygon', coordinates: polygons[0] };
+}
+
+// Геометрия поля из ответа API (GeoJSON-строка или компактная кодировка)
+function getFieldGeometry(field) {
+    return field.geometry_encoded ? decodeGeometry(field.geometry_encoded) : JSON.parse(field.geometry);
+}
+
@@ -4,6 +4,100 @@ let drawControl;
 let drawnItems;
 let currentField = null;
 let fields = [];
+let mapFitted = false;
+let fieldTilesLayer;
+let tileVersion = 0;
+let drawingActive = false;
+// Объекты загруженных тайлов по ключу "z/x/y" (для поиска поля по клику)
+const tileFeatures = new Map();
+
+// Слой тайлов границ полей: каждый тайл - canvas с полигонами из /tiles/fields/{z}/{x}/{y}.geojson
+const FieldTilesLayer = L.GridLayer.extend({
+    createTile: function(coords, done) {
+        const tile = document.createElement('canvas');
+        const size = this.getTileSize();
+        tile.width = size.x;
+        tile.height = size.y;
+        const key = `${coords.z}/${coords.x}/${coords.y}`;
+        
+        fetch(`/tiles/fields/${key}.geojson?v=${tileVersion}`)
+            .then(response => response.json())
+            .then(collection => {
+                tileFeatures.set(key, collection.features);
+                drawFieldTile(tile, coords, size, collection.features);
+                done(null, tile);
+            })
+            .catch(error => done(error, tile));
+        return tile;
+    }
+});
+
+// Полигоны объекта GeoJSON как список колец (Polygon и MultiPolygon)
+function getFeaturePolygons(geometry) {
+    return geometry.type === 'MultiPolygon' ? geometry.coordinates : [geometry.coordinates];
+}
+
+// Отрисовка полей тайла на canvas
+function drawFieldTile(tile, coords, size, features) {
+    const ctx = tile.getContext('2d');
+    const origin = coords.scaleBy(size);
+    ctx.fillStyle = 'rgba(239, 68, 68, 0.3)';
+    ctx.strokeStyle = '#ef4444';
+    ctx.lineWidth = 2;
+    
+    features.forEach(feature => {
+        ctx.beginPath();
+        getFeaturePolygons(feature.geometry).forEach(polygon => {
+            polygon.forEach(ring => {
+                ring.forEach((point, i) => {
+                    const p = map.project(L.latLng(point[1], point[0]), coords.z).subtract(origin);
+                    if (i === 0) {
+                        ctx.moveTo(p.x, p.y);
+                    } else {
+                        ctx.lineTo(p.x, p.y);
+                    }
+                });
+                ctx.closePath();
+            });
+        });
+        ctx.fill('evenodd');
+        ctx.stroke();
+    });
+}
+
+// Попадание точки в полигон (правило even-odd по всем кольцам)
+function pointInPolygons(lng, lat, polygons) {
+    let inside = false;
+    polygons.forEach(polygon => {
+        polygon.forEach(ring => {
+            for (let i = 0, j = ring.length - 1; i < ring.length; j = i++) {
+                const [xi, yi] = ring[i];
+                const [xj, yj] = ring[j];
+                if ((yi > lat) !== (yj > lat) && lng < (xj - xi) * (lat - yi) / (yj - yi) + xi) {
+                    inside = !inside;
+                }
+            }
+        });
+    });
+    return inside;
+}
+
+// Поиск поля под точкой клика среди объектов загруженного тайла
+function findFieldAt(latlng) {
+    const z = Math.round(map.getZoom());
+    const tileCoords = map.project(latlng, z).divideBy(fieldTilesLayer.getTileSize().x).floor();
+    const features = tileFeatures.get(`${z}/${tileCoords.x}/${tileCoords.y}`) || [];
+    const feature = features.find(f => pointInPolygons(latlng.lng, latlng.lat, getFeaturePolygons(f.geometry)));
+    return feature ? fields.find(field => field.id === feature.properties.id) : null;
+}
+
+// Всплывающее окно поля
+function openFieldPopup(field, latlng) {
+    L.popup()
+        .setLatLng(latlng)
+        .setContent(`<b>${escapeHtml(field.name)}</b><br>Площадь: ${field.area || 'Не указана'} га<br><button class="btn btn-success" onclick="viewField(${field.id})" style="margin-top: 5px; width: 100%;">Просмотр поля</button>`)
+        .openOn(map);
+}
 
 // Инициализация карты
 function initMap() {
@@ -40,6 +134,23 @@ function initMap() {
     
     map.addControl(drawControl);
     
+    // Границы полей загружаются тайлами (только видимые, параллельно)
+    fieldTilesLayer = new FieldTilesLayer();
+    fieldTilesLayer.on('tileunload', function(event) {
+        tileFeatures.delete(`${event.coords.z}/${event.coords.x}/${event.coords.y}`);
+    });
+    fieldTilesLayer.addTo(map);
+    
+    map.on(L.Draw.Event.DRAWSTART, function() { drawingActive = true; });
+    map.on(L.Draw.Event.DRAWSTOP, function() { drawingActive = false; });
+    map.on('click', function(event) {
+        if (drawingActive) return;
+        const field = findFieldAt(event.latlng);
+        if (field) {
+            openFieldPopup(field, event.latlng);
+        }
+    });
+    
     // Функция расчета площади
     function calculateArea(latLngs) {
         if (!latLngs || latLngs.length < 3) return 0;
@@ -130,7 +241,8 @@ function initMap() {
 // Загрузка полей
 async function loadFields() {
     try {
-        const response = await fetch('/api/fields');
+        // Геометрия не нужна: карта рисуется тайлами, для списка хватает bbox и центроида
+        const response = await fetch('/api/fields?include_geometry=0');
         fields = await response.json();
         displayFields();
         displayFieldsOnMap();
@@ -182,49 +294,29 @@ function displayFields() {
 
 // Отображение полей на карте
 function displayFieldsOnMap() {
-    drawnItems.clearLayers();
-    
-    fields.forEach(field => {
-        try {
-            const geometry = JSON.parse(field.geometry);
-            const layer = L.geoJSON(geometry, {
-                style: {
-                    color: '#ef4444',
-                    fillColor: '#ef4444',
-                    fillOpacity: 0.3,
-                    weight: 2
-                }
-            }).bindPopup(`<b>${escapeHtml(field.name)}</b><br>Площадь: ${field.area || 'Не указана'} га<br><button class="btn btn-success" onclick="viewField(${field.id})" style="margin-top: 5px; width: 100%;">Просмотр поля</button>`);
-            drawnItems.addLayer(layer);
-        } catch (error) {
-            console.error('Ошибка отображения поля на карте:', error);
-        }
-    });
+    // Поля изменились - перезапрашиваем тайлы в обход кэша браузера
+    tileVersion++;
+    fieldTilesLayer.redraw();
     
-    if (fields.length > 0) {
-        map.fitBounds(drawnItems.getBounds());
+    const boxes = fields.filter(field => field.bbox);
+    if (boxes.length > 0 && !mapFitted) {
+        mapFitted = true;
+        const bounds = L.latLngBounds(boxes.map(field => [field.bbox[1], field.bbox[0]]));
+        boxes.forEach(field => bounds.extend([field.bbox[3], field.bbox[2]]));
+        map.fitBounds(bounds);
     }
 }
 
 // Просмотр поля
 function viewField(fieldId) {
-    // Можно перейти на отдельную страницу или показать детали поля
-    // Пока просто центрируем карту на поле
     const field = fields.find(f => f.id === fieldId);
-    if (field) {
-        try {
-            const geometry = JSON.parse(field.geometry);
-            const layer = L.geoJSON(geometry);
-            map.fitBounds(layer.getBounds());
-            
-            // Открываем popup
-            drawnItems.eachLayer(function(l) {
-                if (l.feature && l.feature.id === fieldId) {
-                    l.openPopup();
-                }
-            });
-        } catch (error) {
-            console.error('Ошибка просмотра поля:', error);
+    if (field && field.bbox) {
+        const [minLon, minLat, maxLon, maxLat] = field.bbox;
+        map.fitBounds([[minLat, minLon], [maxLat, maxLon]]);
+        
+        // Открываем popup в центроиде поля
+        if (field.centroid) {
+            openFieldPopup(field, L.latLng(field.centroid[0], field.centroid[1]));
         }
     }
 }
@@ -281,6 +373,7 @@ document.getElementById('save-field-btn').addEventListener('click', async functi
             document.getElementById('cancel-field-btn').style.display = 'none';
             document.getElementById('field-name').value = '';
             currentField = null;
+            drawnItems.clearLayers();
             loadFields();
         }
     } catch (error) {
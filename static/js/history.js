@@ -14,7 +14,7 @@ async function loadCrops() {
 // Загрузка полей для селекта
 async function loadFieldsForSelect() {
     try {
-        const response = await fetch('/api/fields');
+        const response = await fetch('/api/fields?include_geometry=0');
         const fieldsData = await response.json();
         const select = document.getElementById('history-field-select');
         select.innerHTML = '<option value="">Выберите поле</option>' +
@@ -7,7 +7,7 @@ let historyRecords = [];
 async function loadStats() {
     try {
         // Загружаем поля
-        const fieldsResponse = await fetch('/api/fields');
+        const fieldsResponse = await fetch('/api/fields?include_geometry=0');
         fields = await fieldsResponse.json();
         
         // Загружаем культуры
@@ -96,23 +96,19 @@ async function loadAllRecommendations() {
     container.innerHTML = '<p class="loading-text">Загрузка рекомендаций...</p>';
     
     try {
-        const recommendations = [];
-        
-        // Загружаем рекомендации для каждого поля
-        for (const field of fields) {
-            try {
-                const response = await fetch(`/api/field-recommendation?field_id=${field.id}`);
-                if (response.ok) {
-                    const recommendation = await response.json();
-                    recommendations.push({
-                        field: field,
-                        recommendation: recommendation
-                    });
-                }
-            } catch (error) {
-                console.error(`Ошибка загрузки рекомендации для поля ${field.id}:`, error);
-            }
+        // Загружаем рекомендации для всех полей одним запросом
+        const response = await fetch('/api/field-recommendations');
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
         }
+        const batch = await response.json();
+        const fieldsById = new Map(fields.map(field => [field.id, field]));
+        const recommendations = batch
+            .filter(recommendation => fieldsById.has(recommendation.field_id))
+            .map(recommendation => ({
+                field: fieldsById.get(recommendation.field_id),
+                recommendation: recommendation
+            }));
         
         document.getElementById('stat-recommendations').textContent = recommendations.length;
         displayAllRecommendations(recommendations);
@@ -0,0 +1,59 @@
+import os
+import sys
+import pytest
+from flask import Flask
+
+# Модули приложения лежат в корне репозитория
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import db, init_app_db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """Минимальное приложение с пустыми базами SQLite во временном каталоге (без app.py,
+    планировщика цен и модели)"""
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'geoweb.db'}")
+    monkeypatch.setenv('USERS_DATABASE_URL', f"sqlite:///{tmp_path / 'users.db'}")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_app_db(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture(scope='session')
+def web_app(tmp_path_factory):
+    """Приложение app.py на временных базах, без планировщика цен; модель рекомендаций
+    обучается и сохраняется во временном каталоге"""
+    tmp = tmp_path_factory.mktemp('web')
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{tmp / 'geoweb.db'}",
+        'USERS_DATABASE_URL': f"sqlite:///{tmp / 'users.db'}",
+        'PRICE_SCHEDULER': 'off',
+        'AUTO_MIGRATE': '1',
+        'TILE_CACHE_DIR': str(tmp / 'tile_cache'),
+        'MODEL_VERSIONS_DIR': str(tmp / 'model_versions'),
+    })
+    os.environ.pop('RESPONSE_CACHE_DB', None)
+    from app import app as web_app
+    from neural_network_recommender import recommender
+    from utils import seed_initial_crops
+    with web_app.app_context():
+        seed_initial_crops()
+    recommender.model_path = str(tmp / 'crop_recommender.joblib')
+    web_app.config['TESTING'] = True
+    return web_app
+
+
+@pytest.fixture
+def client(web_app):
+    """Клиент с авторизованной сессией"""
+    client = web_app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
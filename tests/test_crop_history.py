@@ -0,0 +1,19 @@
+import pytest
+from models import CropHistory
+
+
+@pytest.mark.parametrize('cursor', ['after_year=2020', 'after_id=3', 'after_year=x&after_id=1', 'after_year=2020&after_id='])
+def test_incomplete_cursor_is_rejected(client, cursor):
+    response = client.get(f'/api/crop-history?limit=10&{cursor}')
+    assert response.status_code == 400
+    assert 'after_year' in response.get_json()['error']
+
+
+def test_full_cursor_is_accepted(client):
+    assert client.get('/api/crop-history?limit=10&after_year=2020&after_id=3').status_code == 200
+    assert client.get('/api/crop-history?limit=10').status_code == 200
+
+
+def test_listing_query_rejects_half_cursor(app):
+    with pytest.raises(ValueError):
+        CropHistory.listing_query(after_year=2020)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from config import db
+from farm_planner import solve_assignment
+from models import CropHistory, Field
+
+SQUARE = {'type': 'Polygon', 'coordinates': [[[39.70, 47.20], [39.72, 47.20], [39.72, 47.22], [39.70, 47.22], [39.70, 47.20]]]}
+
+
+@pytest.fixture
+def farm(web_app):
+    with web_app.app_context():
+        CropHistory.query.delete()
+        Field.query.delete()
+        for name in ('Северное', 'Южное'):
+            field = Field(name=name)
+            field.set_geometry(SQUARE)
+            db.session.add(field)
+        db.session.commit()
+
+
+@pytest.mark.parametrize('payload', [
+    {'min_tonnage': {'Пшеница': None}},
+    {'min_tonnage': {'Пшеница': 'много'}},
+    {'min_tonnage': ['Пшеница', 100]},
+    {'max_area': {'Пшеница': {'га': 10}}},
+    {'max_area': 'Пшеница'},
+    {'max_area': {'Пшеница': float('nan')}},
+    {'seed_budget': 'x'},
+    {'time_limit': 0},
+])
+def test_invalid_parameters(client, farm, payload):
+    response = client.post('/api/farm/rotation-plan', json=payload)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_plan_is_optimal(client, farm):
+    response = client.post('/api/farm/rotation-plan', json={'max_area': {'Пшеница': 1e6}})
+    assert response.status_code == 200
+    plan = response.get_json()
+    assert (plan['optimal'], plan['status']) == (True, 'optimal')
+    assert len(plan['assignments']) == 2
+
+
+def test_time_limit_is_reported(monkeypatch):
+    # Решатель остановлен по времени с найденным планом (status=1): план возвращается с optimal=False
+    import scipy.optimize
+    num_fields, num_crops = 3, 2
+    columns = {
+        'area': np.full(num_fields, 10.0),
+        'net_profit': np.ones((num_fields, num_crops)),
+        'total_harvest': np.ones((num_fields, num_crops)),
+        'seed_cost': np.ones((num_fields, num_crops)),
+    }
+    incumbent = np.array([1, 0, 0, 1, 1, 0], dtype=float)
+    monkeypatch.setattr(scipy.optimize, 'milp', lambda **kwargs: scipy.optimize.OptimizeResult(
+        status=1, x=incumbent, message='Time limit reached.'
+    ))
+    choice, optimal = solve_assignment(columns, time_limit=1e-3)
+    assert choice.tolist() == [0, 1, 0]
+    assert not optimal
@@ -0,0 +1,139 @@
+import io
+import json
+import pytest
+from field_io import READ_CHUNK_SIZE, _JsonStream, import_fields, iter_geojson, iter_ndjson
+from models import Field
+
+SQUARE = {'type': 'Polygon', 'coordinates': [[[30, 50], [30.01, 50], [30.01, 50.01], [30, 50.01], [30, 50]]]}
+
+
+class SlowStream(io.RawIOBase):
+    """Поток, отдающий не больше size байт за чтение (границы порций внутри чисел и символов)"""
+
+    def __init__(self, data: bytes, size: int = 7):
+        self.data = io.BytesIO(data)
+        self.size = size
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        return self.data.read(self.size)
+
+
+def feature(name, geometry=SQUARE):
+    return {'type': 'Feature', 'properties': {'name': name}, 'geometry': geometry}
+
+
+def collection(features):
+    return json.dumps({'type': 'FeatureCollection', 'name': 'поля', 'features': features}, ensure_ascii=False).encode()
+
+
+def test_iter_geojson_small_chunks():
+    features = [feature(f'Поле №{i}') for i in range(5)]
+    assert [f for _, f in iter_geojson(SlowStream(collection(features)))] == features
+
+
+def test_iter_geojson_array_and_empty():
+    assert list(iter_geojson(io.BytesIO(b'[]'))) == []
+    assert list(iter_geojson(io.BytesIO(b'{}'))) == []
+    assert [n for n, _ in iter_geojson(io.BytesIO(b'[{"a": 1}, {"b": 2}]'))] == [1, 2]
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'{"type": "FeatureCollection", "features": [',
+    b'{"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": {"type": "Pol',
+    b'{"type": "FeatureCollection", "features": [{"a": 1} {"b": 2}]}',
+    b'"features"',
+])
+def test_iter_geojson_truncated_or_malformed(data):
+    with pytest.raises(ValueError):
+        list(iter_geojson(SlowStream(data)))
+
+
+class CountingStream(io.RawIOBase):
+    """Поток с подсчетом чтений и прочитанных байт"""
+
+    def __init__(self, data: bytes):
+        self.data = io.BytesIO(data)
+        self.reads = 0
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        chunk = self.data.read(n)
+        self.reads += 1
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def test_malformed_feature_fails_without_reading_rest():
+    features = [feature(f'Поле {i}') for i in range(20000)]
+    # Название второго поля без кавычек; после него в потоке еще больше 20 порций
+    broken = collection(features).replace('"Поле 1"'.encode(), b'oops', 1)
+    stream = CountingStream(broken)
+    numbers = []
+    with pytest.raises(ValueError, match='Объект 2'):
+        for number, _ in iter_geojson(stream):
+            numbers.append(number)
+    assert numbers == [1]
+    assert len(broken) > 20 * READ_CHUNK_SIZE
+    assert stream.bytes_read <= 2 * READ_CHUNK_SIZE
+
+
+def test_large_value_read_in_growing_chunks():
+    ring = [[30 + i * 1e-6, 50] for i in range(50000)] + [[30, 50]]
+    value = {'type': 'Polygon', 'coordinates': [ring]}
+    data = json.dumps(value).encode()
+    stream = CountingStream(data)
+    assert _JsonStream(stream, chunk_size=1024).value() == value
+    # Порции растут вдвое: число чтений - логарифм размера значения
+    assert stream.reads <= (len(data) // 1024).bit_length() + 2
+
+
+def test_value_size_limit():
+    data = json.dumps({'geometry': 'x' * 10000}).encode()
+    stream = CountingStream(data)
+    with pytest.raises(ValueError, match='больше 1000 символов'):
+        _JsonStream(stream, chunk_size=100, max_value_size=1000).value()
+    assert stream.bytes_read <= 1200
+
+
+def test_iter_ndjson_reports_bad_lines():
+    data = b'{"a": 1}\n\n{"b": \n\x1e{"c": 3}\n'
+    items = list(iter_ndjson(io.BytesIO(data)))
+    assert items[0] == (1, {'a': 1})
+    assert items[1][0] == 3 and isinstance(items[1][1], ValueError)
+    assert items[2] == (4, {'c': 3})
+
+
+def test_import_truncated_stream_keeps_committed_batches(app):
+    features = [feature(f'Поле {i}') for i in range(5)]
+    data = collection(features)
+    # Обрыв внутри пятого объекта: первые два пакета по два поля уже записаны
+    truncated = data[:data.index('Поле 4'.encode())]
+    reports = list(import_fields(iter_geojson(SlowStream(truncated)), batch_size=2))
+    final = reports[-1]
+    assert final['done'] and 'error' in final
+    assert final['imported'] == 4
+    assert sorted(f.name for f in Field.query) == ['Поле 0', 'Поле 1', 'Поле 2', 'Поле 3']
+
+
+def test_import_skips_invalid_features(app):
+    features = [
+        feature('Поле 1'),
+        feature(''),
+        feature('Поле 2', {'type': 'Point', 'coordinates': [30, 50]}),
+        feature('Поле 3', {'type': 'Polygon', 'coordinates': [[[30, 50], [30.01, 50]]]}),
+        'не объект',
+        feature('Поле 4', {'type': 'Feature', 'geometry': SQUARE}),
+    ]
+    final = list(import_fields(iter_geojson(io.BytesIO(collection(features))), batch_size=10))[-1]
+    assert final['done'] and 'error' not in final
+    assert (final['processed'], final['imported'], final['failed']) == (6, 2, 4)
+    assert [e['feature'] for e in final['errors']] == [2, 3, 4, 5]
+    stored = {f.name: json.loads(f.geometry) for f in Field.query}
+    assert stored == {'Поле 1': SQUARE, 'Поле 4': SQUARE}
@@ -0,0 +1,95 @@
+import random
+import pytest
+from sqlalchemy import event
+from config import db
+from models import Crop, CropHistory, Field
+from neural_network_recommender import InferenceSnapshot, recommender
+
+FIELDS = [
+    ('Северное', [[39.70, 47.20], [39.72, 47.20], [39.72, 47.22], [39.70, 47.22], [39.70, 47.20]], 3),
+    ('Южное', [[38.90, 45.00], [38.93, 45.00], [38.93, 45.02], [38.90, 45.02], [38.90, 45.00]], 2),
+    ('Заречное', [[44.50, 48.70], [44.52, 48.70], [44.52, 48.71], [44.50, 48.71], [44.50, 48.70]], 1),
+    ('Новое', [[37.60, 55.70], [37.61, 55.70], [37.61, 55.71], [37.60, 55.71], [37.60, 55.70]], 0),
+]
+
+
+@pytest.fixture
+def fields(web_app):
+    with web_app.app_context():
+        CropHistory.query.delete()
+        Field.query.delete()
+        crops = Crop.query.order_by(Crop.id).all()
+        ids = []
+        for number, (name, ring, years) in enumerate(FIELDS):
+            field = Field(name=name)
+            field.set_geometry({'type': 'Polygon', 'coordinates': [ring]})
+            db.session.add(field)
+            db.session.flush()
+            for year in range(years):
+                crop = crops[(number + year) % len(crops)]
+                db.session.add(CropHistory(field_id=field.id, crop_id=crop.id, year=2020 + year))
+            ids.append(field.id)
+        db.session.commit()
+    recommender.get_snapshot()
+    recommender.recommendation_cache.clear()
+    return ids
+
+
+@pytest.fixture
+def predict_calls(monkeypatch):
+    calls = []
+    predict_proba = InferenceSnapshot.predict_proba
+
+    def counting(self, rows):
+        calls.append(len(rows))
+        return predict_proba(self, rows)
+
+    monkeypatch.setattr(InferenceSnapshot, 'predict_proba', counting)
+    return calls
+
+
+@pytest.fixture
+def statements(web_app):
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    with web_app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_batch_matches_single_field_recommendations(client, fields):
+    # Тексты рекомендаций выбираются случайно: одинаковое зерно для обоих способов
+    random.seed(7)
+    response = client.get('/api/field-recommendations')
+    assert response.status_code == 200
+    batch = response.get_json()
+    assert [r['field_id'] for r in batch] == fields
+
+    recommender.recommendation_cache.clear()
+    random.seed(7)
+    single = []
+    for field_id in fields:
+        response = client.get(f'/api/field-recommendation?field_id={field_id}')
+        assert response.status_code == 200
+        single.append(dict(response.get_json(), field_id=field_id))
+    assert batch == single
+
+
+def test_batch_uses_two_queries_and_one_predict_proba(client, fields, predict_calls, statements):
+    response = client.get('/api/field-recommendations')
+    assert response.status_code == 200
+    assert len(statements) == 2
+    # Поле без истории не попадает в матрицу признаков
+    assert predict_calls == [len(fields) - 1]
+
+
+def test_batch_served_from_cache(client, fields, predict_calls):
+    first = client.get('/api/field-recommendations').get_json()
+    second = client.get('/api/field-recommendations').get_json()
+    assert first == second
+    assert predict_calls == [len(fields) - 1]
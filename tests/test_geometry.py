@@ -0,0 +1,73 @@
+from geometry import _simplify_ring, encode_geometry, encode_polyline, simplify_geometry
+
+
+def decode_polyline(encoded, precision):
+    # Повторение decodePolyline из static/js/common.js (побитовые операции над 32-битными целыми)
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append([lng / factor, lat / factor])
+    return coordinates
+
+
+def test_polyline_round_trip():
+    ring = [[37.617635, 55.755814], [37.618, 55.7561], [-122.419416, -37.774929], [0.0, 0.0], [37.617635, 55.755814]]
+    assert decode_polyline(encode_polyline(ring), 6) == ring
+
+
+def test_polyline_round_trip_quantizes_to_precision():
+    ring = [[30.1234567, 50.9876543], [30.2, 50.1], [30.1234567, 50.9876543]]
+    assert decode_polyline(encode_polyline(ring, 5), 5) == [[30.12346, 50.98765], [30.2, 50.1], [30.12346, 50.98765]]
+
+
+def test_encode_geometry_multipolygon():
+    polygons = [
+        [[[0, 0], [1, 0], [1, 1], [0, 0]], [[0.2, 0.1], [0.8, 0.1], [0.8, 0.7], [0.2, 0.1]]],
+        [[[10, 10], [11, 10], [11, 11], [10, 10]]],
+    ]
+    encoded = encode_geometry({'type': 'MultiPolygon', 'coordinates': polygons})
+    assert encoded['type'] == 'MultiPolygon'
+    decoded = [[decode_polyline(ring, encoded['precision']) for ring in polygon] for polygon in encoded['polygons']]
+    assert decoded == polygons
+
+
+def test_simplify_keeps_short_ring():
+    triangle = [[0, 0], [1, 0], [0, 1], [0, 0]]
+    assert _simplify_ring(triangle, 10) == triangle
+
+
+def test_simplify_collinear_ring_is_not_collapsed():
+    # Все точки на одной прямой: упрощение дало бы меньше 4 точек, кольцо остается как есть
+    ring = [[0, 0], [1, 0], [2, 0], [3, 0], [4, 0], [0, 0]]
+    assert _simplify_ring(ring, 0.5) == ring
+
+
+def test_simplify_ring_of_identical_points():
+    ring = [[1, 1]] * 6
+    assert _simplify_ring(ring, 0.5) == ring
+
+
+def test_simplify_drops_repeated_points():
+    ring = [[0, 0], [0, 0], [2, 0], [2, 0], [2, 2], [0, 2], [0, 2], [0, 0]]
+    assert _simplify_ring(ring, 0.01) == [[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]
+
+
+def test_simplify_drops_hole_smaller_than_tolerance():
+    outer = [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]
+    hole = [[5, 5], [5.0001, 5], [5, 5.0001], [5, 5]]
+    simplified = simplify_geometry({'type': 'Polygon', 'coordinates': [outer, hole]}, 0.01)
+    assert simplified == {'type': 'Polygon', 'coordinates': [outer]}
@@ -0,0 +1,99 @@
+import json
+import pytest
+from config import db
+from history_import import import_crop_history
+from models import Crop, CropHistory, Field
+
+SQUARE = json.dumps({'type': 'Polygon', 'coordinates': [[[30, 50], [30.01, 50], [30.01, 50.01], [30, 50.01], [30, 50]]]})
+
+
+@pytest.fixture
+def catalog(app):
+    wheat = Crop(name='Пшеница', category='зерновые')
+    peas = Crop(name='Горох', category='бобовые')
+    north = Field(name='Северное', geometry=SQUARE)
+    south = Field(name='Южное', geometry=SQUARE)
+    db.session.add_all([wheat, peas, north, south])
+    db.session.commit()
+    return {'wheat': wheat.id, 'peas': peas.id, 'north': north.id, 'south': south.id}
+
+
+def rows():
+    return sorted(
+        (h.field_id, h.year, h.season, h.crop_id, h.notes)
+        for h in CropHistory.query
+    )
+
+
+def run(records, **kwargs):
+    return list(import_crop_history(enumerate(records, 1), **kwargs))[-1]
+
+
+def test_duplicate_keys_in_one_batch_last_wins(catalog):
+    progress = run([
+        {'field_name': 'Северное', 'crop_name': 'Пшеница', 'year': 2023},
+        {'field_name': 'северное ', 'crop_name': 'горох', 'year': '2023', 'notes': 'пересев'},
+        {'field_name': 'Южное', 'crop_name': 'Горох', 'year': 2023, 'season': 'озимые'},
+        {'field_id': catalog['south'], 'crop_id': catalog['wheat'], 'year': 2023, 'season': 'озимые'},
+    ])
+    assert 'error' not in progress
+    assert (progress['inserted'], progress['updated'], progress['rejected']) == (2, 0, 0)
+    assert rows() == [
+        (catalog['north'], 2023, 'весна-лето', catalog['peas'], 'пересев'),
+        (catalog['south'], 2023, 'озимые', catalog['wheat'], ''),
+    ]
+
+
+def test_duplicate_keys_of_existing_row_in_one_batch(catalog):
+    run([{'field_name': 'Северное', 'crop_name': 'Пшеница', 'year': 2022, 'notes': 'первая загрузка'}])
+    history_id = CropHistory.query.one().id
+    progress = run([
+        {'field_name': 'Северное', 'crop_name': 'Горох', 'year': 2022, 'notes': 'исправлено'},
+        {'field_name': 'Северное', 'crop_name': 'Пшеница', 'year': 2022},
+    ])
+    assert (progress['inserted'], progress['updated']) == (0, 1)
+    # Запись без notes обновляет культуру, примечание из предыдущей строки того же ключа сохраняется
+    history = CropHistory.query.one()
+    assert (history.id, history.crop_id, history.notes) == (history_id, catalog['wheat'], 'исправлено')
+
+
+def test_duplicate_keys_across_batches(catalog):
+    records = [
+        {'field_name': 'Южное', 'crop_name': 'Пшеница', 'year': year}
+        for year in (2020, 2021, 2020, 2021, 2020)
+    ]
+    records[-1]['crop_name'] = 'Горох'
+    progress = run(records, batch_size=2)
+    assert 'error' not in progress
+    assert (progress['inserted'], progress['updated']) == (2, 3)
+    assert rows() == [
+        (catalog['south'], 2020, 'весна-лето', catalog['peas'], ''),
+        (catalog['south'], 2021, 'весна-лето', catalog['wheat'], ''),
+    ]
+
+
+def test_rejected_records(catalog):
+    rejected = []
+    progress = run([
+        {'field_name': 'Нет такого', 'crop_name': 'Пшеница', 'year': 2023},
+        {'field_name': 'Северное', 'crop_name': 'Рожь', 'year': 2023},
+        {'field_name': 'Северное', 'crop_name': 'Пшеница', 'year': 'позапрошлый'},
+        {'field_name': 'Северное', 'crop_name': 'Пшеница', 'year': 1800},
+        ValueError('Некорректный JSON'),
+        {'field_name': 'Северное', 'crop_name': 'Пшеница', 'year': 2023},
+    ], on_reject=lambda number, record, reason: rejected.append(number))
+    assert (progress['inserted'], progress['rejected']) == (1, 5)
+    assert rejected == [1, 2, 3, 4, 5]
+
+
+def test_cli_reports_setup_error(tmp_path, monkeypatch, capsys):
+    from history_import import main
+    from response_cache import response_cache
+
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'cli.db'}")
+    monkeypatch.setenv('USERS_DATABASE_URL', f"sqlite:///{tmp_path / 'cli_users.db'}")
+    monkeypatch.setattr(response_cache, 'shared', None)
+    assert main([str(tmp_path / 'missing.csv')]) == 1
+    out = capsys.readouterr().out
+    assert 'Загрузка прервана' in out and 'missing.csv' in out
+    assert 'RESPONSE_CACHE_DB не задан' in out
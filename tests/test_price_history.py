@@ -0,0 +1,81 @@
+from datetime import datetime
+import pytest
+from config import db
+from models import Crop, PriceRollup
+from price_history import get_price_history, record_price_observations
+
+
+@pytest.fixture
+def crop_id(app):
+    crop = Crop(name='Пшеница', category='зерновые')
+    db.session.add(crop)
+    db.session.commit()
+    return crop.id
+
+
+def observation(crop_id, observed_at, market, seed):
+    return {
+        'crop_id': crop_id, 'source': 'test', 'observed_at': observed_at,
+        'market_price_per_ton': market, 'seed_price_per_kg': seed
+    }
+
+
+def rollup(crop_id, bucket, period_start):
+    return db.session.get(PriceRollup, (crop_id, bucket, period_start))
+
+
+def test_rollup_min_max_after_reupsert(crop_id):
+    day = datetime(2024, 3, 6)
+    record_price_observations([
+        observation(crop_id, datetime(2024, 3, 6, 9), 15000, 30),
+        observation(crop_id, datetime(2024, 3, 6, 12), 16000, 28),
+    ])
+    db.session.commit()
+    # Повторная запись в тот же период: одно наблюдение ниже минимума, другое выше максимума
+    record_price_observations([observation(crop_id, datetime(2024, 3, 6, 15), 14000, 35)])
+    record_price_observations([observation(crop_id, datetime(2024, 3, 6, 18), 17000, 29)])
+    db.session.commit()
+
+    row = rollup(crop_id, 'day', day)
+    assert row.observations == 4
+    assert (row.market_min, row.market_max) == (14000, 17000)
+    assert (row.seed_min, row.seed_max) == (28, 35)
+    assert row.market_sum == 62000
+    assert (row.market_last, row.seed_last) == (17000, 29)
+
+    # Наблюдение внутри диапазона не меняет min/max
+    record_price_observations([observation(crop_id, datetime(2024, 3, 6, 20), 15500, 30)])
+    db.session.commit()
+    db.session.expire_all()
+    row = rollup(crop_id, 'day', day)
+    assert (row.observations, row.market_min, row.market_max, row.seed_min, row.seed_max) == (5, 14000, 17000, 28, 35)
+
+
+def test_late_observation_does_not_replace_last(crop_id):
+    record_price_observations([observation(crop_id, datetime(2024, 3, 6, 18), 16000, 30)])
+    db.session.commit()
+    record_price_observations([observation(crop_id, datetime(2024, 3, 6, 8), 12000, 40)])
+    db.session.commit()
+    db.session.expire_all()
+    row = rollup(crop_id, 'day', datetime(2024, 3, 6))
+    assert (row.market_last, row.seed_last) == (16000, 30)
+    assert (row.market_min, row.seed_max) == (12000, 40)
+    assert row.last_observed_at == datetime(2024, 3, 6, 18)
+
+
+def test_rollups_per_bucket(crop_id):
+    record_price_observations([
+        observation(crop_id, datetime(2024, 3, 4, 10), 15000, 30),  # понедельник
+        observation(crop_id, datetime(2024, 3, 10, 10), 17000, 32),  # воскресенье той же недели
+        observation(crop_id, datetime(2024, 3, 11, 10), 13000, 31),  # следующая неделя
+    ])
+    db.session.commit()
+    assert len(get_price_history(crop_id, bucket='day')) == 3
+    weeks = get_price_history(crop_id, bucket='week')
+    assert [(w['period_start'], w['observations'], w['market_price_min'], w['market_price_max']) for w in weeks] == [
+        ('2024-03-04T00:00:00', 2, 15000, 17000),
+        ('2024-03-11T00:00:00', 1, 13000, 13000),
+    ]
+    month, = get_price_history(crop_id, bucket='month')
+    assert (month['observations'], month['market_price_min'], month['market_price_max']) == (3, 13000, 17000)
+    assert month['market_price_avg'] == 15000
@@ -0,0 +1,63 @@
+import json
+import pytest
+import requests
+from price_providers import PriceProvider
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"HTTP {status}", response=response)
+
+
+class FailingProvider(PriceProvider):
+    """Источник, который всегда отвечает заданной ошибкой"""
+
+    def __init__(self, error):
+        super().__init__('failing', rate=1000, burst=1000, retries=2, backoff=0)
+        self.error = error
+        self.calls = 0
+
+    def fetch(self, crop_name, timeout):
+        self.calls += 1
+        raise self.error
+
+
+@pytest.mark.parametrize('error', [
+    requests.ConnectionError('connection refused'),
+    requests.Timeout('read timed out'),
+    http_error(429),
+    http_error(500),
+    http_error(503),
+])
+def test_transient_errors_are_retried(error):
+    provider = FailingProvider(error)
+    assert provider.get_prices('Пшеница') is None
+    assert provider.calls == 3
+
+
+@pytest.mark.parametrize('error', [
+    http_error(400),
+    http_error(404),
+    ValueError('Ответ источника должен быть объектом JSON'),
+    json.JSONDecodeError('Expecting value', '<html>', 0),
+    requests.exceptions.JSONDecodeError('Expecting value', '<html>', 0),
+    FileNotFoundError('prices.csv'),
+])
+def test_permanent_errors_are_not_retried(error):
+    provider = FailingProvider(error)
+    assert provider.get_prices('Пшеница') is None
+    assert provider.calls == 1
+
+
+def test_recovers_after_transient_error():
+    class FlakyProvider(FailingProvider):
+        def fetch(self, crop_name, timeout):
+            self.calls += 1
+            if self.calls == 1:
+                raise http_error(502)
+            return {'market_price_per_ton': 18000.0, 'seed_price_per_kg': 25.0}
+
+    provider = FlakyProvider(None)
+    assert provider.get_prices('Пшеница') == {'market_price_per_ton': 18000.0, 'seed_price_per_kg': 25.0}
+    assert provider.calls == 2
@@ -0,0 +1,130 @@
+from types import SimpleNamespace
+import pytest
+from neural_network_recommender import CropRecommender, RecommendationCache
+
+SQUARE = {'type': 'Polygon', 'coordinates': [[[39.70, 47.20], [39.72, 47.20], [39.72, 47.22], [39.70, 47.22], [39.70, 47.20]]]}
+CENTER = (47.21, 39.71)
+
+
+def test_recently_used_entry_survives_eviction():
+    cache = RecommendationCache(maxsize=3, ttl=60)
+    for key in 'abc':
+        cache.put(key, key.upper())
+    assert cache.get('a') == 'A'
+    cache.put('d', 'D')
+    assert [cache.get(key) for key in 'abcd'] == ['A', None, 'C', 'D']
+
+
+def test_unused_entries_evicted_in_insertion_order():
+    cache = RecommendationCache(maxsize=2, ttl=60)
+    for key in 'abc':
+        cache.put(key, key.upper())
+    assert [cache.get(key) for key in 'abc'] == [None, 'B', 'C']
+
+
+def test_hot_entry_survives_many_inserts():
+    cache = RecommendationCache(maxsize=4, ttl=60)
+    cache.put('hot', 1)
+    for i in range(100):
+        assert cache.get('hot') == 1
+        cache.put(i, i)
+    assert len(cache.items) == 4
+
+
+def test_expired_entry_is_not_returned():
+    cache = RecommendationCache(maxsize=4, ttl=0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+    assert cache.stats()['misses'] == 1
+
+
+def recommendation(recommendation_type, confidence):
+    return {'recommendation_type': recommendation_type, 'recommendation_text': recommendation_type, 'confidence': confidence}
+
+
+def make_recommender(monkeypatch, outputs, cache_size):
+    """Рекомендатель без модели: _recommend выдает заданные ответы по очереди (список)
+    или по предшественнику (dict, как модель - один ответ на одно состояние поля)"""
+    recommender = CropRecommender()
+    recommender.recommendation_cache = RecommendationCache(maxsize=cache_size, ttl=60)
+    recommender.snapshot = SimpleNamespace(version=1)
+    if isinstance(outputs, dict):
+        answer = lambda row: outputs[row['last_crop']]
+    else:
+        queue = list(outputs)
+        answer = lambda row: queue.pop(0)
+    monkeypatch.setattr(recommender, '_loaded_snapshot', lambda: recommender.snapshot)
+    monkeypatch.setattr(recommender, '_recommend', lambda snapshot, rows, **kwargs: [answer(row) for row in rows])
+    return recommender
+
+
+RECORD_IDS = {}
+
+
+def history(*crops):
+    # История по убыванию года; у каждой записи свой id, одинаковая история - те же id
+    return [
+        {'id': RECORD_IDS.setdefault(crops[i:], len(RECORD_IDS) + 1), 'crop_name': crop}
+        for i, crop in enumerate(crops)
+    ]
+
+
+def update(recommender, crop_history, field_id=1, field_name='Северное'):
+    return recommender.update_field_history_and_get_recommendation(
+        field_name, SQUARE, crop_history, CENTER, field_id=field_id, history_id=crop_history[0]['id']
+    )
+
+
+def test_first_recommendation_is_new(monkeypatch):
+    recommender = make_recommender(monkeypatch, [recommendation('удобрение', 0.6)], cache_size=16)
+    assert update(recommender, history('Пшеница'))['recommendation_type'] == 'удобрение'
+
+
+def test_previous_kept_while_still_relevant(monkeypatch):
+    recommender = make_recommender(monkeypatch, [recommendation('севооборот', 0.6), recommendation('удобрение', 0.65)], cache_size=16)
+    first = update(recommender, history('Пшеница'))
+    assert update(recommender, history('Ячмень', 'Пшеница')) == first
+
+
+def test_new_when_confidence_clearly_higher(monkeypatch):
+    recommender = make_recommender(monkeypatch, [recommendation('севооборот', 0.6), recommendation('удобрение', 0.7)], cache_size=16)
+    update(recommender, history('Пшеница'))
+    assert update(recommender, history('Ячмень', 'Пшеница'))['recommendation_type'] == 'удобрение'
+
+
+def test_new_when_previous_no_longer_relevant(monkeypatch):
+    # Защита растений актуальна только после овощных
+    recommender = make_recommender(monkeypatch, [recommendation('защита растений', 0.6), recommendation('удобрение', 0.6)], cache_size=16)
+    update(recommender, history('Картофель'))
+    assert update(recommender, history('Пшеница', 'Картофель'))['recommendation_type'] == 'удобрение'
+
+
+def test_stickiness_is_per_field_id(monkeypatch):
+    # Поля с одинаковым названием не делят прошлую рекомендацию
+    recommender = make_recommender(monkeypatch, [recommendation('севооборот', 0.6), recommendation('удобрение', 0.6)], cache_size=16)
+    update(recommender, history('Пшеница'), field_id=1)
+    assert update(recommender, history('Пшеница'), field_id=2)['recommendation_type'] == 'удобрение'
+
+
+@pytest.mark.parametrize('steps', [
+    [('Пшеница',), ('Пшеница',), ('Ячмень', 'Пшеница'), ('Ячмень', 'Пшеница'), ('Пшеница',)],
+    [('Картофель',), ('Пшеница', 'Картофель'), ('Пшеница', 'Картофель'), ('Картофель',), ('Морковь', 'Картофель')],
+    # Запись истории удалена (возврат к прежнему состоянию из кэша), затем добавлена другая
+    [('Пшеница',), ('Горох', 'Пшеница'), ('Пшеница',), ('Овес', 'Пшеница')],
+])
+def test_cache_hits_do_not_change_stickiness(monkeypatch, steps):
+    # Последовательность обновлений дает те же ответы с кэшем и без него
+    outputs = {
+        'Пшеница': recommendation('севооборот', 0.6),
+        'Ячмень': recommendation('удобрение', 0.62),
+        'Картофель': recommendation('защита растений', 0.75),
+        'Морковь': recommendation('удобрение', 0.9),
+        'Горох': recommendation('защита растений', 0.6),
+        'Овес': recommendation('удобрение', 0.62),
+    }
+    cached = make_recommender(monkeypatch, outputs, cache_size=16)
+    uncached = make_recommender(monkeypatch, outputs, cache_size=0)
+    results = [update(cached, history(*step)) for step in steps]
+    assert results == [update(uncached, history(*step)) for step in steps]
+    # Повторы состояния поля, в том числе возврат к прежнему, обслужены кэшем
+    assert cached.recommendation_cache.stats()['hits'] >= 1
@@ -0,0 +1,21 @@
+from response_cache import ResponseCache
+
+
+def test_crop_prices_are_not_cached(client):
+    first = client.get('/api/calculator/prices/crops')
+    second = client.get('/api/calculator/prices/crops')
+    assert first.status_code == second.status_code == 200
+    assert 'ETag' not in first.headers
+    assert first.get_json()['last_updated'] != second.get_json()['last_updated']
+
+
+def test_cached_endpoint_sends_etag(client):
+    response = client.get('/api/crops')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert client.get('/api/crops', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_scope_warning_without_shared_backend(tmp_path):
+    assert 'RESPONSE_CACHE_DB' in ResponseCache(ttl=60).scope_warning()
+    assert ResponseCache(ttl=60, shared_path=str(tmp_path / 'cache.db')).scope_warning() is None
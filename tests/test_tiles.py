@@ -0,0 +1,122 @@
+import os
+from tiles import TileCache, clip_geometry, tiles_covering, union_bounds
+
+SQUARE = [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]
+
+
+def polygon(*rings):
+    return {'type': 'Polygon', 'coordinates': list(rings)}
+
+
+def test_clip_inside():
+    assert clip_geometry(polygon(SQUARE), (-1, -1, 11, 11)) == polygon(SQUARE)
+
+
+def test_clip_partial():
+    clipped = clip_geometry(polygon(SQUARE), (5, 5, 20, 20))
+    assert clipped == polygon([[5, 5], [10, 5], [10, 10], [5, 10], [5, 5]])
+
+
+def test_clip_outside():
+    assert clip_geometry(polygon(SQUARE), (20, 20, 30, 30)) is None
+
+
+def test_clip_touching_edge_only():
+    # Общая граница с тайлом - кольцо нулевой площади не отдается
+    assert clip_geometry(polygon(SQUARE), (10, 0, 20, 10)) is None
+    assert clip_geometry(polygon(SQUARE), (10, 10, 20, 20)) is None
+
+
+def test_clip_zero_area_ring():
+    assert clip_geometry(polygon([[0, 0], [1, 0], [2, 0], [0, 0]]), (-1, -1, 5, 5)) is None
+    assert clip_geometry(polygon([[1, 1], [1, 1], [1, 1], [1, 1]]), (0, 0, 5, 5)) is None
+
+
+def test_clip_unclosed_ring():
+    clipped = clip_geometry(polygon(SQUARE[:-1]), (5, 5, 20, 20))
+    assert clipped == polygon([[5, 5], [10, 5], [10, 10], [5, 10], [5, 5]])
+
+
+def test_clip_drops_hole_outside_tile():
+    hole = [[1, 1], [2, 1], [2, 2], [1, 1]]
+    clipped = clip_geometry(polygon(SQUARE, hole), (5, 5, 20, 20))
+    assert clipped == polygon([[5, 5], [10, 5], [10, 10], [5, 10], [5, 5]])
+
+
+def test_clip_multipolygon_keeps_visible_parts():
+    other = [[20, 20], [30, 20], [30, 30], [20, 30], [20, 20]]
+    multipolygon = {'type': 'MultiPolygon', 'coordinates': [[SQUARE], [other]]}
+    assert clip_geometry(multipolygon, (15, 15, 40, 40)) == polygon(other)
+
+
+def test_tile_cache_put_and_get(tmp_path):
+    cache = TileCache(str(tmp_path))
+    cache.put(10, 1, 2, b'tile', cache.generation())
+    assert cache.get(10, 1, 2) == b'tile'
+    assert cache.get(10, 1, 3) is None
+
+
+def test_tile_built_before_invalidation_is_not_cached(tmp_path):
+    # Тайл построен по полям, прочитанным до изменения поля, а записывается после инвалидации
+    cache = TileCache(str(tmp_path))
+    generation = cache.generation()
+    cache.invalidate_bounds((39.7, 47.2, 39.72, 47.22))
+    cache.put(10, 1, 2, b'stale', generation)
+    assert cache.get(10, 1, 2) is None
+    cache.put(10, 1, 2, b'fresh', cache.generation())
+    assert cache.get(10, 1, 2) == b'fresh'
+
+
+def test_invalidation_during_put_removes_tile(tmp_path, monkeypatch):
+    # Инвалидация между проверкой поколения и записью файла
+    cache = TileCache(str(tmp_path))
+    generation = cache.generation()
+    write = cache._write_atomic
+
+    def write_after_invalidation(path, data):
+        if path.endswith('.geojson'):
+            cache.invalidate_bounds(None)
+        write(path, data)
+
+    monkeypatch.setattr(cache, '_write_atomic', write_after_invalidation)
+    cache.put(10, 1, 2, b'stale', generation)
+    assert cache.get(10, 1, 2) is None
+
+
+def test_invalidate_bounds_removes_only_covering_tiles(tmp_path):
+    cache = TileCache(str(tmp_path))
+    bounds = (39.70, 47.20, 39.72, 47.22)
+    generation = cache.generation()
+    # z=2 и z=5 - перебор покрытых тайлов, z=18 (больше MAX_DIRECT_INVALIDATION тайлов) - просмотр каталога
+    inside = [(z, x, y) for z in (2, 5, 18) for x, y in tiles_covering(bounds, z)]
+    outside = [(18, 0, 0), (5, 0, 0), (2, 3, 3)]
+    for tile in inside + outside:
+        cache.put(*tile, b'tile', generation)
+    assert cache.invalidate_bounds(bounds) == len(inside)
+    assert [tile for tile in inside + outside if cache.get(*tile) is not None] == outside
+
+
+def test_invalidate_large_bounds_scans_cached_tiles(tmp_path):
+    cache = TileCache(str(tmp_path))
+    generation = cache.generation()
+    cache.put(18, 158000, 92000, b'a', generation)
+    cache.put(18, 10, 10, b'b', generation)
+    # Покрытие в миллионы тайлов z18 - удаляются только закэшированные
+    assert cache.invalidate_bounds((36.0, 44.0, 40.0, 48.0)) == 1
+    assert cache.get(18, 158000, 92000) is None and cache.get(18, 10, 10) == b'b'
+
+
+def test_clear(tmp_path):
+    cache = TileCache(str(tmp_path))
+    generation = cache.generation()
+    cache.put(3, 1, 1, b'tile', generation)
+    cache.clear()
+    assert cache.get(3, 1, 1) is None
+    cache.put(3, 1, 1, b'stale', generation)
+    assert cache.get(3, 1, 1) is None
+    assert os.path.exists(cache.generation_path)
+
+
+def test_union_bounds():
+    assert union_bounds(None, (1, 2, 3, 4)) == (1, 2, 3, 4)
+    assert union_bounds((1, 2, 3, 4), (0, 3, 2, 5)) == (0, 2, 3, 5)
@@ -0,0 +1,264 @@
+import json
+import math
+import os
+import shutil
+import threading
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+from geometry import get_polygons, simplify_geometry
+from models import Field
+from spatial_index import filter_fields_by_bbox
+
+# Тайлы границ полей в формате GeoJSON (одна FeatureCollection на тайл, схема XYZ / Web Mercator).
+# Полигоны обрезаются по тайлу с запасом TILE_BUFFER (доля тайла), чтобы обводка не давала
+# швов на границах, и упрощаются с допуском в один пиксель тайла.
+TILE_SIZE = 256
+TILE_BUFFER = 1 / 16
+MIN_TILE_ZOOM = 0
+MAX_TILE_ZOOM = 20
+# Выше этого масштаба тайлы не кэшируются на диске (их слишком много, а запрос дешевый)
+MAX_CACHED_ZOOM = 18
+# Если bbox покрывает больше тайлов масштаба, инвалидация просматривает каталог масштаба
+# (закэшированные тайлы), а не перебирает все покрытые тайлы
+MAX_DIRECT_INVALIDATION = 256
+
+Bounds = Tuple[float, float, float, float]
+
+
+def _lon_to_tile_x(lon: float, z: int) -> float:
+    return (lon + 180.0) / 360.0 * (2 ** z)
+
+
+def _lat_to_tile_y(lat: float, z: int) -> float:
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    rad = math.radians(lat)
+    return (1.0 - math.log(math.tan(rad) + 1.0 / math.cos(rad)) / math.pi) / 2.0 * (2 ** z)
+
+
+def _tile_y_to_lat(y: float, z: int) -> float:
+    n = math.pi - 2.0 * math.pi * y / (2 ** z)
+    return math.degrees(math.atan(math.sinh(n)))
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    """Проверка координат тайла"""
+    return MIN_TILE_ZOOM <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z: int, x: int, y: int, buffer: float = 0.0) -> Bounds:
+    """Границы тайла (min_lon, min_lat, max_lon, max_lat), buffer - запас в долях тайла"""
+    n = 2 ** z
+    min_lon = (x - buffer) / n * 360.0 - 180.0
+    max_lon = (x + 1 + buffer) / n * 360.0 - 180.0
+    max_lat = _tile_y_to_lat(max(y - buffer, 0), z)
+    min_lat = _tile_y_to_lat(min(y + 1 + buffer, n), z)
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def tile_range(bounds: Bounds, z: int) -> Tuple[int, int, int, int]:
+    """Диапазон (x0, x1, y0, y1) тайлов масштаба z, пересекающихся с bounds (с учетом буфера обрезки)"""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    n = 2 ** z
+    x0 = max(int(math.floor(_lon_to_tile_x(min_lon, z) - TILE_BUFFER)), 0)
+    x1 = min(int(math.floor(_lon_to_tile_x(max_lon, z) + TILE_BUFFER)), n - 1)
+    y0 = max(int(math.floor(_lat_to_tile_y(max_lat, z) - TILE_BUFFER)), 0)
+    y1 = min(int(math.floor(_lat_to_tile_y(min_lat, z) + TILE_BUFFER)), n - 1)
+    return x0, x1, y0, y1
+
+
+def tiles_covering(bounds: Bounds, z: int) -> Iterable[Tuple[int, int]]:
+    """Тайлы масштаба z, пересекающиеся с bounds (с учетом буфера обрезки)"""
+    x0, x1, y0, y1 = tile_range(bounds, z)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x, y
+
+
+def _clip_ring(ring: List[List[float]], bounds: Bounds) -> List[List[float]]:
+    # Отсечение кольца прямоугольником (Сазерленд-Ходжмен)
+    min_lon, min_lat, max_lon, max_lat = bounds
+    edges = (
+        (lambda p: p[0] >= min_lon, lambda a, b: _intersect_x(a, b, min_lon)),
+        (lambda p: p[0] <= max_lon, lambda a, b: _intersect_x(a, b, max_lon)),
+        (lambda p: p[1] >= min_lat, lambda a, b: _intersect_y(a, b, min_lat)),
+        (lambda p: p[1] <= max_lat, lambda a, b: _intersect_y(a, b, max_lat)),
+    )
+    points = ring[:-1] if len(ring) > 1 and ring[0] == ring[-1] else ring
+    for inside, intersect in edges:
+        if not points:
+            break
+        clipped = []
+        prev = points[-1]
+        for point in points:
+            if inside(point):
+                if not inside(prev):
+                    clipped.append(intersect(prev, point))
+                clipped.append(point)
+            elif inside(prev):
+                clipped.append(intersect(prev, point))
+            prev = point
+        points = clipped
+    # Поле, касающееся тайла только границей, дает кольцо нулевой площади - оно не отдается
+    points = [point for i, point in enumerate(points) if point != points[i - 1]]
+    if len(points) < 3 or _ring_area2(points) == 0:
+        return []
+    return points + [points[0]]
+
+
+def _ring_area2(points: List[List[float]]) -> float:
+    # Удвоенная площадь незамкнутого кольца (формула шнурков)
+    return sum(a[0] * b[1] - b[0] * a[1] for a, b in zip(points, points[1:] + points[:1]))
+
+
+def _intersect_x(a, b, x):
+    t = (x - a[0]) / (b[0] - a[0])
+    return [x, a[1] + t * (b[1] - a[1])]
+
+
+def _intersect_y(a, b, y):
+    t = (y - a[1]) / (b[1] - a[1])
+    return [a[0] + t * (b[0] - a[0]), y]
+
+
+def clip_geometry(geometry, bounds: Bounds) -> Optional[Dict]:
+    """Обрезка Polygon/MultiPolygon по прямоугольнику; None, если ничего не осталось"""
+    polygons = []
+    for polygon in get_polygons(geometry):
+        outer = _clip_ring(polygon[0], bounds)
+        if not outer:
+            continue
+        holes = [clipped for clipped in (_clip_ring(ring, bounds) for ring in polygon[1:]) if clipped]
+        polygons.append([outer] + holes)
+    if not polygons:
+        return None
+    if len(polygons) == 1:
+        return {'type': 'Polygon', 'coordinates': polygons[0]}
+    return {'type': 'MultiPolygon', 'coordinates': polygons}
+
+
+def build_fields_tile(session_query, engine, z: int, x: int, y: int) -> Dict:
+    """FeatureCollection полей, попадающих в тайл (обрезанных и упрощенных)"""
+    bounds = tile_bounds(z, x, y, TILE_BUFFER)
+    tolerance = 360.0 / (TILE_SIZE * 2 ** z)
+    features = []
+    for field in filter_fields_by_bbox(session_query, engine, bounds).order_by(Field.id):
+        try:
+            clipped = clip_geometry(field.geometry, bounds)
+            if clipped is None:
+                continue
+            features.append({
+                'type': 'Feature',
+                'id': field.id,
+                'geometry': simplify_geometry(clipped, tolerance),
+                'properties': {'id': field.id, 'name': field.name, 'area': field.area}
+            })
+        except Exception as e:
+            print(f"Ошибка построения тайла {z}/{x}/{y} для поля {field.id}: {e}")
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def union_bounds(a: Optional[Bounds], b: Optional[Bounds]) -> Optional[Bounds]:
+    """Общий bbox двух bbox (None - пустой)"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+class TileCache:
+    """Кэш тайлов на диске: <cache_dir>/<layer>/<z>/<x>/<y>.geojson.
+    Общий для всех процессов; инвалидация удаляет файлы тайлов, покрывающих bbox поля.
+    Метка поколения (<cache_dir>/<layer>/generation) меняется при каждой инвалидации: тайл,
+    построенный по данным, прочитанным до изменения поля, не остается в кэше"""
+
+    def __init__(self, cache_dir: str, layer: str = 'fields'):
+        self.root = os.path.join(cache_dir, layer)
+        self.generation_path = os.path.join(self.root, 'generation')
+
+    def path(self, z: int, x: int, y: int) -> str:
+        return os.path.join(self.root, str(z), str(x), f"{y}.geojson")
+
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        try:
+            with open(self.path(z, x, y), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def generation(self) -> Optional[str]:
+        """Текущее поколение кэша. Читается до запроса полей тайла и передается в put"""
+        try:
+            with open(self.generation_path, 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _next_generation(self) -> None:
+        self._write_atomic(self.generation_path, uuid.uuid4().hex.encode())
+
+    def put(self, z: int, x: int, y: int, data: bytes, generation: Optional[str]) -> None:
+        """Запись тайла, построенного при поколении generation. Если кэш за это время инвалидирован,
+        тайл не сохраняется: поколение проверяется и до, и после записи, а инвалидация меняет
+        поколение до удаления файлов, поэтому устаревший тайл удаляет одна из сторон"""
+        if z > MAX_CACHED_ZOOM or self.generation() != generation:
+            return
+        path = self.path(z, x, y)
+        self._write_atomic(path, data)
+        if self.generation() != generation:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def invalidate_bounds(self, bounds: Optional[Bounds]) -> int:
+        """Удаление закэшированных тайлов всех масштабов, пересекающихся с bounds
+        (вызывается после фиксации изменений полей)"""
+        self._next_generation()
+        if bounds is None:
+            return 0
+        removed = 0
+        for z in range(MIN_TILE_ZOOM, MAX_CACHED_ZOOM + 1):
+            z_dir = os.path.join(self.root, str(z))
+            if not os.path.isdir(z_dir):
+                continue
+            x0, x1, y0, y1 = tile_range(bounds, z)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) <= MAX_DIRECT_INVALIDATION:
+                paths = (self.path(z, x, y) for x, y in tiles_covering(bounds, z))
+            else:
+                paths = self._cached_paths(z_dir, x0, x1, y0, y1)
+            for path in paths:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    @staticmethod
+    def _cached_paths(z_dir: str, x0: int, x1: int, y0: int, y1: int) -> Iterable[str]:
+        # Закэшированные тайлы масштаба в диапазоне: перебор каталогов, а не всех покрытых тайлов
+        for x_entry in os.scandir(z_dir):
+            if not x_entry.name.isdigit() or not x0 <= int(x_entry.name) <= x1:
+                continue
+            for y_entry in os.scandir(x_entry.path):
+                y, _, ext = y_entry.name.partition('.')
+                if ext == 'geojson' and y.isdigit() and y0 <= int(y) <= y1:
+                    yield y_entry.path
+
+    def clear(self) -> None:
+        self._next_generation()
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def encode_tile(tile: Dict) -> bytes:
+    return json.dumps(tile, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
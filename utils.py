@@ -1,6 +1,8 @@
 from flask import Flask
 from config import get_database_url, db, init_app_db
 from models import Field, Crop, CropHistory
+from price_history import backfill_price_observations
+from response_cache import response_cache
 
 def ensure_database_exists(db_url: str):
 	pass
@@ -46,6 +48,9 @@ def seed_initial_crops():
 	for crop in initial_crops:
 		db.session.add(crop)
 	db.session.commit()
+	# Начальные цены - первые наблюдения в истории цен
+	backfill_price_observations()
+	response_cache.invalidate('crops')
 	print(f"[OK] Добавлено {len(initial_crops)} культур")
 
 
@@ -64,6 +69,30 @@ def init_database():
 		print("[SUCCESS] Таблицы созданы, данные загружены")
 
 
+def migrate_database():
+	# Миграции схемы отдельным шагом (перед запуском воркеров с AUTO_MIGRATE=0)
+	from migrations import run_migrations
+	app = Flask(__name__)
+	app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+	init_app_db(app)
+	
+	with app.app_context():
+		run_migrations()
+		seed_initial_crops()
+		print("[SUCCESS] Миграции выполнены")
+
+
+def build_model_artifact(force: bool = False):
+	# Офлайн-обучение рекомендательной модели и сохранение артефакта для воркеров
+	from neural_network_recommender import recommender
+	if not force and recommender.load_model():
+		print(f"[OK] Модель актуальна: {recommender.model_path}")
+		return
+	recommender.train()
+	path = recommender.save_model()
+	print(f"[SUCCESS] Модель сохранена: {path}")
+
+
 def check_database():
 	# Проверка состояния бд
 	app = Flask(__name__)
@@ -82,6 +111,10 @@ if __name__ == "__main__":
 	import sys
 	if len(sys.argv) > 1 and sys.argv[1] == 'check':
 		check_database()
+	elif len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+		migrate_database()
+	elif len(sys.argv) > 1 and sys.argv[1] == 'build-model':
+		build_model_artifact(force='--force' in sys.argv)
 	else:
 		init_database()
 